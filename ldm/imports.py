@@ -0,0 +1,95 @@
+"""
+Deferred imports for the command line entry points.
+Only the standard library is imported here, so an entry point that imports its heavy dependencies through
+lazy_import answers --help, and reports argument errors, before torch and friends are loaded. profile_imports
+times every import that follows it and prints the cumulative seconds spent per top level package on exit.
+"""
+
+import atexit
+import builtins
+import sys
+import time
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access.
+    Usage:
+        torch = lazy_import("torch")
+        torch.zeros(3)  # torch is imported here
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            # through __import__, so profile_imports sees it
+            __import__(self._name)
+            self.__dict__["_module"] = sys.modules[self._name]
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r}, {state}>"
+
+
+def lazy_import(name):
+    """
+    Returns:
+        the module if it is already imported, otherwise a LazyModule that imports it when first used
+    """
+    return sys.modules[name] if name in sys.modules else LazyModule(name)
+
+
+def profile_imports(argv=None, flag="--import-profile", top=25):
+    """
+    If flag is in argv, removes it and times every import from here on, then prints the cumulative seconds of
+    the top packages when the process exits. Call it before any other import of the entry point.
+    Args:
+        argv: list of str the arguments to look for flag in, sys.argv by default
+        flag: str the switch that turns profiling on
+        top: int how many packages to print
+    Returns:
+        bool whether imports are being profiled
+    """
+    argv = sys.argv if argv is None else argv
+    if flag not in argv:
+        return False
+    argv.remove(flag)
+    original_import = builtins.__import__
+    start = time.perf_counter()
+    totals = {}
+    stack = []
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        package = name.split(".")[0]
+        # only the outermost import of a package counts, the imports it triggers are part of its time
+        outermost = package not in stack
+        stack.append(package)
+        began = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            stack.pop()
+            if outermost:
+                totals[package] = totals.get(package, 0.0) + time.perf_counter() - began
+
+    def report():
+        builtins.__import__ = original_import
+        print(f"Imports, cumulative seconds per package, {time.perf_counter() - start:.2f}s since profiling began:")
+        for package, seconds in sorted(totals.items(), key=lambda item: -item[1])[:top]:
+            print(f"  {package:<32} {seconds:8.3f}")
+
+    builtins.__import__ = timed_import
+    atexit.register(report)
+    return True
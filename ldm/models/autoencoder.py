@@ -27,20 +27,22 @@ class VQModel(pl.LightningModule):
                  lr_g_factor=1.0,
                  remap=None,
                  sane_index_shape=False, # tell vector quantizer to return indices as bhw
-                 use_ema=False
+                 use_ema=False,
+                 with_encoder=True,  # inference that only decodes latents can skip building the encoder
+                 with_decoder=True,
                  ):
         super().__init__()
         self.embed_dim = embed_dim
         self.n_embed = n_embed
         self.image_key = image_key
-        self.encoder = Encoder(**ddconfig)
-        self.decoder = Decoder(**ddconfig)
+        self.encoder = Encoder(**ddconfig) if with_encoder else None
+        self.decoder = Decoder(**ddconfig) if with_decoder else None
         self.loss = instantiate_from_config(lossconfig)
         self.quantize = VectorQuantizer(n_embed, embed_dim, beta=0.25,
                                         remap=remap,
                                         sane_index_shape=sane_index_shape)
-        self.quant_conv = torch.nn.Conv2d(ddconfig["z_channels"], embed_dim, 1)
-        self.post_quant_conv = torch.nn.Conv2d(embed_dim, ddconfig["z_channels"], 1)
+        self.quant_conv = torch.nn.Conv2d(ddconfig["z_channels"], embed_dim, 1) if with_encoder else None
+        self.post_quant_conv = torch.nn.Conv2d(embed_dim, ddconfig["z_channels"], 1) if with_decoder else None
         if colorize_nlabels is not None:
             assert type(colorize_nlabels)==int
             self.register_buffer("colorize", torch.randn(3, colorize_nlabels, 1, 1))
@@ -94,17 +96,20 @@ class VQModel(pl.LightningModule):
             self.model_ema(self)
 
     def encode(self, x):
+        assert self.encoder is not None, "the model was built without its encoder"
         h = self.encoder(x)
         h = self.quant_conv(h)
         quant, emb_loss, info = self.quantize(h)
         return quant, emb_loss, info
 
     def encode_to_prequant(self, x):
+        assert self.encoder is not None, "the model was built without its encoder"
         h = self.encoder(x)
         h = self.quant_conv(h)
         return h
 
     def decode(self, quant):
+        assert self.decoder is not None, "the model was built without its decoder"
         quant = self.post_quant_conv(quant)
         dec = self.decoder(quant)
         return dec
@@ -267,6 +272,7 @@ class VQModelInterface(VQModel):
         self.embed_dim = embed_dim
 
     def encode(self, x):
+        assert self.encoder is not None, "the model was built without its encoder"
         h = self.encoder(x)
         h = self.quant_conv(h)
         return h
@@ -277,6 +283,7 @@ class VQModelInterface(VQModel):
             quant, emb_loss, info = self.quantize(h)
         else:
             quant = h
+        assert self.decoder is not None, "the model was built without its decoder"
         quant = self.post_quant_conv(quant)
         dec = self.decoder(quant)
         return dec
@@ -292,15 +299,17 @@ class AutoencoderKL(pl.LightningModule):
                  image_key="image",
                  colorize_nlabels=None,
                  monitor=None,
+                 with_encoder=True,  # inference that only decodes latents can skip building the encoder
+                 with_decoder=True,
                  ):
         super().__init__()
         self.image_key = image_key
-        self.encoder = Encoder(**ddconfig)
-        self.decoder = Decoder(**ddconfig)
+        self.encoder = Encoder(**ddconfig) if with_encoder else None
+        self.decoder = Decoder(**ddconfig) if with_decoder else None
         self.loss = instantiate_from_config(lossconfig)
         assert ddconfig["double_z"]
-        self.quant_conv = torch.nn.Conv2d(2*ddconfig["z_channels"], 2*embed_dim, 1)
-        self.post_quant_conv = torch.nn.Conv2d(embed_dim, ddconfig["z_channels"], 1)
+        self.quant_conv = torch.nn.Conv2d(2*ddconfig["z_channels"], 2*embed_dim, 1) if with_encoder else None
+        self.post_quant_conv = torch.nn.Conv2d(embed_dim, ddconfig["z_channels"], 1) if with_decoder else None
         self.embed_dim = embed_dim
         if colorize_nlabels is not None:
             assert type(colorize_nlabels)==int
@@ -322,12 +331,14 @@ class AutoencoderKL(pl.LightningModule):
         print(f"Restored from {path}")
 
     def encode(self, x):
+        assert self.encoder is not None, "the model was built without its encoder"
         h = self.encoder(x)
         moments = self.quant_conv(h)
         posterior = DiagonalGaussianDistribution(moments)
         return posterior
 
     def decode(self, z):
+        assert self.decoder is not None, "the model was built without its decoder"
         z = self.post_quant_conv(z)
         dec = self.decoder(z)
         return dec
@@ -0,0 +1,255 @@
+"""SAMPLING ONLY."""
+
+import itertools
+
+import torch
+import numpy as np
+
+from ldm.modules.diffusionmodules.util import make_ddim_sampling_parameters, make_ddim_timesteps
+
+
+class SamplingRequest(object):
+    """
+    One sample being denoised by a ContinuousDDIMSampler. It carries everything the sampler needs to take
+    its next step, so it can join or leave the running batch between any two UNet evaluations.
+    Requests with a lower priority are more urgent.
+    """
+
+    def __init__(self, x, cond, uncond, schedule, t_start, scale=1.0, generator=None, callback=None, priority=0):
+        self.x = x
+        self.cond = cond
+        self.uncond = uncond
+        self.schedule = schedule
+        self.scale = scale
+        self.generator = generator
+        self.callback = callback
+        self.priority = priority
+        self.preemptions = 0
+        self.order = None
+        # the schedule is walked from t_start - 1 down to 0, like DDIMSampler.decode
+        self.index = t_start - 1
+        self.steps = t_start
+
+    @property
+    def finished(self):
+        return self.index < 0
+
+    @property
+    def guided(self):
+        return self.uncond is not None and self.scale != 1.0
+
+    def compatible(self, other):
+        return self.x.shape == other.x.shape and self.cond.shape == other.cond.shape
+
+    def rank(self):
+        # the most urgent, then the oldest, request sorts first
+        return self.priority, self.order
+
+
+class ContinuousDDIMSampler(object):
+    """
+    DDIM sampling over a rolling batch. Every request keeps its own timestep index, schedule, guidance scale and
+    conditioning, so requests with different step counts, eta or scale share one UNet evaluation per step.
+    Requests are admitted and retired between steps, and a new request never waits for a whole batch to finish.
+    Pending requests are admitted most urgent first. With preempt set, a more urgent request that finds the batch
+    full, or running samples of another size, takes the place of the least urgent ones at the next step boundary.
+    A preempted request keeps its latent, moved off the device, and its step index, and carries on from there
+    once it is admitted again.
+    Usage:
+        sampler = ContinuousDDIMSampler(model, max_batch=8)
+        sampler.submit(sampler.request(x_T, c, uc, steps=50, scale=7.5, callback=on_done))
+        while not sampler.idle:
+            sampler.step()
+    """
+
+    def __init__(self, model, max_batch=8, ddim_discretize="uniform", preempt=True):
+        self.model = model
+        self.max_batch = max_batch
+        self.preempt = preempt
+        self.ddim_discretize = ddim_discretize
+        self.alphas_cumprod = model.alphas_cumprod.detach().cpu().numpy().astype(np.float64)
+        self.schedules = {}
+        self.active = []
+        self.pending = []
+        self.submitted = itertools.count()
+
+    def __len__(self):
+        return len(self.active) + len(self.pending)
+
+    @property
+    def idle(self):
+        return not self.active and not self.pending
+
+    def schedule(self, steps, eta):
+        """
+        The DDIM timesteps and sampling parameters for steps and eta, as numpy arrays indexed by step.
+        """
+        key = (steps, float(eta))
+        if key not in self.schedules:
+            timesteps = make_ddim_timesteps(
+                ddim_discr_method=self.ddim_discretize, num_ddim_timesteps=steps,
+                num_ddpm_timesteps=self.alphas_cumprod.shape[0], verbose=False,
+            )
+            sigmas, alphas, alphas_prev = make_ddim_sampling_parameters(
+                alphacums=self.alphas_cumprod, ddim_timesteps=timesteps, eta=eta, verbose=False
+            )
+            self.schedules[key] = dict(
+                timesteps=timesteps, alphas=alphas, alphas_prev=alphas_prev, sigmas=sigmas,
+                sqrt_one_minus_alphas=np.sqrt(1. - alphas),
+            )
+        return self.schedules[key]
+
+    def request(self, x_T, cond, uncond=None, steps=50, scale=1.0, eta=0., x0=None, strength=None, seed=None,
+                callback=None, priority=0):
+        """
+        Builds a request for one sample.
+        Args:
+            x_T: the starting noise, [C, H, W]
+            cond: the conditioning of this sample alone, without a batch dimension
+            uncond: the unconditional conditioning, or None to sample without guidance
+            x0: a latent to refine like img2img, noised to strength of the schedule with x_T
+            seed: seeds the noise added at each step when eta > 0
+            callback: called with the request once its sample is finished
+            priority: int lower is more urgent
+        Returns:
+            SamplingRequest, not yet submitted
+        """
+        schedule = self.schedule(steps, eta)
+        # make_ddim_timesteps can return more timesteps than steps, e.g. 31 for 30, and DDIMSampler walks them all
+        length = len(schedule["timesteps"])
+        t_start = length
+        x = x_T
+        if x0 is not None:
+            assert 0. < strength <= 1., "can only work with strength in (0.0, 1.0]"
+            t_start = max(1, int(strength * steps))
+            # DDIMSampler.stochastic_encode noises to index t_enc, which is one past the end at strength 1
+            t_enc = min(t_start, length - 1)
+            x = (float(np.sqrt(schedule["alphas"][t_enc])) * x0.to(x_T.dtype)
+                 + float(schedule["sqrt_one_minus_alphas"][t_enc]) * x_T)
+        generator = torch.Generator().manual_seed(seed) if seed is not None and eta > 0 else None
+        return SamplingRequest(x, cond, uncond, schedule, t_start, scale=scale, generator=generator,
+                               callback=callback, priority=priority)
+
+    def submit(self, request):
+        request.order = next(self.submitted)
+        self.pending.append(request)
+        self.pending.sort(key=SamplingRequest.rank)
+        return request
+
+    def least_urgent(self):
+        """
+        The priority of the least urgent running request, or None if the batch has room for more.
+        """
+        if len(self.active) < self.max_batch:
+            return None
+        return max(request.priority for request in self.active)
+
+    def clear(self):
+        """
+        Drops every running and pending request.
+        Returns:
+            list of SamplingRequest that were dropped
+        """
+        dropped = self.active + self.pending
+        self.active, self.pending = [], []
+        return dropped
+
+    def admit(self):
+        """
+        Moves pending requests into the running batch, most urgent first, while there is room, preempting less
+        urgent running requests to make room if preempt is set. A request whose latent shape differs from the
+        running batch waits, and holds back the ones behind it, until the batch drains.
+        Returns:
+            list of SamplingRequest preempted
+        """
+        preempted = []
+        while self.pending:
+            head = self.pending[0]
+            if self.active and not head.compatible(self.active[0]):
+                if not (self.preempt and all(request.priority > head.priority for request in self.active)):
+                    break
+                victims = list(self.active)
+            elif len(self.active) >= self.max_batch:
+                victim = max(self.active, key=SamplingRequest.rank)
+                if not (self.preempt and victim.priority > head.priority):
+                    break
+                victims = [victim]
+            else:
+                self.active.append(self.pending.pop(0))
+                continue
+            for victim in victims:
+                self.active.remove(victim)
+                victim.x = victim.x.cpu()
+                victim.preemptions += 1
+                preempted.append(victim)
+            self.pending.extend(victims)
+            self.pending.sort(key=SamplingRequest.rank)
+        return preempted
+
+    @torch.no_grad()
+    def step(self):
+        """
+        Admits pending requests, takes one DDIM step for every running request in a single UNet evaluation,
+        and retires the requests that reached the end of their schedule.
+        Returns:
+            list of SamplingRequest that finished in this step
+        """
+        self.admit()
+        if not self.active:
+            return []
+        active = self.active
+        device = self.model.device
+        x = torch.stack([request.x for request in active]).to(device)
+        cond = torch.stack([request.cond for request in active]).to(device)
+        t = torch.tensor(
+            [request.schedule["timesteps"][request.index] for request in active], device=device, dtype=torch.long
+        )
+
+        # only the guided samples are evaluated a second time without conditioning
+        guided = [row for row, request in enumerate(active) if request.guided]
+        if guided:
+            x_in = torch.cat([x, x[guided]])
+            t_in = torch.cat([t, t[guided]])
+            c_in = torch.cat([cond, torch.stack([active[row].uncond for row in guided]).to(device)])
+            e_out = self.model.apply_model(x_in, t_in, c_in)
+            e_t, e_t_uncond = e_out[:len(active)], e_out[len(active):]
+            scale = torch.tensor(
+                [active[row].scale for row in guided], device=device, dtype=e_t.dtype
+            ).view(-1, 1, 1, 1)
+            e_t = e_t.clone()
+            e_t[guided] = e_t_uncond + scale * (e_t[guided] - e_t_uncond)
+        else:
+            e_t = self.model.apply_model(x, t, cond)
+
+        def gather(name):
+            values = [request.schedule[name][request.index] for request in active]
+            return torch.tensor(values, device=device, dtype=torch.float32).view(-1, 1, 1, 1)
+
+        a_t, a_prev, sigma_t = gather("alphas"), gather("alphas_prev"), gather("sigmas")
+        sqrt_one_minus_at = gather("sqrt_one_minus_alphas")
+        e_t = e_t.float()
+        x = x.float()
+
+        # the DDIM update of p_sample_ddim, with every schedule value per sample
+        pred_x0 = (x - sqrt_one_minus_at * e_t) / a_t.sqrt()
+        dir_xt = (1. - a_prev - sigma_t ** 2).sqrt() * e_t
+        x_prev = a_prev.sqrt() * pred_x0 + dir_xt
+        if bool((sigma_t > 0).any()):
+            noise = torch.stack([
+                torch.randn(request.x.shape, generator=request.generator) if request.generator is not None
+                else torch.randn(request.x.shape)
+                for request in active
+            ]).to(device)
+            x_prev = x_prev + sigma_t * noise
+
+        finished = []
+        for request, sample in zip(active, x_prev):
+            request.x = sample
+            request.index -= 1
+            if request.finished:
+                finished.append(request)
+        self.active = [request for request in active if not request.finished]
+        for request in finished:
+            if request.callback is not None:
+                request.callback(request)
+        return finished
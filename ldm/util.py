@@ -1,8 +1,14 @@
+import copy
 import importlib
+import json
+import os
+import struct
+import time
 
 import torch
 import numpy as np
 from collections import abc
+from contextlib import contextmanager
 from einops import rearrange
 from functools import partial
 
@@ -85,6 +91,308 @@ def instantiate_from_config(config):
     return get_obj_from_str(config["target"])(**config.get("params", dict()))
 
 
+# the torch.nn.init functions module constructors call to randomly initialize their weights
+INIT_FUNCTIONS = (
+    "uniform_", "normal_", "trunc_normal_", "constant_", "ones_", "zeros_", "eye_", "dirac_",
+    "xavier_uniform_", "xavier_normal_", "kaiming_uniform_", "kaiming_normal_", "orthogonal_", "sparse_",
+)
+
+
+@contextmanager
+def skip_init():
+    """
+    Builds modules without randomly initializing their weights, for models whose weights are all about to be
+    loaded from a checkpoint. The weights are left as allocated but never written, so the OS does not commit
+    their pages before the checkpoint's tensors take their place.
+    """
+    saved = {name: getattr(torch.nn.init, name) for name in INIT_FUNCTIONS if hasattr(torch.nn.init, name)}
+    try:
+        for name in saved:
+            setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+        yield
+    finally:
+        for name, function in saved.items():
+            setattr(torch.nn.init, name, function)
+
+
+def assign_state_dict(model, state_dict):
+    """
+    Loads state_dict into model like load_state_dict(strict=False), but puts the checkpoint's tensors in place
+    of the model's instead of copying them over, so loading needs no second copy of the weights. A tensor is
+    only copied when it has to be cast to the dtype of the model's.
+    Returns:
+        tuple: the missing and the unexpected keys
+    """
+    expected = model.state_dict(keep_vars=True)
+    modules = dict(model.named_modules())
+    missing = [key for key in expected if key not in state_dict]
+    unexpected = []
+    for key, tensor in state_dict.items():
+        if key not in expected:
+            unexpected.append(key)
+            continue
+        current = expected[key]
+        if current.shape != tensor.shape:
+            raise RuntimeError(
+                f"size mismatch for {key}: copying a param with shape {tuple(tensor.shape)} from checkpoint, "
+                f"the shape in current model is {tuple(current.shape)}."
+            )
+        module_name, _, name = key.rpartition(".")
+        module = modules[module_name]
+        tensor = tensor.to(current.dtype)
+        if name in module._parameters:
+            module._parameters[name] = torch.nn.Parameter(tensor, requires_grad=current.requires_grad)
+        else:
+            module._buffers[name] = tensor
+    return missing, unexpected
+
+
+# the safetensors dtype codes of the tensor types a slim checkpoint holds, bfloat16 is stored as raw 16 bit words
+SLIM_DTYPES = {
+    "F64": (torch.float64, np.float64),
+    "F32": (torch.float32, np.float32),
+    "F16": (torch.float16, np.float16),
+    "BF16": (torch.bfloat16, np.int16),
+    "I64": (torch.int64, np.int64),
+    "I32": (torch.int32, np.int32),
+    "I16": (torch.int16, np.int16),
+    "I8": (torch.int8, np.int8),
+    "U8": (torch.uint8, np.uint8),
+    "BOOL": (torch.bool, np.bool_),
+}
+
+
+def save_slim_checkpoint(state_dict, path, metadata=None):
+    """
+    Writes state_dict as one flat, uncompressed buffer behind a json header, in the safetensors layout, so it can
+    be memory mapped by load_slim_checkpoint instead of unpickled. Tensors are written widest type first so every
+    tensor starts aligned to its own element size.
+    Args:
+        state_dict: dict of name to tensor
+        path: str the file to write
+        metadata: dict of str to str stored in the header
+    Returns:
+        None
+    """
+    codes = {dtype: code for code, (dtype, _) in SLIM_DTYPES.items()}
+    tensors = sorted(state_dict.items(), key=lambda item: (-item[1].element_size(), item[0]))
+    header, offset = {}, 0
+    for name, tensor in tensors:
+        if tensor.dtype not in codes:
+            raise TypeError(f"{name} has dtype {tensor.dtype}, which a slim checkpoint cannot hold")
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {
+            "dtype": codes[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + size],
+        }
+        offset += size
+    if metadata:
+        header["__metadata__"] = {str(key): str(value) for key, value in metadata.items()}
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # the tensor data starts 8 byte aligned
+    header += b" " * (-len(header) % 8)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as slim:
+        slim.write(struct.pack("<Q", len(header)))
+        slim.write(header)
+        for name, tensor in tensors:
+            tensor = tensor.detach().cpu().contiguous()
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            slim.write(tensor.numpy().tobytes())
+    os.replace(temporary, path)
+
+
+def load_slim_checkpoint(path):
+    """
+    Opens a checkpoint written by save_slim_checkpoint without reading it. Every tensor is a copy on write view of
+    the memory mapped file, so its pages are only read from disk when the tensor is first used, and are shared
+    by every process that maps the same file until one writes to them.
+    Returns:
+        tuple: the state dict and the metadata dict
+    """
+    with open(path, "rb") as slim:
+        length = struct.unpack("<Q", slim.read(8))[0]
+        header = json.loads(slim.read(length))
+    metadata = header.pop("__metadata__", {})
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + length)
+    state_dict = {}
+    for name, info in header.items():
+        dtype, np_dtype = SLIM_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        tensor = torch.from_numpy(data[start:end].view(np_dtype).reshape(info["shape"]))
+        state_dict[name] = tensor.view(dtype) if dtype == torch.bfloat16 else tensor
+    return state_dict, metadata
+
+
+def bake_ema_state_dict(state_dict):
+    """
+    Replaces every weight of the diffusion model that has an EMA copy in state_dict with that copy, and drops the
+    EMA copies. LitEma keeps the copy of model.<name> as the buffer model_ema.<name without dots>.
+    Returns:
+        int how many weights were replaced
+    """
+    baked = 0
+    for key in list(state_dict):
+        if not key.startswith("model."):
+            continue
+        ema_key = "model_ema." + key[len("model."):].replace(".", "")
+        if ema_key in state_dict:
+            state_dict[key] = state_dict[ema_key]
+            baked += 1
+    for key in [key for key in state_dict if key.startswith("model_ema.")]:
+        del state_dict[key]
+    return baked
+
+
+def uses_ema(config):
+    """
+    Whether the model config builds a diffusion model that keeps EMA weights.
+    """
+    from ldm.models.diffusion.ddpm import DDPM
+
+    cls = get_obj_from_str(config["target"])
+    return issubclass(cls, DDPM) and config.get("params", dict()).get("use_ema", True)
+
+
+# the parts of a latent diffusion model an inference entry point can choose to build
+COMPONENTS = ("unet", "cond_stage", "encoder", "decoder")
+
+
+def select_components(model_config, components):
+    """
+    Rewrites a latent diffusion model config to build only the components listed, and no training losses.
+    A conditional model built without its cond stage gets an identity in its place, so it keeps its
+    conditioning_key and get_learned_conditioning passes conditioning through unchanged.
+    Args:
+        model_config: the config of the model, config.model
+        components: iterable of COMPONENTS, the unet is always built
+    Returns:
+        a copy of model_config
+    """
+    components = set(components)
+    unknown = components - set(COMPONENTS)
+    if unknown:
+        raise ValueError(f"Unknown components {sorted(unknown)}, expected some of {COMPONENTS}")
+    model_config = copy.deepcopy(model_config)
+    params = model_config.get("params", dict())
+    first_stage = params.get("first_stage_config")
+    if first_stage is None:
+        return model_config
+    cond_stage = params.get("cond_stage_config")
+    if cond_stage == "__is_first_stage__":
+        # the first stage encodes the conditioning
+        components.add("encoder")
+    elif "cond_stage" not in components and cond_stage != "__is_unconditional__":
+        # a conditional model stays conditional, the caller passes the conditioning itself, already encoded
+        params["cond_stage_config"] = {"target": "torch.nn.Identity"}
+    first_stage["params"] = {
+        **first_stage.get("params", dict()),
+        "lossconfig": {"target": "torch.nn.Identity"},
+        "with_encoder": "encoder" in components,
+        "with_decoder": "decoder" in components,
+    }
+    return model_config
+
+
+def read_checkpoint(ckpt):
+    """
+    Reads a Lightning checkpoint onto the cpu, or memory maps a slim one written by scripts/convert_checkpoint.py.
+    Returns:
+        tuple: its state dict and its global step, None if it has none
+    """
+    if ckpt.endswith(".safetensors"):
+        sd, metadata = load_slim_checkpoint(ckpt)
+        global_step = int(metadata["global_step"]) if metadata.get("global_step") else None
+        if global_step is not None:
+            print(f"Global Step: {global_step}")
+        return sd, global_step
+    pl_sd = torch.load(ckpt, map_location="cpu")
+    global_step = pl_sd.get("global_step")
+    if global_step is not None:
+        print(f"Global Step: {global_step}")
+    return pl_sd.get("state_dict", pl_sd), global_step
+
+
+def load_model_from_config(
+    config, ckpt, verbose=False, device=None, timings=None, bake_ema=True, components=None, state_dict=None
+):
+    """
+    Builds the model in config without random initialization and loads the weights of checkpoint ckpt into it
+    in place, then prints how long each phase took.
+    Args:
+        config: the OmegaConf config, with the model under config.model
+        ckpt: str the checkpoint path
+        verbose: bool print the missing and unexpected keys
+        device: the device to move the model to, or None to leave it on the cpu
+        timings: dict the seconds each phase took are stored in, if passed
+        bake_ema: bool load the checkpoint's EMA weights as the model's own, and build the model without EMA
+            weights, so ema_scope is a no-op and one copy of the weights is resident
+        components: iterable of COMPONENTS to build, or None to build the whole model. The checkpoint's weights
+            of the components left out are never loaded into the model
+        state_dict: the checkpoint's state dict if the caller already read it with read_checkpoint, e.g. for its
+            global step, ckpt is then only named in messages. Its tensors are moved into the model
+    Returns:
+        the model, in eval mode
+    """
+    timings = {} if timings is None else timings
+    print(f"Loading model from {ckpt}")
+    mark = time.perf_counter()
+
+    def lap(phase):
+        nonlocal mark
+        now = time.perf_counter()
+        timings[phase] = now - mark
+        mark = now
+
+    sd = read_checkpoint(ckpt)[0] if state_dict is None else state_dict
+    model_config = config.model
+    if bake_ema and uses_ema(model_config):
+        baked = bake_ema_state_dict(sd)
+        if baked:
+            print(f"Baked {baked} EMA weights into the model")
+        model_config = copy.deepcopy(model_config)
+        model_config["params"] = {**model_config.get("params", dict()), "use_ema": False}
+    if components is not None:
+        model_config = select_components(model_config, components)
+    lap("read")
+    with skip_init():
+        model = instantiate_from_config(model_config)
+    lap("build")
+    m, u = assign_state_dict(model, sd)
+    if components is not None:
+        # the weights of the components left out are expected to be unused
+        print(f"Built {', '.join(sorted(components))}, skipped {len(u)} checkpoint weights")
+    if getattr(model, "use_ema", False) and not any(key.startswith("model_ema.") for key in sd):
+        # a slim checkpoint has its EMA weights baked in, there is nothing to swap in
+        print("The checkpoint has no EMA weights, using its weights as they are")
+        model.use_ema = False
+        del model.model_ema
+        m = [key for key in m if not key.startswith("model_ema.")]
+    del sd
+    lap("assign")
+    if len(m) > 0 and verbose:
+        print("missing keys:")
+        print(m)
+    if len(u) > 0 and verbose:
+        print("unexpected keys:")
+        print(u)
+    parameters = dict(model.named_parameters())
+    uninitialized = [key for key in m if key in parameters]
+    if len(uninitialized) > 0:
+        # initialization was skipped, so these weights hold whatever their memory held
+        print(f"{len(uninitialized)} parameters are missing from {ckpt} and were left uninitialized:")
+        print(uninitialized)
+    if device is not None:
+        model.to(device)
+    model.eval()
+    lap("device")
+    print(
+        f"Loaded model in {sum(timings[phase] for phase in ('read', 'build', 'assign', 'device')):.2f}s "
+        + ", ".join(f"{phase} {timings[phase]:.2f}s" for phase in ("read", "build", "assign", "device"))
+    )
+    return model
+
+
 def get_obj_from_str(string, reload=False):
     module, cls = string.rsplit(".", 1)
     if reload:
@@ -160,7 +468,6 @@ def parallel_data_prefetch(
 
     # start processes
     print(f"Start prefetching...")
-    import time
 
     start = time.time()
     gather_res = [[] for _ in range(n_proc)]
@@ -1,5 +1,5 @@
 from torchvision.datasets.utils import download_url
-from ldm.util import instantiate_from_config
+from ldm.util import load_model_from_config as load_ldm_model, read_checkpoint
 import torch
 import os
 # todo ?
@@ -38,14 +38,8 @@ def download_models(mode):
 
 
 def load_model_from_config(config, ckpt):
-    print(f"Loading model from {ckpt}")
-    pl_sd = torch.load(ckpt, map_location="cpu")
-    global_step = pl_sd["global_step"]
-    sd = pl_sd["state_dict"]
-    model = instantiate_from_config(config.model)
-    m, u = model.load_state_dict(sd, strict=False)
-    model.cuda()
-    model.eval()
+    sd, global_step = read_checkpoint(ckpt)
+    model = load_ldm_model(config, ckpt, device=torch.device("cuda"), state_dict=sd)
     return {"model": model}, global_step
 
 
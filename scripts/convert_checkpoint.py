@@ -0,0 +1,89 @@
+"""
+Converts a Lightning training checkpoint into a slim inference checkpoint.
+Only the model's state dict is kept: the optimizer and scheduler states, the callbacks and the loss module's weights
+are dropped, the EMA weights are baked into the model's own and their copies dropped, and the weights can be cast
+to fp16 or bf16. The result is written as one flat buffer that the loaders in ldm/util.py memory map instead of
+unpickling, so cold starts are bound by I/O and processes loading the same file share its pages.
+
+Usage:
+    python scripts/convert_checkpoint.py --ckpt models/ldm/stable-diffusion-v1/model.ckpt --dtype fp16
+    python scripts/txt2img.py --ckpt models/ldm/stable-diffusion-v1/model.safetensors --prompt "a lighthouse"
+"""
+
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from ldm.util import bake_ema_state_dict, save_slim_checkpoint
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+# state dict prefixes only training uses
+TRAINING_PREFIXES = ("model_ema.", "loss.", "first_stage_model.loss.")
+
+
+def slim_state_dict(pl_sd, dtype=None, ema=True):
+    """
+    Reduces a Lightning checkpoint to the weights inference needs.
+    Args:
+        pl_sd: dict the loaded checkpoint
+        dtype: torch.dtype floating point weights are cast to, or None to keep theirs
+        ema: bool bake the EMA weights in, if the checkpoint has them
+    Returns:
+        tuple: the state dict and the metadata to store with it
+    """
+    state_dict = dict(pl_sd.get("state_dict", pl_sd))
+    baked = bake_ema_state_dict(state_dict) if ema else 0
+    state_dict = {
+        key: tensor for key, tensor in state_dict.items()
+        if not key.startswith(TRAINING_PREFIXES) and isinstance(tensor, torch.Tensor)
+    }
+    if dtype is not None:
+        state_dict = {
+            key: tensor.to(dtype) if tensor.is_floating_point() else tensor for key, tensor in state_dict.items()
+        }
+    metadata = {"format": "ldm-slim", "ema": "baked" if baked else "none"}
+    if pl_sd.get("global_step") is not None:
+        metadata["global_step"] = pl_sd["global_step"]
+    if dtype is not None:
+        metadata["dtype"] = str(dtype).split(".")[-1]
+    return state_dict, metadata
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Convert a training checkpoint into a slim inference checkpoint")
+    parser.add_argument("--ckpt", type=str, required=True, help="the Lightning checkpoint to convert")
+    parser.add_argument(
+        "--out",
+        type=str,
+        help="the slim checkpoint to write, defaults to the checkpoint's path with a .safetensors extension",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        choices=list(DTYPES),
+        help="store floating point weights at this precision, by default they keep the checkpoint's",
+    )
+    parser.add_argument("--no_ema", action="store_true", help="keep the raw weights instead of baking the EMA in")
+    return parser
+
+
+def main():
+    opt = get_parser().parse_args()
+    out = opt.out or os.path.splitext(opt.ckpt)[0] + ".safetensors"
+    print(f"Reading {opt.ckpt}")
+    pl_sd = torch.load(opt.ckpt, map_location="cpu")
+    state_dict, metadata = slim_state_dict(
+        pl_sd, dtype=DTYPES.get(opt.dtype), ema=not opt.no_ema
+    )
+    del pl_sd
+    save_slim_checkpoint(state_dict, out, metadata)
+    size = os.path.getsize(out)
+    print(f"Wrote {len(state_dict)} tensors, {size / 2 ** 30:.2f} GiB, EMA {metadata['ema']}, to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,666 @@
+"""
+A long running local generation service.
+The model is loaded once and kept warm. txt2img and img2img jobs are queued over HTTP, on localhost or a Unix socket,
+and compatible jobs (same kind, size, steps, eta, guidance scale and strength) that arrive close together are
+rendered in one shared sampling batch. With --continuous, jobs of any options join and leave one rolling DDIM
+batch between sampling steps instead. Job priorities always order the queue, but only with --continuous does a
+more urgent job preempt the running ones, a lock-step batch always runs to the end. Jobs are answered
+asynchronously: submitting returns a job id, and the job is polled, or waited on, until its image is ready.
+Images are only ever saved in the server's --outdir. An img2img job uploads its init image as base64 in
+init_image_data, or names a file under the server's --input_root in init_image.
+
+Usage:
+    python scripts/generation_server.py --port 8765 --plms
+    python scripts/generation_server.py --socket /tmp/generation.sock
+    python scripts/generation_server.py --continuous --max_batch 8
+
+    curl -X POST localhost:8765/jobs -H "Content-Type: application/json" \
+        -d '{"prompt": "a lighthouse at dusk", "seed": 7}'
+    curl -X POST localhost:8765/jobs -H "Content-Type: application/json" \
+        -d '{"prompt": "a lighthouse at dawn", "priority": "background"}'
+    curl "localhost:8765/jobs/<id>?wait=60"
+"""
+
+import base64
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from ldm.imports import profile_imports
+
+# txt2img options a job may set for itself, every other option is fixed when the server starts
+JOB_OPTIONS = ("H", "W", "ddim_steps", "ddim_eta", "scale")
+# priority classes, most urgent first
+PRIORITIES = ("interactive", "batch", "background")
+
+
+@dataclass
+class Job:
+    """
+    One image to render.
+    Attributes:
+        kind: str txt2img or img2img
+        prompt: str
+        seed: int the seed of the job's starting noise
+        name: str the image is saved as image_<name>.png in the server's outdir
+        options: dict any of JOB_OPTIONS
+        init_image: str or PIL.Image the image img2img starts from, a path under the server's input root or an upload
+        strength: float how much of the schedule img2img runs
+        priority: str one of PRIORITIES, queued jobs are rendered most urgent first
+    """
+
+    kind: str = "txt2img"
+    prompt: str = ""
+    seed: int = 42
+    name: str = None
+    options: dict = field(default_factory=dict)
+    init_image: object = None
+    strength: float = 0.75
+    priority: str = "interactive"
+    id: str = field(default_factory=lambda: uuid4().hex)
+    status: str = "queued"
+    result: str = None
+    error: str = None
+    submitted: float = field(default_factory=time.time)
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @classmethod
+    def from_request(cls, request, input_root=None):
+        """
+        Builds a job from a request body, ignoring any option a job may not set.
+        Args:
+            request: dict the job, see the module docstring
+            input_root: str the only directory init_image paths may point into, None to only accept uploads
+        Raises:
+            ValueError: if the request is malformed, or names a file the job may not read or write
+        """
+        if not isinstance(request, dict):
+            raise ValueError("A job must be a JSON object")
+        if request.get("kind", "txt2img") not in ("txt2img", "img2img"):
+            raise ValueError(f"Unknown job kind {request['kind']}")
+        if request.get("priority", "interactive") not in PRIORITIES:
+            raise ValueError(f"Unknown priority {request['priority']}, expected one of {PRIORITIES}")
+        name = request.get("name")
+        if name is not None and not valid_name(name):
+            raise ValueError(f"Invalid name {name!r}, a name may not be empty or hold a path separator or ..")
+        job = cls(
+            kind=request.get("kind", "txt2img"),
+            prompt=request["prompt"],
+            seed=int(request.get("seed", 42)),
+            options={name: request[name] for name in JOB_OPTIONS if name in request},
+            strength=float(request.get("strength", 0.75)),
+            priority=request.get("priority", "interactive"),
+        )
+        if job.kind == "img2img":
+            job.init_image = read_init_image(request, input_root)
+        job.name = name or job.id
+        return job
+
+    def batch_key(self):
+        """
+        Jobs with the same key can share a sampling batch.
+        """
+        return self.kind, tuple(sorted(self.options.items())), self.strength if self.kind == "img2img" else None
+
+    def rank(self):
+        # the most urgent, then the oldest, job sorts first
+        return PRIORITIES.index(self.priority), self.submitted
+
+    def to_dict(self):
+        return dict(
+            id=self.id, kind=self.kind, name=self.name, priority=self.priority, status=self.status,
+            result=self.result, error=self.error,
+        )
+
+
+def valid_name(name):
+    """
+    Whether name can only ever make a file directly in the output directory.
+    """
+    return (
+        isinstance(name, str) and name not in ("", ".")
+        and not any(part in name for part in ("/", "\\", os.sep, "..", "\0"))
+    )
+
+
+def read_init_image(request, input_root=None):
+    """
+    The init image of an img2img request, either uploaded as base64 in init_image_data, or a path in init_image
+    that resolves, symlinks followed, to a file under input_root.
+    Returns:
+        PIL.Image for an upload, otherwise str the resolved path
+    Raises:
+        ValueError: if there is no init image, or it is not allowed or not an image
+    """
+    if request.get("init_image_data"):
+        from PIL import Image
+
+        try:
+            image = Image.open(io.BytesIO(base64.b64decode(request["init_image_data"], validate=True)))
+            image.load()
+        except (OSError, ValueError) as e:
+            raise ValueError(f"init_image_data is not a base64 encoded image: {e}")
+        return image
+    path = request.get("init_image")
+    if not path:
+        raise ValueError("img2img jobs need an init_image_data upload or an init_image")
+    if input_root is None:
+        raise ValueError("This server reads no init_image paths, upload the image in init_image_data instead")
+    root = os.path.realpath(input_root)
+    path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"init_image {request['init_image']} is outside the server's input root")
+    if not os.path.isfile(path):
+        raise ValueError(f"init_image {request['init_image']} not found")
+    return path
+
+
+class JobQueue:
+    """
+    Jobs waiting to be rendered, most urgent first, taken in batches of compatible jobs.
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.jobs)
+
+    def put(self, job):
+        with self.condition:
+            self.jobs.append(job)
+            self.jobs.sort(key=Job.rank)
+            self.condition.notify_all()
+
+    def take_batch(self, max_batch, window):
+        """
+        Waits for a job, then for up to window seconds for more jobs compatible with the most urgent one.
+        Args:
+            max_batch: int the most jobs in one batch
+            window: float seconds to wait for a batch to fill up
+        Returns:
+            list of Job, most urgent first
+        """
+        with self.condition:
+            while not self.jobs:
+                self.condition.wait()
+            key = self.jobs[0].batch_key()
+            deadline = time.monotonic() + window
+            while sum(job.batch_key() == key for job in self.jobs) < max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = [job for job in self.jobs if job.batch_key() == key][:max_batch]
+            self.jobs = [job for job in self.jobs if job not in batch]
+            return batch
+
+    def take(self, count, above=None):
+        """
+        Takes up to count of the most urgent jobs, whatever their options, without waiting.
+        Args:
+            count: int the most jobs to take
+            above: int only take jobs more urgent than this index into PRIORITIES
+        Returns:
+            list of Job, most urgent first
+        """
+        with self.condition:
+            jobs = self.jobs if above is None else [job for job in self.jobs if job.rank()[0] < above]
+            taken = jobs[:count]
+            self.jobs = [job for job in self.jobs if job not in taken]
+            return taken
+
+    def wait(self):
+        """
+        Waits until a job is queued.
+        """
+        with self.condition:
+            while not self.jobs:
+                self.condition.wait()
+
+
+class GenerationService:
+    """
+    Renders queued jobs with one warm ImageGenerator on a single worker thread.
+    By default compatible jobs are sampled together in lock-step batches. With continuous set, every job joins
+    a rolling DDIM batch between two UNet evaluations and leaves it as soon as its own schedule is done, so jobs
+    with different step counts, guidance scales and strengths share the model without waiting on each other.
+    Queued jobs are started most urgent first. In continuous mode a more urgent job also preempts less urgent
+    running jobs at the next step boundary, which keep their latents and step index and resume once there is room.
+    """
+
+    def __init__(self, generator, max_batch=4, batch_window=0.05, keep_finished=1000, continuous=False):
+        """
+        Args:
+            generator: scripts.txt2img.ImageGenerator
+            max_batch: int the most jobs sampled together
+            batch_window: float seconds the worker waits for compatible jobs before sampling a partial batch
+            keep_finished: int how many finished jobs are remembered for clients to collect
+            continuous: bool sample with a ContinuousDDIMSampler instead of in lock-step batches
+        """
+        self.generator = generator
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.keep_finished = keep_finished
+        self.continuous = continuous
+        # the empty prompt's conditioning, shared by every guided job in continuous mode
+        self.uncond = None
+        self.queue = JobQueue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.worker.start()
+        return self
+
+    def submit(self, job):
+        with self.lock:
+            self.jobs[job.id] = job
+            # forget the oldest finished jobs
+            while len(self.jobs) > self.keep_finished:
+                oldest = next((id for id, queued in self.jobs.items() if queued.done.is_set()), None)
+                if oldest is None:
+                    break
+                del self.jobs[oldest]
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def run(self):
+        if self.continuous:
+            return self.run_continuous()
+        while True:
+            batch = self.queue.take_batch(self.max_batch, self.batch_window)
+            self.render(batch)
+
+    def run_continuous(self):
+        """
+        Keeps a rolling sampling batch full from the queue, admitting jobs between steps while the sampler
+        is busy and sleeping on the queue while it is idle.
+        """
+        from ldm.models.diffusion.continuous import ContinuousDDIMSampler
+
+        sampler = ContinuousDDIMSampler(self.generator.model, max_batch=self.max_batch)
+        while True:
+            self.queue.wait()
+            with self.generator.sampling_scope():
+                while True:
+                    jobs = self.queue.take(max(0, self.max_batch - len(sampler)))
+                    # jobs that would preempt a full batch are started whether or not others are waiting
+                    least_urgent = sampler.least_urgent()
+                    if least_urgent is not None and len(sampler.pending) < self.max_batch:
+                        jobs += self.queue.take(self.max_batch - len(sampler.pending), above=least_urgent)
+                    for job in jobs:
+                        self.admit(sampler, job)
+                    if sampler.idle:
+                        break
+                    try:
+                        for request in sampler.admit():
+                            print(f"Job {request.job.id} preempted at step {request.steps - request.index - 1}")
+                            request.job.status = "preempted"
+                        for request in sampler.active:
+                            request.job.status = "running"
+                        finished = sampler.step()
+                    except Exception as e:
+                        print(e)
+                        print("Sampling step failed")
+                        self.fail([request.job for request in sampler.clear()], e)
+                        continue
+                    if finished:
+                        self.save(finished)
+
+    def admit(self, sampler, job):
+        """
+        Encodes a job's prompt, starting noise and init image and submits it to the sampler.
+        """
+        import torch
+
+        generator = self.generator
+        try:
+            opt = generator.options(**job.options)
+            shape = [opt.C, opt.H // opt.f, opt.W // opt.f]
+            x_T = torch.randn(shape, generator=torch.Generator().manual_seed(job.seed)).to(generator.device)
+            c = generator.model.get_learned_conditioning([job.prompt])[0]
+            uc = None
+            if opt.scale != 1.0:
+                if self.uncond is None:
+                    self.uncond = generator.model.get_learned_conditioning([""])[0]
+                uc = self.uncond
+            x0 = generator.encode_images([job.init_image], opt)[0] if job.kind == "img2img" else None
+            request = sampler.request(
+                x_T, c, uc, steps=opt.ddim_steps, scale=opt.scale, eta=opt.ddim_eta, x0=x0, strength=job.strength,
+                seed=job.seed, priority=PRIORITIES.index(job.priority),
+            )
+        except Exception as e:
+            print(e)
+            print(f"Job {job.id} could not be started")
+            return self.fail([job], e)
+        request.job, request.opt = job, opt
+        sampler.submit(request)
+
+    def save(self, requests):
+        """
+        Decodes the finished requests together and saves each job's image.
+        """
+        import torch
+
+        jobs = [request.job for request in requests]
+        try:
+            x_samples = self.generator.decode_samples(torch.stack([request.x for request in requests]))
+            for request, x_sample in zip(requests, x_samples):
+                request.job.result = self.generator.save_samples(x_sample[None], [request.job.name], request.opt)[0]
+                request.job.status = "done"
+                request.job.done.set()
+        except Exception as e:
+            print(e)
+            print(f"Jobs {[job.id for job in jobs]} could not be saved")
+            self.fail([job for job in jobs if not job.done.is_set()], e)
+
+    def fail(self, jobs, error):
+        for job in jobs:
+            job.error, job.status = str(error), "failed"
+            job.done.set()
+
+    def render(self, batch):
+        """
+        Renders a batch of compatible jobs in one make_images call.
+        """
+        for job in batch:
+            job.status = "running"
+        first = batch[0]
+        print(f"Rendering {len(batch)} {first.kind} jobs")
+        try:
+            paths = self.generator.make_images(
+                [job.prompt for job in batch],
+                [job.name for job in batch],
+                [job.seed for job in batch],
+                opt=self.generator.options(**first.options),
+                init_images=[job.init_image for job in batch] if first.kind == "img2img" else None,
+                strength=first.strength,
+            )
+            for job, path in zip(batch, paths):
+                job.result, job.status = path, "done"
+        except Exception as e:
+            print(e)
+            print(f"Jobs {[job.id for job in batch]} failed")
+            for job in batch:
+                job.error, job.status = str(e), "failed"
+        finally:
+            for job in batch:
+                job.done.set()
+
+
+class GenerationHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs with a job, or {"jobs": [...]}, returns the job ids.
+    GET /jobs/<id>?wait=<seconds> returns the job, waiting up to that long for it to finish.
+    GET /health returns how many jobs are queued.
+    """
+
+    service = None
+    # the directory init_image paths are read from, None to only accept uploaded init images
+    input_root = None
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/jobs":
+            return self.reply(404, {"error": "not found"})
+        if self.headers.get_content_type() != "application/json":
+            return self.reply(415, {"error": "jobs must be sent as application/json"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("The request must be a JSON object")
+            jobs = request.get("jobs", [request])
+            if not isinstance(jobs, list):
+                raise ValueError("jobs must be a list")
+            jobs = [Job.from_request(job, self.input_root) for job in jobs]
+        except (ValueError, KeyError, TypeError) as e:
+            return self.reply(400, {"error": str(e)})
+        for job in jobs:
+            self.service.submit(job)
+        self.reply(202, {"ids": [job.id for job in jobs]})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            return self.reply(200, {"queued": len(self.service.queue)})
+        if not url.path.startswith("/jobs/"):
+            return self.reply(404, {"error": "not found"})
+        job = self.service.get(url.path[len("/jobs/"):])
+        if job is None:
+            return self.reply(404, {"error": "unknown job"})
+        try:
+            wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+        except ValueError:
+            return self.reply(400, {"error": "wait must be a number of seconds"})
+        if wait > 0:
+            job.done.wait(wait)
+        self.reply(200, job.to_dict())
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # clients on a Unix socket have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class GenerationClient:
+    """
+    Renders through a running generation server. It has ImageGenerator.make_images' signature,
+    so it can stand in for a local ImageGenerator. Init images are uploaded, and the images are saved in the
+    server's --outdir whatever opt.outdir is.
+    Usage:
+        client = GenerationClient("http://127.0.0.1:8765")  # or "unix:///tmp/generation.sock"
+        paths = client.make_images(["a lighthouse at dusk"], ["lighthouse"], [7])
+    """
+
+    def __init__(self, url, timeout=3600, priority="interactive"):
+        """
+        Args:
+            url: str http://host:port or unix://<socket path>
+            timeout: float seconds to wait for a job before giving up on it
+            priority: str the priority class of every job submitted, one of PRIORITIES
+        """
+        self.url = url
+        self.timeout = timeout
+        self.priority = priority
+
+    def connection(self):
+        if self.url.startswith("unix://"):
+            return UnixHTTPConnection(self.url[len("unix://"):], timeout=self.timeout + 60)
+        url = urlparse(self.url)
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout + 60)
+
+    def request(self, method, path, body=None):
+        connection = self.connection()
+        try:
+            connection.request(
+                method, path, body=json.dumps(body) if body is not None else None,
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            reply = json.loads(response.read() or b"{}")
+            if response.status >= 400:
+                raise RuntimeError(reply.get("error", response.status))
+            return reply
+        finally:
+            connection.close()
+
+    def submit(self, jobs):
+        """
+        Args:
+            jobs: list of job dicts, see Job.from_request
+        Returns:
+            list of str the job ids
+        """
+        return self.request("POST", "/jobs", {"jobs": jobs})["ids"]
+
+    def wait(self, job_id):
+        """
+        Returns:
+            dict the finished job, see Job.to_dict
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            job = self.request("GET", f"/jobs/{job_id}?wait={min(60, max(1, deadline - time.monotonic())):.0f}")
+            if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+                return job
+
+    def make_images(
+        self, prompts, names, seeds, opt=None, timings=None, init_images=None, strength=0.75, postprocess=None,
+        **kwargs,
+    ):
+        """
+        Renders one image per prompt on the server, see ImageGenerator.make_images. The server saves the images,
+        so postprocess is applied here by reopening them, and init_latents and latents are not supported.
+        Returns:
+            the paths of the saved images, None for any job that failed, in the same order as prompts
+        """
+        if kwargs.get("init_latents") is not None or kwargs.get("latents") is not None:
+            print("The generation server neither starts from nor returns latents, init_latents and latents are ignored")
+        start = time.perf_counter(), time.thread_time()
+        options = {name: getattr(opt, name) for name in JOB_OPTIONS if opt is not None and hasattr(opt, name)}
+        jobs = [
+            dict(
+                kind="img2img" if init_images is not None else "txt2img",
+                prompt=prompt,
+                name=name,
+                seed=seed,
+                init_image_data=encode_image(init_images[position]) if init_images is not None else None,
+                strength=strength,
+                priority=self.priority,
+                **options,
+            )
+            for position, (prompt, name, seed) in enumerate(zip(prompts, names, seeds))
+        ]
+        paths = []
+        for position, job_id in enumerate(self.submit(jobs)):
+            job = self.wait(job_id)
+            if job["status"] != "done":
+                print(f"Job {job_id} failed: {job['error']}")
+                paths.append(None)
+                continue
+            if postprocess is not None:
+                from PIL import Image
+
+                with Image.open(job["result"]) as image:
+                    image = postprocess(image.convert("RGB"), position)
+                image.save(job["result"])
+            paths.append(job["result"])
+        if timings is not None:
+            # the server's phases are not visible from here, the whole round trip counts as sampling
+            timings["sampling"] = (time.perf_counter() - start[0], time.thread_time() - start[1])
+        return paths
+
+
+def encode_image(image):
+    """
+    The bytes of an image path, or of a PIL image as PNG, in base64 for the init_image_data of a job.
+    """
+    if isinstance(image, str):
+        with open(image, "rb") as file:
+            data = file.read()
+    else:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = buffer.getvalue()
+    return base64.b64encode(data).decode("ascii")
+
+
+def get_parser():
+    from scripts.txt2img import get_parser as get_txt2img_parser
+
+    parser = get_txt2img_parser()
+    parser.description = "Serve txt2img and img2img jobs from one warm model"
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="the port to listen on")
+    parser.add_argument("--socket", type=str, help="listen on this Unix socket instead of a port")
+    parser.add_argument(
+        "--input_root",
+        type=str,
+        help="img2img jobs may name init_image files under this directory, without it init images must be uploaded",
+    )
+    parser.add_argument("--max_batch", type=int, default=4, help="the most jobs sampled together")
+    parser.add_argument(
+        "--batch_window",
+        type=float,
+        default=0.05,
+        help="seconds to wait for compatible jobs before sampling a partial batch",
+    )
+    parser.add_argument(
+        "--continuous",
+        action="store_true",
+        help="sample every job in one rolling DDIM batch that jobs join and leave between steps, instead of "
+        "in lock-step batches of compatible jobs. Only then does a more urgent job preempt running jobs, "
+        "without it job priorities only order the queue",
+    )
+    return parser
+
+
+def main():
+    opt = get_parser().parse_args()
+    from scripts.txt2img import ImageGenerator
+
+    service = GenerationService(
+        ImageGenerator(opt), max_batch=opt.max_batch, batch_window=opt.batch_window, continuous=opt.continuous
+    ).start()
+    handler = type("Handler", (GenerationHandler,), {"service": service, "input_root": opt.input_root})
+    if opt.socket:
+        if os.path.exists(opt.socket):
+            os.remove(opt.socket)
+        server = UnixHTTPServer(opt.socket, handler)
+        print(f"Serving on {opt.socket}")
+    else:
+        server = ThreadingHTTPServer((opt.host, opt.port), handler)
+        print(f"Serving on http://{opt.host}:{opt.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    profile_imports()
+    main()
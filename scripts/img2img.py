@@ -8,20 +8,12 @@ import time
 from contextlib import nullcontext
 from itertools import islice
 
-import numpy as np
-import PIL
-import torch
-from einops import rearrange, repeat
-from omegaconf import OmegaConf
-from PIL import Image
-from pytorch_lightning import seed_everything
-from torch import autocast
-from torchvision.utils import make_grid
-from tqdm import tqdm, trange
-
-from ldm.models.diffusion.ddim import DDIMSampler
-from ldm.models.diffusion.plms import PLMSSampler
-from ldm.util import instantiate_from_config
+from ldm.imports import lazy_import, profile_imports
+
+# imported on first use, so --help and argument errors do not wait for them
+np = lazy_import("numpy")
+torch = lazy_import("torch")
+Image = lazy_import("PIL.Image")
 
 
 def get_device():
@@ -41,32 +33,12 @@ def chunk(it, size):
     return iter(lambda: tuple(islice(it, size)), ())
 
 
-def load_model_from_config(config, ckpt, verbose=False):
-    print(f"Loading model from {ckpt}")
-    pl_sd = torch.load(ckpt, map_location="cpu")
-    if "global_step" in pl_sd:
-        print(f"Global Step: {pl_sd['global_step']}")
-    sd = pl_sd["state_dict"]
-    model = instantiate_from_config(config.model)
-    m, u = model.load_state_dict(sd, strict=False)
-    if len(m) > 0 and verbose:
-        print("missing keys:")
-        print(m)
-    if len(u) > 0 and verbose:
-        print("unexpected keys:")
-        print(u)
-
-    model.to(get_device())
-    model.eval()
-    return model
-
-
 def load_img(path):
     image = Image.open(path).convert("RGB")
     w, h = image.size
     print(f"loaded input image of size ({w}, {h}) from {path}")
     w, h = map(lambda x: x - x % 32, (w, h))  # resize to integer multiple of 32
-    image = image.resize((w, h), resample=PIL.Image.LANCZOS)
+    image = image.resize((w, h), resample=Image.LANCZOS)
     image = np.array(image).astype(np.float32) / 255.0
     image = image[None].transpose(0, 3, 1, 2)
     image = torch.from_numpy(image)
@@ -190,7 +162,7 @@ def main():
         "--ckpt",
         type=str,
         default="models/ldm/stable-diffusion-v1-v1/model.ckpt",
-        help="path to checkpoint of model",
+        help="path to checkpoint of model, or to a slim .safetensors one from scripts/convert_checkpoint.py",
     )
     parser.add_argument(
         "--seed",
@@ -205,12 +177,47 @@ def main():
         choices=["full", "autocast"],
         default="autocast",
     )
+    parser.add_argument(
+        "--service",
+        type=str,
+        help="render on a running scripts/generation_server.py, e.g. http://127.0.0.1:8765, instead of loading the "
+        "model, the images are saved in the server's --outdir",
+    )
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="print the cumulative seconds spent importing each package on exit",
+    )
 
     opt = parser.parse_args()
+    if opt.service:
+        sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+        from scripts.generation_server import GenerationClient
+
+        paths = GenerationClient(opt.service).make_images(
+            [opt.prompt] * opt.n_samples,
+            [f"{opt.seed}_{i}" for i in range(opt.n_samples)],
+            [opt.seed + i for i in range(opt.n_samples)],
+            opt=opt,
+            init_images=[opt.init_img] * opt.n_samples,
+            strength=opt.strength,
+        )
+        print(f"Your samples are ready and waiting for you here: {paths}")
+        return
+    from einops import rearrange, repeat
+    from omegaconf import OmegaConf
+    from pytorch_lightning import seed_everything
+    from torchvision.utils import make_grid
+    from tqdm import tqdm, trange
+
+    from ldm.models.diffusion.ddim import DDIMSampler
+    from ldm.models.diffusion.plms import PLMSSampler
+    from ldm.util import COMPONENTS, load_model_from_config
+
     seed_everything(opt.seed)
 
     config = OmegaConf.load(f"{opt.config}")
-    model = load_model_from_config(config, f"{opt.ckpt}")
+    model = load_model_from_config(config, f"{opt.ckpt}", components=COMPONENTS)
 
     device = get_device()
     model = model.to(device)
@@ -257,7 +264,7 @@ def main():
     t_enc = int(opt.strength * opt.ddim_steps)
     print(f"target t_enc is {t_enc} steps")
 
-    precision_scope = autocast if opt.precision == "autocast" else nullcontext
+    precision_scope = torch.autocast if opt.precision == "autocast" else nullcontext
     if device.type == "mps":
         precision_scope = nullcontext  # have to use f32 on mps
     with torch.no_grad():
@@ -324,4 +331,5 @@ def main():
 
 
 if __name__ == "__main__":
+    profile_imports()
     main()
@@ -10,7 +10,7 @@ from PIL import Image
 from tqdm import tqdm
 
 from ldm.models.diffusion.ddim import DDIMSampler
-from main import instantiate_from_config
+from ldm.util import COMPONENTS, load_model_from_config
 
 
 def make_batch(image, mask, device):
@@ -62,10 +62,7 @@ if __name__ == "__main__":
     print(f"Found {len(masks)} inputs.")
 
     config = OmegaConf.load("models/ldm/inpainting_big/config.yaml")
-    model = instantiate_from_config(config.model)
-    model.load_state_dict(
-        torch.load("models/ldm/inpainting_big/last.ckpt")["state_dict"], strict=False
-    )
+    model = load_model_from_config(config, "models/ldm/inpainting_big/last.ckpt", components=COMPONENTS)
 
     if torch.cuda.is_available():
         device = torch.device("cuda")
@@ -21,7 +21,7 @@ from ldm.models.diffusion.ddim import DDIMSampler
 from ldm.models.diffusion.plms import PLMSSampler
 from ldm.modules.encoders.modules import (FrozenClipImageEmbedder,
                                           FrozenCLIPTextEmbedder)
-from ldm.util import instantiate_from_config, parallel_data_prefetch
+from ldm.util import load_model_from_config, parallel_data_prefetch
 
 DATABASES = [
     "openimages",
@@ -56,7 +56,7 @@ from ldm.models.diffusion.ddim import DDIMSampler
 from ldm.models.diffusion.plms import PLMSSampler
 from ldm.modules.encoders.modules import (FrozenClipImageEmbedder,
                                           FrozenCLIPTextEmbedder)
-from ldm.util import instantiate_from_config, parallel_data_prefetch
+from ldm.util import load_model_from_config, parallel_data_prefetch
 
 DATABASES = [
     "openimages",
@@ -87,26 +87,6 @@ def chunk(it, size):
     return iter(lambda: tuple(islice(it, size)), ())
 
 
-def load_model_from_config(config, ckpt, verbose=False):
-    print(f"Loading model from {ckpt}")
-    pl_sd = torch.load(ckpt, map_location="cpu")
-    if "global_step" in pl_sd:
-        print(f"Global Step: {pl_sd['global_step']}")
-    sd = pl_sd["state_dict"]
-    model = instantiate_from_config(config.model)
-    m, u = model.load_state_dict(sd, strict=False)
-    if len(m) > 0 and verbose:
-        print("missing keys:")
-        print(m)
-    if len(u) > 0 and verbose:
-        print("unexpected keys:")
-        print(u)
-
-    model.to(get_device())
-    model.eval()
-    return model
-
-
 class Searcher(object):
     def __init__(self, database, retriever_version='ViT-L/14'):
         assert database in DATABASES
@@ -355,7 +335,8 @@ if __name__ == "__main__":
     opt = parser.parse_args()
 
     config = OmegaConf.load(f"{opt.config}")
-    model = load_model_from_config(config, f"{opt.ckpt}")
+    # no image is encoded
+    model = load_model_from_config(config, f"{opt.ckpt}", components=("unet", "cond_stage", "decoder"))
 
     device = torch.device(get_device())
     model = model.to(device)
@@ -451,26 +432,6 @@ def chunk(it, size):
     return iter(lambda: tuple(islice(it, size)), ())
 
 
-def load_model_from_config(config, ckpt, verbose=False):
-    print(f"Loading model from {ckpt}")
-    pl_sd = torch.load(ckpt, map_location="cpu")
-    if "global_step" in pl_sd:
-        print(f"Global Step: {pl_sd['global_step']}")
-    sd = pl_sd["state_dict"]
-    model = instantiate_from_config(config.model)
-    m, u = model.load_state_dict(sd, strict=False)
-    if len(m) > 0 and verbose:
-        print("missing keys:")
-        print(m)
-    if len(u) > 0 and verbose:
-        print("unexpected keys:")
-        print(u)
-
-    model.cuda()
-    model.eval()
-    return model
-
-
 class Searcher(object):
     def __init__(self, database, retriever_version='ViT-L/14'):
         assert database in DATABASES
@@ -720,7 +681,8 @@ if __name__ == "__main__":
     opt = parser.parse_args()
 
     config = OmegaConf.load(f"{opt.config}")
-    model = load_model_from_config(config, f"{opt.ckpt}")
+    # no image is encoded
+    model = load_model_from_config(config, f"{opt.ckpt}", components=("unet", "cond_stage", "decoder"))
 
     device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
     model = model.to(device)
@@ -13,7 +13,7 @@ from PIL import Image
 from tqdm import trange
 
 from ldm.models.diffusion.ddim import DDIMSampler
-from ldm.util import instantiate_from_config
+from ldm.util import instantiate_from_config, load_model_from_config, read_checkpoint
 
 rescale = lambda x: (x + 1.0) / 2.0
 
@@ -239,24 +239,18 @@ def get_parser():
     return parser
 
 
-def load_model_from_config(config, sd):
-    model = instantiate_from_config(config)
-    model.load_state_dict(sd, strict=False)
-    model.cuda()
-    model.eval()
-    return model
-
-
 def load_model(config, ckpt, gpu, eval_mode):
-    if ckpt:
-        print(f"Loading model from {ckpt}")
-        pl_sd = torch.load(ckpt, map_location="cpu")
-        global_step = pl_sd["global_step"]
-    else:
-        pl_sd = {"state_dict": None}
-        global_step = None
-    model = load_model_from_config(config.model, pl_sd["state_dict"])
-
+    if not ckpt:
+        # no checkpoint, the model keeps its random initialization
+        model = instantiate_from_config(config.model)
+        model.cuda()
+        model.eval()
+        return model, None
+    sd, global_step = read_checkpoint(ckpt)
+    # unconditional sampling only decodes
+    model = load_model_from_config(
+        config, ckpt, device=torch.device("cuda"), components=("unet", "decoder"), state_dict=sd
+    )
     return model, global_step
 
 
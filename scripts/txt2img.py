@@ -1,24 +1,21 @@
 import argparse, os, sys, glob
-import cv2
-import torch
-import numpy as np
-from omegaconf import OmegaConf
-from PIL import Image
-from tqdm import tqdm, trange
-from imwatermark import WatermarkEncoder
 from itertools import islice
-from einops import rearrange
-from torchvision.utils import make_grid
 import time
-from pytorch_lightning import seed_everything
-from torch import autocast
 from contextlib import contextmanager, nullcontext
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from ldm.util import instantiate_from_config
-from ldm.models.diffusion.ddim import DDIMSampler
-from ldm.models.diffusion.plms import PLMSSampler
+from ldm.imports import lazy_import, profile_imports
+
+# imported on first use, so --help and argument errors do not wait for them
+cv2 = lazy_import("cv2")
+torch = lazy_import("torch")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+
+# the txt2img command line only samples and decodes, it never encodes an image
+TXT2IMG_COMPONENTS = ("unet", "cond_stage", "decoder")
 
 
 def get_device():
@@ -30,10 +27,9 @@ def get_device():
         return 'cpu'
 
 
-from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
-from transformers import AutoFeatureExtractor
-
 # load safety model
+# from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
+# from transformers import AutoFeatureExtractor
 # safety_model_id = "CompVis/stable-diffusion-v1-safety-checker"
 # safety_feature_extractor = AutoFeatureExtractor.from_pretrained(safety_model_id)
 # safety_checker = StableDiffusionSafetyChecker.from_pretrained(safety_model_id)
@@ -56,24 +52,16 @@ def numpy_to_pil(images):
     return pil_images
 
 
-def load_model_from_config(config, ckpt, verbose=False):
-    print(f"Loading model from {ckpt}")
-    pl_sd = torch.load(ckpt, map_location="cpu")
-    if "global_step" in pl_sd:
-        print(f"Global Step: {pl_sd['global_step']}")
-    sd = pl_sd["state_dict"]
-    model = instantiate_from_config(config.model)
-    m, u = model.load_state_dict(sd, strict=False)
-    if len(m) > 0 and verbose:
-        print("missing keys:")
-        print(m)
-    if len(u) > 0 and verbose:
-        print("unexpected keys:")
-        print(u)
-
-    model.to(get_device())
-    model.eval()
-    return model
+def lap(timings, phase, mark, device):
+    """
+    Stores the wall and cpu seconds since mark under timings[phase] and returns a new mark.
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    now = (time.perf_counter(), time.thread_time())
+    if phase is not None:
+        timings[phase] = (now[0] - mark[0], now[1] - mark[1])
+    return now
 
 
 def put_watermark(img, wm_encoder=None):
@@ -110,273 +98,517 @@ def check_safety(x_image):
     return x_checked_image, has_nsfw_concept
 
 
+def get_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--prompt",
+        type=str,
+        nargs="?",
+        default="a painting of a virus monster playing guitar",
+        help="the prompt to render",
+    )
+    parser.add_argument(
+        "--outdir",
+        type=str,
+        nargs="?",
+        help="dir to write results to",
+        default="outputs/txt2img-samples",
+    )
+    parser.add_argument(
+        "--skip_grid",
+        action="store_true",
+        help="do not save a grid, only individual samples. Helpful when evaluating lots of samples",
+    )
+    parser.add_argument(
+        "--skip_save",
+        action="store_true",
+        help="do not save individual samples. For speed measurements.",
+    )
+    parser.add_argument(
+        "--ddim_steps",
+        type=int,
+        default=50,
+        help="number of ddim sampling steps",
+    )
+    parser.add_argument(
+        "--plms",
+        action="store_true",
+        help="use plms sampling",
+    )
+    parser.add_argument(
+        "--laion400m",
+        action="store_true",
+        help="uses the LAION400M model",
+    )
+    parser.add_argument(
+        "--fixed_code",
+        action="store_true",
+        help="if enabled, uses the same starting code across samples ",
+    )
+    parser.add_argument(
+        "--ddim_eta",
+        type=float,
+        default=0.0,
+        help="ddim eta (eta=0.0 corresponds to deterministic sampling",
+    )
+    parser.add_argument(
+        "--n_iter",
+        type=int,
+        default=1,
+        help="sample this often",
+    )
+    parser.add_argument(
+        "--H",
+        type=int,
+        default=512,
+        help="image height, in pixel space",
+    )
+    parser.add_argument(
+        "--W",
+        type=int,
+        default=512,
+        help="image width, in pixel space",
+    )
+    parser.add_argument(
+        "--C",
+        type=int,
+        default=4,
+        help="latent channels",
+    )
+    parser.add_argument(
+        "--f",
+        type=int,
+        default=8,
+        help="downsampling factor",
+    )
+    parser.add_argument(
+        "--n_samples",
+        type=int,
+        default=1,
+        help="how many samples to produce for each given prompt. A.k.a. batch size",
+    )
+    parser.add_argument(
+        "--n_rows",
+        type=int,
+        default=0,
+        help="rows in the grid (default: n_samples)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=7.5,
+        help="unconditional guidance scale: eps = eps(x, empty) + scale * (eps(x, cond) - eps(x, empty))",
+    )
+    parser.add_argument(
+        "--from-file",
+        type=str,
+        help="if specified, load prompts from this file",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/stable-diffusion/v1-inference.yaml",
+        help="path to config which constructs model",
+    )
+    parser.add_argument(
+        "--ckpt",
+        type=str,
+        default="models/ldm/stable-diffusion-v1/model.ckpt",
+        help="path to checkpoint of model, or to a slim .safetensors one from scripts/convert_checkpoint.py",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="the seed (for reproducible sampling)",
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        help="evaluate at this precision",
+        choices=["full", "autocast"],
+        default="autocast",
+    )
+    parser.add_argument(
+        "--name",
+        type=str,
+        default="",
+        help="file name"
+    )
+    parser.add_argument(
+        "--service",
+        type=str,
+        help="render on a running scripts/generation_server.py, e.g. http://127.0.0.1:8765, instead of loading the "
+        "model, the images are saved in the server's --outdir",
+    )
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="print the cumulative seconds spent importing each package on exit",
+    )
+    return parser
+
+
 def main(opt=None):
     if not opt:
-        parser = argparse.ArgumentParser()
-
-        parser.add_argument(
-            "--prompt",
-            type=str,
-            nargs="?",
-            default="a painting of a virus monster playing guitar",
-            help="the prompt to render",
-        )
-        parser.add_argument(
-            "--outdir",
-            type=str,
-            nargs="?",
-            help="dir to write results to",
-            default="outputs/txt2img-samples",
-        )
-        parser.add_argument(
-            "--skip_grid",
-            action="store_true",
-            help="do not save a grid, only individual samples. Helpful when evaluating lots of samples",
-        )
-        parser.add_argument(
-            "--skip_save",
-            action="store_true",
-            help="do not save individual samples. For speed measurements.",
-        )
-        parser.add_argument(
-            "--ddim_steps",
-            type=int,
-            default=50,
-            help="number of ddim sampling steps",
-        )
-        parser.add_argument(
-            "--plms",
-            action="store_true",
-            help="use plms sampling",
-        )
-        parser.add_argument(
-            "--laion400m",
-            action="store_true",
-            help="uses the LAION400M model",
-        )
-        parser.add_argument(
-            "--fixed_code",
-            action="store_true",
-            help="if enabled, uses the same starting code across samples ",
-        )
-        parser.add_argument(
-            "--ddim_eta",
-            type=float,
-            default=0.0,
-            help="ddim eta (eta=0.0 corresponds to deterministic sampling",
-        )
-        parser.add_argument(
-            "--n_iter",
-            type=int,
-            default=1,
-            help="sample this often",
-        )
-        parser.add_argument(
-            "--H",
-            type=int,
-            default=512,
-            help="image height, in pixel space",
-        )
-        parser.add_argument(
-            "--W",
-            type=int,
-            default=512,
-            help="image width, in pixel space",
-        )
-        parser.add_argument(
-            "--C",
-            type=int,
-            default=4,
-            help="latent channels",
-        )
-        parser.add_argument(
-            "--f",
-            type=int,
-            default=8,
-            help="downsampling factor",
-        )
-        parser.add_argument(
-            "--n_samples",
-            type=int,
-            default=1,
-            help="how many samples to produce for each given prompt. A.k.a. batch size",
-        )
-        parser.add_argument(
-            "--n_rows",
-            type=int,
-            default=0,
-            help="rows in the grid (default: n_samples)",
-        )
-        parser.add_argument(
-            "--scale",
-            type=float,
-            default=7.5,
-            help="unconditional guidance scale: eps = eps(x, empty) + scale * (eps(x, cond) - eps(x, empty))",
-        )
-        parser.add_argument(
-            "--from-file",
-            type=str,
-            help="if specified, load prompts from this file",
-        )
-        parser.add_argument(
-            "--config",
-            type=str,
-            default="configs/stable-diffusion/v1-inference.yaml",
-            help="path to config which constructs model",
-        )
-        parser.add_argument(
-            "--ckpt",
-            type=str,
-            default="models/ldm/stable-diffusion-v1/model.ckpt",
-            help="path to checkpoint of model",
-        )
-        parser.add_argument(
-            "--seed",
-            type=int,
-            default=42,
-            help="the seed (for reproducible sampling)",
-        )
-        parser.add_argument(
-            "--precision",
-            type=str,
-            help="evaluate at this precision",
-            choices=["full", "autocast"],
-            default="autocast",
-        )
-        parser.add_argument(
-            "--name",
-            type=str,
-            default="",
-            help="file name"
-        )
-        opt = parser.parse_args()
+        opt = get_parser().parse_args()
 
+    if getattr(opt, "service", None):
+        print(render_on_service(opt))
+        return
 
     make_image(opt)
 
     # pil_image.open(path).show()
 
 
-def make_image(opt):
-    # breakpoint()
-    if opt.laion400m:
-        print("Falling back to LAION 400M model...")
-        opt.config = "configs/latent-diffusion/txt2img-1p4B-eval.yaml"
-        opt.ckpt = "models/ldm/text2img-large/model.ckpt"
-        opt.outdir = "outputs/txt2img-samples-laion400m"
-    seed_everything(opt.seed)
-    config = OmegaConf.load(f"{opt.config}")
-    model = load_model_from_config(config, f"{opt.ckpt}")
-    device = torch.device(get_device())
-    model = model.to(device)
-    sampler = PLMSSampler(model) if opt.plms else DDIMSampler(model)
-    os.makedirs(opt.outdir, exist_ok=True)
-    outpath = opt.outdir
-    print(
-        "Creating invisible watermark encoder (see https://github.com/ShieldMnt/invisible-watermark)..."
-    )
-    wm = "StableDiffusionV1"
-    wm_encoder = WatermarkEncoder()
-    wm_encoder.set_watermark("bytes", wm.encode("utf-8"))
-    batch_size = opt.n_samples
-    n_rows = opt.n_rows if opt.n_rows > 0 else batch_size
-    if not opt.from_file:
-        prompt = opt.prompt
-        assert prompt is not None
-        data = [batch_size * [prompt]]
+def render_on_service(opt):
+    """
+    Renders the images make_image would on a generation server, one job per image: n_samples images of the prompt,
+    or one of each line of --from-file, n_iter times over, seeded from --seed up. No grid is saved.
+    Returns:
+        the paths of the images the server saved in its own --outdir, None for any job that failed
+    """
+    from scripts.generation_server import GenerationClient
 
-    else:
+    if opt.outdir != get_parser().get_default("outdir"):
+        raise ValueError("--outdir cannot be used with --service, the server saves images in its own --outdir")
+    prompts = opt.n_samples * [opt.prompt]
+    if opt.from_file:
         print(f"reading prompts from {opt.from_file}")
         with open(opt.from_file, "r") as f:
-            data = f.read().splitlines()
-            data = list(chunk(data, batch_size))
-    sample_path = os.path.join(outpath, "samples")
-    os.makedirs(sample_path, exist_ok=True)
-    base_count = len(os.listdir(sample_path))
-    grid_count = len(os.listdir(outpath)) - 1
-    start_code = None
-    if opt.fixed_code:
-        start_code = torch.randn(
-            [opt.n_samples, opt.C, opt.H // opt.f, opt.W // opt.f], device="cpu"
-        ).to(torch.device(device))
-    precision_scope = autocast if opt.precision == "autocast" else nullcontext
-    if device.type == "mps":
-        precision_scope = nullcontext  # have to use f32 on mps
-    with torch.no_grad():
-        with precision_scope(device.type):
-            with model.ema_scope():
-                tic = time.time()
-                all_samples = []
-                for _ in trange(opt.n_iter, desc="Sampling"):
-                    for prompts in tqdm(data, desc="data"):
-                        uc = None
-                        if opt.scale != 1.0:
-                            uc = model.get_learned_conditioning(batch_size * [""])
-                        if isinstance(prompts, tuple):
-                            prompts = list(prompts)
-                        c = model.get_learned_conditioning(prompts)
-                        shape = [opt.C, opt.H // opt.f, opt.W // opt.f]
-                        samples_ddim, _ = sampler.sample(
-                            S=opt.ddim_steps,
-                            conditioning=c,
-                            batch_size=opt.n_samples,
-                            shape=shape,
-                            verbose=False,
-                            unconditional_guidance_scale=opt.scale,
-                            unconditional_conditioning=uc,
-                            eta=opt.ddim_eta,
-                            x_T=start_code,
-                        )
-
-                        x_samples_ddim = model.decode_first_stage(samples_ddim)
-                        x_samples_ddim = torch.clamp(
-                            (x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0
-                        )
-                        x_samples_ddim = (
-                            x_samples_ddim.cpu().permute(0, 2, 3, 1).numpy()
-                        )
-
-                        x_checked_image, has_nsfw_concept = (x_samples_ddim,False)
-
-                        x_checked_image_torch = torch.from_numpy(
-                            x_checked_image
-                        ).permute(0, 3, 1, 2)
-
-                        if not opt.skip_save:
-                            for x_sample in x_checked_image_torch:
-                                x_sample = 255.0 * rearrange(
-                                    x_sample.cpu().numpy(), "c h w -> h w c"
-                                )
-                                img = Image.fromarray(x_sample.astype(np.uint8))
-                                img = put_watermark(img, wm_encoder)
-                                img.save(
-                                    os.path.join(sample_path, f"{base_count:05}.png")
-                                )
-                                base_count += 1
-
-                        if not opt.skip_grid:
-                            all_samples.append(x_checked_image_torch)
-
-                if not opt.skip_grid:
-                    # additionally, save as grid
-                    grid = torch.stack(all_samples, 0)
-                    grid = rearrange(grid, "n b c h w -> (n b) c h w")
-                    grid = make_grid(grid, nrow=n_rows)
-
-                    # to image
-                    grid = 255.0 * rearrange(grid, "c h w -> h w c").cpu().numpy()
-                    img = Image.fromarray(grid.astype(np.uint8))
-                    img = put_watermark(img, wm_encoder)
-                    img.save(os.path.join(outpath, f"image_{opt.name}.png"))
-                    grid_count += 1
-
-                toc = time.time()
-    # print(
-    #     f"Your samples are ready and waiting for you here: \n{outpath} \n" f" \nEnjoy."
-    # )
-
-    return f"{outpath}/image_{opt.name}.png"
+            prompts = [prompt for prompt in f.read().splitlines() if prompt]
+    prompts = opt.n_iter * prompts
+    if not opt.name:
+        # the server names unnamed jobs after their id
+        names = [None] * len(prompts)
+    elif len(prompts) == 1:
+        names = [opt.name]
+    else:
+        names = [f"{opt.name}_{i}" for i in range(len(prompts))]
+    return GenerationClient(opt.service).make_images(
+        prompts, names, [opt.seed + i for i in range(len(prompts))], opt=opt
+    )
+
+
+class ImageGenerator:
+    """
+    Keeps the model, sampler and watermark encoder loaded between calls so that
+    callers rendering many prompts (e.g. the storyboard) only pay the startup cost once.
+    """
+
+    def __init__(self, opt, components=None):
+        """
+        Args:
+            opt: the txt2img options
+            components: the parts of the model to build, see ldm.util.COMPONENTS, all of them by default.
+                img2img and refine need the encoder
+        """
+        from imwatermark import WatermarkEncoder
+        from omegaconf import OmegaConf
+
+        from ldm.models.diffusion.ddim import DDIMSampler
+        from ldm.models.diffusion.plms import PLMSSampler
+        from ldm.util import COMPONENTS, load_model_from_config
+
+        if opt.laion400m:
+            print("Falling back to LAION 400M model...")
+            opt.config = "configs/latent-diffusion/txt2img-1p4B-eval.yaml"
+            opt.ckpt = "models/ldm/text2img-large/model.ckpt"
+            opt.outdir = "outputs/txt2img-samples-laion400m"
+        self.opt = opt
+        config = OmegaConf.load(f"{opt.config}")
+        self.device = torch.device(get_device())
+        # the seconds each phase of loading the model took
+        self.load_timings = {}
+        self.model = load_model_from_config(
+            config, f"{opt.ckpt}", device=self.device, timings=self.load_timings,
+            components=COMPONENTS if components is None else components,
+        )
+        self.sampler = PLMSSampler(self.model) if opt.plms else DDIMSampler(self.model)
+        # img2img needs stochastic_encode, which only the DDIM sampler has
+        self.ddim_sampler = self.sampler if isinstance(self.sampler, DDIMSampler) else DDIMSampler(self.model)
+        print(
+            "Creating invisible watermark encoder (see https://github.com/ShieldMnt/invisible-watermark)..."
+        )
+        wm = "StableDiffusionV1"
+        self.wm_encoder = WatermarkEncoder()
+        self.wm_encoder.set_watermark("bytes", wm.encode("utf-8"))
+
+    def options(self, **overrides):
+        """
+        Returns a copy of the options the generator was built with, updated with overrides.
+        """
+        return argparse.Namespace(**{**vars(self.opt), **overrides})
+
+    def make_image(self, opt=None):
+        from einops import rearrange
+        from pytorch_lightning import seed_everything
+        from torchvision.utils import make_grid
+        from tqdm import tqdm, trange
+
+        opt = opt or self.opt
+        model, sampler, device = self.model, self.sampler, self.device
+        seed_everything(opt.seed)
+        os.makedirs(opt.outdir, exist_ok=True)
+        outpath = opt.outdir
+        batch_size = opt.n_samples
+        n_rows = opt.n_rows if opt.n_rows > 0 else batch_size
+        if not opt.from_file:
+            prompt = opt.prompt
+            assert prompt is not None
+            data = [batch_size * [prompt]]
+
+        else:
+            print(f"reading prompts from {opt.from_file}")
+            with open(opt.from_file, "r") as f:
+                data = f.read().splitlines()
+                data = list(chunk(data, batch_size))
+        sample_path = os.path.join(outpath, "samples")
+        os.makedirs(sample_path, exist_ok=True)
+        base_count = len(os.listdir(sample_path))
+        grid_count = len(os.listdir(outpath)) - 1
+        start_code = None
+        if opt.fixed_code:
+            start_code = torch.randn(
+                [opt.n_samples, opt.C, opt.H // opt.f, opt.W // opt.f], device="cpu"
+            ).to(torch.device(device))
+        precision_scope = torch.autocast if opt.precision == "autocast" else nullcontext
+        if device.type == "mps":
+            precision_scope = nullcontext  # have to use f32 on mps
+        with torch.no_grad():
+            with precision_scope(device.type):
+                with model.ema_scope():
+                    tic = time.time()
+                    all_samples = []
+                    for _ in trange(opt.n_iter, desc="Sampling"):
+                        for prompts in tqdm(data, desc="data"):
+                            uc = None
+                            if opt.scale != 1.0:
+                                uc = model.get_learned_conditioning(batch_size * [""])
+                            if isinstance(prompts, tuple):
+                                prompts = list(prompts)
+                            c = model.get_learned_conditioning(prompts)
+                            shape = [opt.C, opt.H // opt.f, opt.W // opt.f]
+                            samples_ddim, _ = sampler.sample(
+                                S=opt.ddim_steps,
+                                conditioning=c,
+                                batch_size=opt.n_samples,
+                                shape=shape,
+                                verbose=False,
+                                unconditional_guidance_scale=opt.scale,
+                                unconditional_conditioning=uc,
+                                eta=opt.ddim_eta,
+                                x_T=start_code,
+                            )
+
+                            x_samples_ddim = model.decode_first_stage(samples_ddim)
+                            x_samples_ddim = torch.clamp(
+                                (x_samples_ddim + 1.0) / 2.0, min=0.0, max=1.0
+                            )
+                            x_samples_ddim = (
+                                x_samples_ddim.cpu().permute(0, 2, 3, 1).numpy()
+                            )
+
+                            x_checked_image, has_nsfw_concept = (x_samples_ddim, False)
+
+                            x_checked_image_torch = torch.from_numpy(
+                                x_checked_image
+                            ).permute(0, 3, 1, 2)
+
+                            if not opt.skip_save:
+                                for x_sample in x_checked_image_torch:
+                                    x_sample = 255.0 * rearrange(
+                                        x_sample.cpu().numpy(), "c h w -> h w c"
+                                    )
+                                    img = Image.fromarray(x_sample.astype(np.uint8))
+                                    img = put_watermark(img, self.wm_encoder)
+                                    img.save(
+                                        os.path.join(sample_path, f"{base_count:05}.png")
+                                    )
+                                    base_count += 1
+
+                            if not opt.skip_grid:
+                                all_samples.append(x_checked_image_torch)
+
+                    if not opt.skip_grid:
+                        # additionally, save as grid
+                        grid = torch.stack(all_samples, 0)
+                        grid = rearrange(grid, "n b c h w -> (n b) c h w")
+                        grid = make_grid(grid, nrow=n_rows)
+
+                        # to image
+                        grid = 255.0 * rearrange(grid, "c h w -> h w c").cpu().numpy()
+                        img = Image.fromarray(grid.astype(np.uint8))
+                        img = put_watermark(img, self.wm_encoder)
+                        img.save(os.path.join(outpath, f"image_{opt.name}.png"))
+                        grid_count += 1
+
+                    toc = time.time()
+        # print(
+        #     f"Your samples are ready and waiting for you here: \n{outpath} \n" f" \nEnjoy."
+        # )
+
+        return f"{outpath}/image_{opt.name}.png"
+
+
+    def make_images(
+        self, prompts, names, seeds, opt=None, timings=None, init_images=None, init_latents=None, strength=0.3,
+        latents=None, postprocess=None,
+    ):
+        """
+        Renders one sample for each prompt in a single sampling call. Every sample gets its own
+        starting code drawn from its own seed, so a prompt renders the same image whichever batch it lands in.
+        If a timings dict is passed, the wall and cpu seconds of the sampling, decode and save phases
+        are stored in it, along with the bytes saved.
+        If init_images, or init_latents already in latent space, are passed, each prompt refines its own
+        like scripts/img2img.py instead of starting from noise, running only the last strength * ddim_steps
+        steps of a DDIM schedule. If a latents list is passed, the final latent of every sample is appended to it.
+        If postprocess is passed, it is called with each watermarked PIL image and its position in prompts
+        and returns the image to save, e.g. to draw a caption without saving and reopening the file.
+        Returns:
+            the paths of the saved images, in the same order as prompts
+        """
+        opt = opt or self.opt
+        timings = {} if timings is None else timings
+        mark = lap(timings, None, None, self.device)
+        model, sampler, device = self.model, self.sampler, self.device
+        assert len(prompts) == len(names) == len(seeds)
+        os.makedirs(opt.outdir, exist_ok=True)
+        batch_size = len(prompts)
+        shape = [opt.C, opt.H // opt.f, opt.W // opt.f]
+        start_code = torch.stack(
+            [torch.randn(shape, generator=torch.Generator().manual_seed(seed)) for seed in seeds]
+        ).to(device)
+        with self.sampling_scope(opt):
+            uc = None
+            if opt.scale != 1.0:
+                uc = model.get_learned_conditioning(batch_size * [""])
+            c = model.get_learned_conditioning(list(prompts))
+            if init_images is not None:
+                init_latents = self.encode_images(init_images, opt)
+            if init_latents is not None:
+                samples_ddim = self.refine(init_latents, c, uc, start_code, strength, opt)
+            else:
+                samples_ddim, _ = sampler.sample(
+                    S=opt.ddim_steps,
+                    conditioning=c,
+                    batch_size=batch_size,
+                    shape=shape,
+                    verbose=False,
+                    unconditional_guidance_scale=opt.scale,
+                    unconditional_conditioning=uc,
+                    eta=opt.ddim_eta,
+                    x_T=start_code,
+                )
+            mark = lap(timings, "sampling", mark, device)
+            if latents is not None:
+                latents.extend(samples_ddim.float().cpu())
+            x_samples_ddim = self.decode_samples(samples_ddim)
+            mark = lap(timings, "decode", mark, device)
+            paths = self.save_samples(x_samples_ddim, names, opt, postprocess=postprocess)
+            lap(timings, "save", mark, device)
+            timings["bytes"] = sum(os.path.getsize(path) for path in paths)
+        return paths
+
+    @contextmanager
+    def sampling_scope(self, opt=None):
+        """
+        The no_grad, precision and EMA scope every sampling call runs in.
+        """
+        opt = opt or self.opt
+        precision_scope = torch.autocast if opt.precision == "autocast" else nullcontext
+        if self.device.type == "mps":
+            precision_scope = nullcontext  # have to use f32 on mps
+        with torch.no_grad():
+            with precision_scope(self.device.type):
+                with self.model.ema_scope():
+                    yield
+
+    def decode_samples(self, samples):
+        """
+        Decodes sampled latents into images in [0, 1].
+        """
+        x_samples = self.model.decode_first_stage(samples)
+        return torch.clamp((x_samples + 1.0) / 2.0, min=0.0, max=1.0)
+
+    def save_samples(self, x_samples, names, opt=None, postprocess=None):
+        """
+        Watermarks decoded samples and saves each as image_<name>.png in opt.outdir.
+        Returns:
+            the paths of the saved images, in the same order as names
+        """
+        from einops import rearrange
+
+        opt = opt or self.opt
+        os.makedirs(opt.outdir, exist_ok=True)
+        paths = []
+        for position, (x_sample, name) in enumerate(zip(x_samples, names)):
+            x_sample = 255.0 * rearrange(
+                x_sample.cpu().numpy(), "c h w -> h w c"
+            )
+            img = Image.fromarray(x_sample.astype(np.uint8))
+            img = put_watermark(img, self.wm_encoder)
+            if postprocess is not None:
+                img = postprocess(img, position)
+            path = os.path.join(opt.outdir, f"image_{name}.png")
+            img.save(path)
+            paths.append(path)
+        return paths
+
+    def encode_images(self, images, opt):
+        """
+        Encodes image paths or PIL images into the first stage's latent space.
+        """
+        init_image = torch.cat(
+            [load_img(image, (opt.W, opt.H)) for image in images]
+        ).to(self.device)
+        return self.model.get_first_stage_encoding(self.model.encode_first_stage(init_image))
+
+    def refine(self, init_latents, c, uc, noise, strength, opt):
+        """
+        Noises init_latents to strength and denoises them with the DDIM sampler.
+        Returns:
+            the sampled latents
+        """
+        assert 0.0 < strength <= 1.0, "can only work with strength in (0.0, 1.0]"
+        sampler = self.ddim_sampler
+        init_latent = torch.stack(list(init_latents)).to(self.device, noise.dtype)
+        sampler.make_schedule(ddim_num_steps=opt.ddim_steps, ddim_eta=opt.ddim_eta, verbose=False)
+        t_enc = max(1, int(strength * opt.ddim_steps))
+        # at strength 1 t_enc is one past the end of a schedule of ddim_steps timesteps, noise to its last one
+        t_noise = min(t_enc, len(sampler.ddim_timesteps) - 1)
+        z_enc = sampler.stochastic_encode(
+            init_latent, torch.tensor([t_noise] * len(init_latent)).to(self.device), noise=noise
+        )
+        return sampler.decode(
+            z_enc,
+            c,
+            t_enc,
+            unconditional_guidance_scale=opt.scale,
+            unconditional_conditioning=uc,
+        )
+
+
+def load_img(image, size):
+    """
+    Loads an image path or PIL image as a batch of one in [-1, 1], resized to size.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    image = image.convert("RGB").resize(size, resample=Image.LANCZOS)
+    image = np.array(image).astype(np.float32) / 255.0
+    image = torch.from_numpy(image[None].transpose(0, 3, 1, 2))
+    return 2.0 * image - 1.0
+
+
+def make_image(opt, generator=None):
+    if generator is None:
+        generator = ImageGenerator(opt, components=TXT2IMG_COMPONENTS)
+    return generator.make_image(opt)
 
 
 if __name__ == "__main__":
+    profile_imports()
     main()
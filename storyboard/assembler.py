@@ -0,0 +1,149 @@
+"""
+Single pass video assembly for the storyboard.
+Every line is a still image held for as long as its audio plays. Instead of rendering a 24 fps clip per line and
+concatenating them afterwards, the assembler encodes each still once, timestamps it at the point its audio starts,
+and appends the audio samples to a single continuous track, so the final video is written in one pass.
+"""
+
+from fractions import Fraction
+
+import av
+from PIL import Image
+
+
+class StreamingVideoAssembler:
+    """
+    Writes (image, audio) pairs to one video file as they are added.
+    Usage:
+        with StreamingVideoAssembler("final_video.mp4") as assembler:
+            for line in story:
+                assembler.add(line["image"], line["audio"])
+    """
+
+    def __init__(self, path, size=None, fps=24, audio_rate=44100, codec="libx264", audio_codec="aac"):
+        """
+        Args:
+            path: str the video file to write
+            size: (width, height) of the video, defaults to the size of the first image
+            fps: int the time base of the video track, stills are placed on this grid
+            audio_rate: int the sample rate of the audio track
+            codec: str the video encoder
+            audio_codec: str the audio encoder
+        """
+        self.path = path
+        self.size = size
+        self.fps = fps
+        self.audio_rate = audio_rate
+        self.container = av.open(path, mode="w")
+        self.video_stream = self.container.add_stream(codec, rate=fps)
+        self.video_stream.pix_fmt = "yuv420p"
+        if codec == "libx264":
+            self.video_stream.options = {"tune": "stillimage"}
+        self.audio_stream = self.container.add_stream(audio_codec, rate=audio_rate)
+        self.audio_stream.layout = "stereo"
+        self.fifo = av.AudioFifo()
+        self.samples_written = 0
+        self.samples_encoded = 0
+        self.last_pts = -1
+        self.last_frame = None
+        self.last_image_path = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def duration(self):
+        """
+        Seconds of audio appended so far.
+        """
+        return self.samples_written / self.audio_rate
+
+    def add(self, image_path, audio_path):
+        """
+        Appends one still and its audio to the video. A still that is already showing is held rather than
+        encoded again, so consecutive lines sharing an image play as one shot over their concatenated audio.
+        Args:
+            image_path: str the still to show
+            audio_path: str the audio to play while the still is shown
+        Returns:
+            float the duration of the line in seconds
+        """
+        audio_frames = self._decode_audio(audio_path)
+        start = self.samples_written
+        if image_path != self.last_image_path:
+            self._encode_image(image_path, Fraction(start, self.audio_rate))
+        for frame in audio_frames:
+            frame.pts = None
+            self.fifo.write(frame)
+            self.samples_written += frame.samples
+        self._encode_audio()
+        return (self.samples_written - start) / self.audio_rate
+
+    def close(self):
+        """
+        Holds the last still until the audio ends, flushes both encoders and closes the file.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.last_frame is not None:
+            # repeat the last still once at the end of the audio so the final line keeps its full duration
+            end_pts = round(self.duration * self.fps)
+            if end_pts > self.last_pts:
+                self.last_frame.pts = end_pts
+                self.container.mux(self.video_stream.encode(self.last_frame))
+        self._encode_audio(flush=True)
+        self.container.mux(self.video_stream.encode())
+        self.container.mux(self.audio_stream.encode())
+        self.container.close()
+
+    def _decode_audio(self, audio_path):
+        # a resampler can't be reused once it has been flushed, so every line gets its own
+        resampler = av.AudioResampler(format="fltp", layout="stereo", rate=self.audio_rate)
+        with av.open(audio_path) as audio:
+            frames = []
+            for frame in audio.decode(audio=0):
+                frames.extend(self._resample(resampler, frame))
+            frames.extend(self._resample(resampler, None))
+        return frames
+
+    @staticmethod
+    def _resample(resampler, frame):
+        resampled = resampler.resample(frame)
+        # older PyAV returns a single frame or None instead of a list
+        if resampled is None:
+            return []
+        return resampled if isinstance(resampled, list) else [resampled]
+
+    def _encode_image(self, image_path, start):
+        image = Image.open(image_path).convert("RGB")
+        if self.size is None:
+            # yuv420p needs even dimensions
+            self.size = (image.width - image.width % 2, image.height - image.height % 2)
+            self.video_stream.width, self.video_stream.height = self.size
+        if image.size != self.size:
+            image = image.resize(self.size)
+        pts = round(start * self.fps)
+        if pts <= self.last_pts:
+            # the previous line was shorter than one frame, let this still replace it on the next frame
+            pts = self.last_pts + 1
+        frame = av.VideoFrame.from_image(image)
+        frame.pts = pts
+        frame.time_base = Fraction(1, self.fps)
+        self.container.mux(self.video_stream.encode(frame))
+        self.last_pts = pts
+        self.last_frame = frame
+        self.last_image_path = image_path
+
+    def _encode_audio(self, flush=False):
+        frame_size = self.audio_stream.codec_context.frame_size or 1024
+        while self.fifo.samples >= frame_size or (flush and self.fifo.samples):
+            frame = self.fifo.read(min(frame_size, self.fifo.samples))
+            frame.pts = self.samples_encoded
+            frame.time_base = Fraction(1, self.audio_rate)
+            self.samples_encoded += frame.samples
+            self.container.mux(self.audio_stream.encode(frame))
@@ -0,0 +1,144 @@
+"""
+A content addressed cache for storyboard assets.
+Assets are stored under a hash of everything that determines their content (the prompt and sampling options for
+images, the text and voice for audio), so any story that asks for the same asset reuses it whatever its story id.
+The cache is capped in size and evicts the least recently used assets first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def asset_key(**parts):
+    """
+    Hashes the parts that determine an asset's content.
+    Args:
+        **parts: json serializable values, their order does not matter
+    Returns:
+        str the hex digest
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def checkpoint_fingerprint(path):
+    """
+    A cheap fingerprint of a model checkpoint built from its resolved path, size and modification time,
+    so changing or replacing the checkpoint changes the fingerprint without hashing gigabytes of weights.
+    Args:
+        path: str the checkpoint
+    Returns:
+        str the fingerprint, or the path itself if the checkpoint does not exist
+    """
+    if not os.path.exists(path):
+        return path
+    stat = os.stat(path)
+    return asset_key(path=os.path.realpath(path), size=stat.st_size, mtime=stat.st_mtime)
+
+
+class AssetCache:
+    """
+    Files stored by key in a directory, evicted least recently used first once they take up more than max_bytes.
+    Recency is tracked with each file's modification time so it survives between runs.
+    """
+
+    def __init__(self, root="storyboard/asset_cache", max_bytes=10 * 1024 ** 3):
+        """
+        Args:
+            root: str the directory the cache is kept in
+            max_bytes: int the most the cached files may take up on disk
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = None
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def _load(self):
+        # scan the cache directory once, oldest first
+        if self.entries is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        files = []
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(self.root, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        self.size = sum(self.entries.values())
+
+    def path(self, key, extension):
+        return os.path.join(self.root, f"{key}{extension}")
+
+    def get(self, key, extension, destination=None):
+        """
+        Looks an asset up and marks it as recently used.
+        Args:
+            key: str from asset_key
+            extension: str the asset's file extension
+            destination: str if given, the asset is copied here
+        Returns:
+            str the path to the asset, or None if it is not cached
+        """
+        name = f"{key}{extension}"
+        with self.lock:
+            self._load()
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+            path = self.path(key, extension)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # removed behind our back
+                self.size -= self.entries.pop(name)
+                return None
+            if destination is None:
+                return path
+            _copy(path, destination)
+            return destination
+
+    def put(self, key, extension, source):
+        """
+        Adds a file to the cache and evicts the least recently used assets if the cache is over its size.
+        Args:
+            key: str from asset_key
+            extension: str the asset's file extension
+            source: str the file to copy into the cache
+        Returns:
+            str the path to the cached asset
+        """
+        name = f"{key}{extension}"
+        path = self.path(key, extension)
+        with self.lock:
+            self._load()
+            if name in self.entries:
+                self.size -= self.entries.pop(name)
+            _copy(source, path)
+            self.entries[name] = os.path.getsize(path)
+            self.size += self.entries[name]
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+
+def _copy(source, destination):
+    # copy through a temporary file so a crash never leaves a truncated asset behind, and so that
+    # regenerating a story's own file in place can never change what is cached
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    temporary = f"{destination}.tmp"
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, destination)
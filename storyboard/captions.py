@@ -0,0 +1,86 @@
+"""
+Caption rendering for storyboard images.
+A caption is drawn centred along the top of the image, at the largest font size up to max_size that fits its width,
+in white with a black outline. Fonts are loaded once per size and the size is found by binary search, and the
+caption is drawn on the image in memory so it can be applied before the image is first saved.
+"""
+
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+FONTS = ("Arial", "DejaVuSans.ttf")
+
+
+@lru_cache(maxsize=None)
+def get_font(size, names=FONTS):
+    """
+    Loads the first of names that is installed at size, falling back to PIL's default font.
+    Args:
+        size: int the font size in points
+        names: tuple of str font names or paths to try in order
+    Returns:
+        ImageFont.FreeTypeFont
+    """
+    for name in names:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def fit_font(text, width, max_size=36, stroke=1):
+    """
+    Finds the largest font no bigger than max_size whose rendering of text fits in width.
+    Args:
+        text: str the caption
+        width: int the width available in pixels
+        max_size: int the font size to start from
+        stroke: int the width of the outline
+    Returns:
+        tuple: the font and the width and height of the text in it
+    """
+    low, high = 1, max_size
+    while low < high:
+        size = (low + high + 1) // 2
+        left, _, right, _ = get_font(size).getbbox(text, stroke_width=stroke)
+        if right - left <= width:
+            low = size
+        else:
+            high = size - 1
+    font = get_font(low)
+    left, top, right, bottom = font.getbbox(text, stroke_width=stroke)
+    return font, right - left, bottom - top
+
+
+def caption(image, text, max_size=36, stroke=1):
+    """
+    Draws text centred along the top of image, in place.
+    Args:
+        image: PIL.Image.Image
+        text: str the caption
+        max_size: int the largest font size to use
+        stroke: int the width of the black outline
+    Returns:
+        the same image
+    """
+    font, text_width, _ = fit_font(text, image.width, max_size, stroke)
+    ImageDraw.Draw(image).text(
+        ((image.width - text_width) / 2, 0),
+        text,
+        font=font,
+        fill=(255, 255, 255),
+        stroke_width=stroke,
+        stroke_fill=(0, 0, 0),
+    )
+    return image
+
+
+def caption_file(text, path, **kwargs):
+    """
+    Captions the image saved at path and saves it over itself, for images that were saved without one.
+    """
+    with Image.open(path) as image:
+        image = caption(image.convert("RGB"), text, **kwargs)
+    image.save(path)
@@ -0,0 +1,246 @@
+"""
+A SQLite catalog of storyboards and their per line assets.
+The pipeline records every story and every line's text, audio, image and duration here as they are produced, so
+the GUI can look a story up by id with an indexed query instead of listing the output directories of every story
+ever generated.
+"""
+
+import glob
+import json
+import os
+import sqlite3
+import threading
+
+import arrow
+
+STORY_COLUMNS = ("file_prefix", "file_path", "prompt_prefix", "prompt_suffix", "final_video")
+LINE_COLUMNS = ("line_id", "text", "audio", "image", "duration", "scene")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id TEXT PRIMARY KEY,
+    file_prefix TEXT,
+    file_path TEXT,
+    prompt_prefix TEXT,
+    prompt_suffix TEXT,
+    final_video TEXT,
+    created TEXT,
+    updated TEXT
+);
+CREATE TABLE IF NOT EXISTS lines (
+    story_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    line_id TEXT,
+    text TEXT,
+    audio TEXT,
+    image TEXT,
+    duration REAL,
+    scene INTEGER,
+    PRIMARY KEY (story_id, position)
+);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    applied TEXT
+);
+"""
+
+
+class StoryCatalog:
+    """
+    The catalog database, opened on first use and shared by every thread.
+    Usage:
+        catalog = StoryCatalog()
+        catalog.add_story(story_id, file_path="ezekiel.txt")
+        catalog.update_line(story_id, 0, text="This is the first line.", image="outputs/...png")
+        catalog.lines(story_id)
+    """
+
+    def __init__(self, path="storyboard/catalog.sqlite"):
+        """
+        Args:
+            path: str the database file
+        """
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            # readers never block the pipeline's writes, and a commit does not wait for the disk
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def add_story(self, story_id, **fields):
+        """
+        Adds a story or updates the fields given.
+        Args:
+            story_id: str
+            **fields: any of STORY_COLUMNS
+        Returns:
+            None
+        """
+        fields = {name: value for name, value in fields.items() if name in STORY_COLUMNS}
+        fields["updated"] = arrow.now().isoformat()
+        columns = ", ".join(fields)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                f"INSERT INTO stories (id, created, {columns}) VALUES (?, ?, {', '.join('?' for _ in fields)}) "
+                f"ON CONFLICT (id) DO UPDATE SET {updates}",
+                (str(story_id), fields["updated"], *fields.values()),
+            )
+            connection.commit()
+
+    def update_line(self, story_id, position, **fields):
+        """
+        Sets fields on one line of a story, ignoring any the catalog has no column for.
+        Args:
+            story_id: str
+            position: int the index of the line in the story
+            **fields: any of LINE_COLUMNS
+        Returns:
+            None
+        """
+        fields = {name: value for name, value in fields.items() if name in LINE_COLUMNS}
+        if not fields:
+            return
+        columns = ", ".join(fields)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                f"INSERT INTO lines (story_id, position, {columns}) VALUES (?, ?, {', '.join('?' for _ in fields)}) "
+                f"ON CONFLICT (story_id, position) DO UPDATE SET {updates}",
+                (str(story_id), position, *fields.values()),
+            )
+            connection.commit()
+
+    def replace_lines(self, story_id, lines):
+        """
+        Replaces every line of a story at once.
+        Args:
+            story_id: str
+            lines: list of dicts with any of LINE_COLUMNS
+        Returns:
+            None
+        """
+        rows = [
+            (str(story_id), position, *(line.get(name) for name in LINE_COLUMNS))
+            for position, line in enumerate(lines)
+        ]
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("DELETE FROM lines WHERE story_id = ?", (str(story_id),))
+                connection.executemany(
+                    f"INSERT INTO lines (story_id, position, {', '.join(LINE_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in range(len(LINE_COLUMNS) + 2))})",
+                    rows,
+                )
+
+    def stories(self):
+        """
+        Returns:
+            list of dict every story, most recently updated first
+        """
+        with self.lock:
+            rows = self.connect().execute("SELECT * FROM stories ORDER BY updated DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def story(self, story_id):
+        """
+        Returns:
+            dict the story, or None if it is not in the catalog
+        """
+        with self.lock:
+            row = self.connect().execute("SELECT * FROM stories WHERE id = ?", (str(story_id),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def lines(self, story_id):
+        """
+        Returns:
+            list of dict the lines of the story, in order
+        """
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT * FROM lines WHERE story_id = ? ORDER BY position", (str(story_id),)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def import_snapshots(self, cache_dir="storyboard/cache"):
+        """
+        Adds the stories cached before the catalog existed, read from their journal snapshots.
+        Args:
+            cache_dir: str the directory the story snapshots are in
+        Returns:
+            int how many stories were added
+        """
+        added = 0
+        for snapshot in glob.glob(os.path.join(cache_dir, "*.json")):
+            file_prefix = os.path.basename(snapshot)[: -len(".json")]
+            story_id = file_prefix.split("_")[0]
+            if self.story(story_id) is not None:
+                continue
+            try:
+                with open(snapshot, "r") as cached:
+                    story_dict = json.load(cached)
+            except (OSError, json.JSONDecodeError) as e:
+                print(e)
+                print(f"Could not import {snapshot}")
+                continue
+            if not isinstance(story_dict, list):
+                continue
+            final_video = f"storyboard/final_video/{file_prefix}/final_video.mp4"
+            audio_dir = f"storyboard/audio/{file_prefix}"
+            metadata = next((line for line in story_dict if line.get("file_prefix")), {})
+            self.add_story(
+                story_id,
+                file_prefix=file_prefix,
+                file_path=metadata.get("file_path"),
+                final_video=final_video if os.path.exists(final_video) else None,
+            )
+            lines = [dict(line) for line in story_dict if not line.get("file_prefix")]
+            for line in lines:
+                line["line_id"] = line.get("id")
+                if line.get("audio") and "/" not in line["audio"]:
+                    line["audio"] = f"{audio_dir}/{line['audio']}"
+            self.replace_lines(story_id, lines)
+            added += 1
+        return added
+
+    def migrate_snapshots(self, cache_dir="storyboard/cache"):
+        """
+        Imports the snapshots with import_snapshots the first time it is called on a database, and records that it
+        did, so every later call is a single query. Stories generated since the catalog existed are in it already.
+        Args:
+            cache_dir: str the directory the story snapshots are in
+        Returns:
+            int how many stories were added
+        """
+        with self.lock:
+            applied = self.connect().execute(
+                "SELECT 1 FROM migrations WHERE name = ?", ("import_snapshots",)
+            ).fetchone()
+        if applied is not None:
+            return 0
+        added = self.import_snapshots(cache_dir)
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR IGNORE INTO migrations (name, applied) VALUES (?, ?)",
+                ("import_snapshots", arrow.now().isoformat()),
+            )
+            connection.commit()
+        return added
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -4,22 +4,30 @@ audio for each line, and a video of the images and audio.
 """
 
 import contextlib
+import difflib
+import hashlib
 import json
 import os
-import shutil
-import subprocess
+import threading
 import time
-from dataclasses import dataclass
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 import random
 import arrow
-import av
-import torch
-from gtts import gTTS
-from moviepy.editor import *
-from PIL import Image, ImageDraw, ImageFont
-from transformers import BartForConditionalGeneration, BartTokenizer
 from uuid import uuid4
-import scripts
+from storyboard.assembler import StreamingVideoAssembler
+from storyboard.asset_cache import AssetCache, asset_key, checkpoint_fingerprint
+from storyboard.captions import caption, caption_file
+from storyboard.catalog import StoryCatalog
+from storyboard.journal import StoryJournal
+from storyboard.pipeline import Pipeline, Stage
+from storyboard.prompt_cache import SemanticPromptCache
+from storyboard.scenes import embed_texts, group_scenes
+from storyboard.stats import PipelineStats, print_summary
+from storyboard.tts import GTTSBackend, LocalTTSBackend, TTSBackend, synthesize
+
+TTS_BACKENDS = {"gtts": GTTSBackend, "local": LocalTTSBackend}
 
 
 @dataclass
@@ -70,13 +78,11 @@ class GlobalPrompt:
     """
     The Global image Prompt class
     """
-    photography_string: str = Photography().set_photography()
-    artist: str = input(
-        "Enter an artist or press enter to use the default of Van Gogh"
-    ) or "Van Gogh"
-    art_medium = random.choice(
+    artist: str = "Van Gogh"
+    photography_string: str = field(default_factory=lambda: Photography().set_photography())
+    art_medium: str = field(default_factory=lambda: random.choice(
         ["chalk", "graffiti", "water colors", "oil paints", "cinematic", "4k", "hyper realistic", "12k", "fabric",
-         "pencil drawing", "wood", "clay"])
+         "pencil drawing", "wood", "clay"]))
 
     def global_prompt_prefix(self):
         return f"A {self.art_medium} in the style of {self.artist}"
@@ -85,6 +91,111 @@ class GlobalPrompt:
         return f"with a {self.photography_string} photography style"
 
 
+@dataclass
+class PipelineContext:
+    """
+    The expensive resources a story run needs. Nothing is loaded until a stage first asks for it,
+    so importing this module or building a Story stays cheap.
+    Usage:
+        with PipelineContext(txt2img={"ddim_steps": 30}) as context:
+            initiate_story(Story("ezekiel.txt", context=context))
+    """
+
+    txt2img: dict = field(default_factory=dict)
+    paraphraser_options: dict = field(default_factory=dict)
+    service: str = None
+    service_priority: str = "batch"
+    paraphraser: "Paraphraser" = None
+    txt2img_options = None
+    image_generator = None
+    text_encoder = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_paraphraser(self):
+        """
+        This function builds the paraphraser, its model is only loaded once a sentence is missing from its memo.
+        Returns:
+            Paraphraser
+        """
+        with self.lock:
+            if self.paraphraser is None:
+                self.paraphraser = Paraphraser(**self.paraphraser_options)
+        return self.paraphraser
+
+    def get_txt2img_options(self):
+        """
+        This function builds the txt2img options every line of the story is rendered with,
+        scripts/txt2img.py's defaults updated with the context's txt2img options.
+        Returns:
+            argparse.Namespace
+        """
+        with self.lock:
+            if self.txt2img_options is None:
+                from scripts.txt2img import get_parser
+
+                self.txt2img_options = get_parser().parse_args(["--n_samples", "1", "--n_iter", "1", "--plms"])
+                vars(self.txt2img_options).update(self.txt2img)
+        return self.txt2img_options
+
+    def get_image_generator(self):
+        """
+        This function loads the txt2img model, sampler and watermark encoder the first time it is called
+        and reuses them for every line after that. If the context has a service url, images are rendered
+        by that scripts/generation_server.py instead and no model is loaded here.
+        Returns:
+            ImageGenerator, or a GenerationClient with the same make_images
+        """
+        options = self.get_txt2img_options()
+        with self.lock:
+            if self.image_generator is None and self.service:
+                from scripts.generation_server import GenerationClient
+
+                print(f"Rendering with the generation server at {self.service}")
+                self.image_generator = GenerationClient(self.service, priority=self.service_priority)
+            if self.image_generator is None:
+                from scripts.txt2img import ImageGenerator
+
+                print("Loading the txt2img model")
+                self.image_generator = ImageGenerator(options)
+        return self.image_generator
+
+    def get_text_encoder(self):
+        """
+        This function returns the CLIP text encoder the txt2img model is conditioned on. If the model is not loaded,
+        only the encoder is, so stories whose images are all cached never load the diffusion model.
+        Returns:
+            FrozenCLIPEmbedder
+        """
+        with self.lock:
+            if self.text_encoder is None:
+                if hasattr(self.image_generator, "model"):
+                    self.text_encoder = self.image_generator.model.cond_stage_model
+                else:
+                    from ldm.modules.encoders.modules import FrozenCLIPEmbedder
+
+                    print("Loading the CLIP text encoder")
+                    self.text_encoder = FrozenCLIPEmbedder()
+                    self.text_encoder.to(self.text_encoder.device)
+        return self.text_encoder
+
+    def close(self):
+        """
+        This function drops the loaded models so their memory can be freed.
+        Returns:
+            None
+        """
+        with self.lock:
+            self.paraphraser = None
+            self.image_generator = None
+            self.text_encoder = None
+
+
 @dataclass
 class Story:
     """
@@ -94,9 +205,11 @@ class Story:
     """
 
     file_path: str
-    global_prompt = GlobalPrompt()
-    id = uuid4()
-    file_prefix = id
+    global_prompt_prefix: str = None
+    global_prompt_suffix: str = None
+    context: PipelineContext = None
+    id = None
+    file_prefix = None
     end_time: str = None
     start_time: str = arrow.now()
     text: str = None
@@ -106,18 +219,73 @@ class Story:
     cache_path: str = "storyboard/cache/"
     last_updated = arrow.now().isoformat()
     ignore_cache = False
-    global_prompt_prefix = global_prompt.global_prompt_prefix()
-    global_prompt_suffix = global_prompt.global_prompt_suffix()
+    image_batch_size = 4
+    image_workers = 1
+    seed = 42
+    tts_backend: TTSBackend = field(default_factory=GTTSBackend)
+    audio_workers = 8
+    audio_retries = 3
+    queue_size = 16
+    scene_threshold = None
+    scene_max_lines = 8
+    prompt_cache_threshold = None
+    prompt_cache_refresh = 0.0
+    warm_start_strength = None
+    latents: dict = field(default_factory=dict)
+    asset_cache: AssetCache = field(default_factory=AssetCache)
+    prompt_cache: SemanticPromptCache = field(default_factory=SemanticPromptCache)
+    catalog: StoryCatalog = field(default_factory=StoryCatalog)
+    journal: StoryJournal = None
+    stats: PipelineStats = field(default_factory=PipelineStats)
 
     def __post_init__(self):
-        self.file_prefix = f"{self.id}_{self.file_prefix}"
+        self.id = uuid4()
+        self.file_prefix = f"{self.id}_{self.id}"
         print(f"story id for debugging purposes: {self.id}")
-        prefix_approval = input(f"Are you ok with this prompt prefix: {self.global_prompt_prefix}?")
-        if prefix_approval.lower().startswith("n"):
-            self.global_prompt_prefix = input("Enter your own prefix: ")
-        suffix_approval = input(f"Ok, but what about this suffix: {self.global_prompt_suffix}?")
-        if suffix_approval.lower().startswith("n"):
-            self.global_prompt_suffix = input("Enter your own suffix: ")
+        global_prompt = GlobalPrompt()
+        if self.global_prompt_prefix is None:
+            self.global_prompt_prefix = global_prompt.global_prompt_prefix()
+        if self.global_prompt_suffix is None:
+            self.global_prompt_suffix = global_prompt.global_prompt_suffix()
+        if self.context is None:
+            self.context = PipelineContext()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        This function builds a story from a config so a batch run needs no input, see configs/storyboard/example.yaml.
+        Args:
+            config: dict with story, prompt, tts, txt2img and paraphraser sections
+        Returns:
+            Story
+        """
+        story_options = dict(config.get("story") or {})
+        prompt_options = dict(config.get("prompt") or {})
+        tts_options = dict(config.get("tts") or {})
+        global_prompt = GlobalPrompt(artist=prompt_options.get("artist") or "Van Gogh")
+        story = cls(
+            story_options.pop("file_path"),
+            global_prompt_prefix=prompt_options.get("prefix") or global_prompt.global_prompt_prefix(),
+            global_prompt_suffix=prompt_options.get("suffix") or global_prompt.global_prompt_suffix(),
+            context=PipelineContext(
+                txt2img=dict(config.get("txt2img") or {}),
+                paraphraser_options=dict(config.get("paraphraser") or {}),
+                service=(config.get("service") or {}).get("url"),
+                service_priority=(config.get("service") or {}).get("priority") or "batch",
+            ),
+        )
+        resume = story_options.pop("resume", None)
+        for name, value in story_options.items():
+            if not hasattr(story, name):
+                raise KeyError(f"Unknown story option {name}")
+            setattr(story, name, value)
+        if tts_options.get("backend"):
+            # every backend takes its own options, only the section of the selected one is passed on
+            backend = tts_options["backend"]
+            story.tts_backend = TTS_BACKENDS[backend](**dict(tts_options.get(backend) or {}))
+        if resume:
+            story.resume(resume)
+        return story
 
     def get_text(self):
         """
@@ -127,8 +295,35 @@ class Story:
         Example:
             [{'text': 'This is the first line.'}, {'text': 'This is the second line.'}]
         """
+        for _ in self.iter_text():
+            pass
+        return self.story_dict
+
+    def iter_text(self):
+        """
+        This function parses the text file one line at a time, adding each line to the story dictionary
+        as soon as it has been paraphrased so the later stages can start on it.
+        If scene_threshold is set, every line is parsed first and grouped into shots with assign_scenes.
+        Yields:
+            tuple: the index of the line in the story dictionary and the line
+        Example:
+            (0, {'text': 'This is the first line.'})
+        """
+        if self.scene_threshold is None:
+            yield from self.iter_lines()
+            return
+        # a shot can only be cut once the lines after it are known
+        lines = sorted(self.iter_lines(), key=lambda item: item[0])
+        self.assign_scenes(lines)
+        yield from lines
+
+    def iter_lines(self):
+        """
+        This function parses and paraphrases the text file's lines, see iter_text.
+        Yields:
+            tuple: the index of the line in the story dictionary and the line
+        """
 
-        paraphrase_model = Paraphraser()
         print(f"Getting text from {self.file_path}")
         with open(self.file_path, "r") as text:
             story = [
@@ -138,26 +333,135 @@ class Story:
                    and line not in ["", " "]
             ]
 
-        story_dict = [
-            paraphrase({"text": line}, paraphrase_model)
-            for line in story
-            if len(line) > 0 or line != b""
-        ]
-        # remove any dictionaries that look like {"text": ""} or
-        story_dict = [line for line in story_dict if line["text"] != ""]
-        story_dict.append(
-            {"file_prefix": self.file_prefix, "file_path": self.file_path}
-        )
+        self.text = story
+        story = [line for line in story if len(line) > 0 or line != b""]
+        changed = self.diff_text(story)
+        for index, line in enumerate(self.story_dict):
+            if "text" in line:
+                # unchanged since the previous run, its assets are reused as they are
+                self.stats.record("text", index, cache="hit")
+                yield index, line
+        if changed:
+            paraphrase_model = self.context.get_paraphraser()
+            # paraphrase a chunk of lines at a time so the model works in full batches
+            # while the later stages can already start on the first lines
+            for start in range(0, len(changed), paraphrase_model.batch_size):
+                chunk = changed[start:start + paraphrase_model.batch_size]
+                wall, cpu = time.perf_counter(), time.thread_time()
+                paraphrased = paraphrase_model.paraphrase_lines([source for _, source in chunk])
+                wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+                for (index, _), text in zip(chunk, paraphrased):
+                    # a line that paraphrases to "" keeps its place but gets no assets
+                    self.update_line(index, text=text)
+                    self.stats.record(
+                        "text", index, wall=wall / len(chunk), cpu=cpu / len(chunk), cache="miss", batch=len(chunk)
+                    )
+                    yield index, self.story_dict[index]
         print("Caching story")
         self.cache_story()
         print("Text parsed")
-        self.text = story
-        self.story_dict = story_dict
-        return story_dict
+
+    def diff_text(self, story):
+        """
+        This function diffs the text file's lines against the lines of the previous run, if the story was resumed.
+        Lines are identified by a hash of their text rather than their index, so unchanged lines keep their
+        paraphrase, audio and image wherever they moved to, and only inserted or modified lines are left to
+        regenerate. The new story dictionary replaces the journal's.
+        Args:
+            story: list of str the lines of the text file
+        Returns:
+            list: (index, text) tuples of the lines that need paraphrasing
+        """
+        previous = [] if self.ignore_cache else [
+            line for line in self.story_dict or [] if line.get("id") and line.get("text") is not None
+        ]
+        ids = self.line_ids(story)
+        self.story_dict = [{"id": line_id} for line_id in ids]
+        matcher = difflib.SequenceMatcher(None, [line["id"] for line in previous], ids, autojunk=False)
+        counts = {}
+        for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            counts[tag] = counts.get(tag, 0) + max(old_end - old_start, new_end - new_start)
+            if tag == "equal":
+                for old, new in zip(range(old_start, old_end), range(new_start, new_end)):
+                    # scenes are cut again on every run, the lines around this one may have changed
+                    self.story_dict[new] = {k: v for k, v in previous[old].items() if k != "scene"}
+        if previous:
+            print(
+                f"Text diffed against the previous run: {counts.get('equal', 0)} unchanged, "
+                f"{counts.get('insert', 0)} inserted, {counts.get('replace', 0)} modified, "
+                f"{counts.get('delete', 0)} deleted"
+            )
+        self.story_dict.append({"file_prefix": self.file_prefix, "file_path": self.file_path})
+        self.get_journal().replace(self.story_dict)
+        self.catalog.add_story(
+            self.id,
+            file_prefix=self.file_prefix,
+            file_path=self.file_path,
+            prompt_prefix=self.global_prompt_prefix,
+            prompt_suffix=self.global_prompt_suffix,
+        )
+        self.catalog.replace_lines(self.id, [self.catalog_fields(line) for line in self.story_dict[:-1]])
+        return [(index, source) for index, source in enumerate(story) if "text" not in self.story_dict[index]]
+
+    def assign_scenes(self, lines):
+        """
+        This function merges runs of semantically similar adjacent lines into shots. Every line gets a scene key,
+        the index of the line that opens its shot, and only that line's image is rendered. The other lines of
+        the shot keep their own audio and hold the shot's image while it plays.
+        Args:
+            lines: list of (index, line) tuples in story order
+        Returns:
+            None
+        """
+        texted = [(index, line) for index, line in lines if line.get("text")]
+        if not texted:
+            return
+        with self.stats.measure("scenes", -1) as record:
+            record["batch"] = len(texted)
+            embeddings = embed_texts(self.context.get_text_encoder(), [line["text"] for _, line in texted])
+            scenes = group_scenes(embeddings, self.scene_threshold, self.scene_max_lines)
+        for scene in scenes:
+            first = texted[scene[0]][0]
+            for position in scene:
+                self.update_line(texted[position][0], scene=first)
+        print(f"Grouped {len(texted)} lines into {len(scenes)} shots")
+
+    @staticmethod
+    def line_ids(story):
+        """
+        This function gives every line an id from a hash of its text. A repeated line gets a numbered id for
+        each repeat, so no two lines of a story write the same files.
+        Args:
+            story: list of str
+        Returns:
+            list of str
+        """
+        seen = {}
+        ids = []
+        for line in story:
+            digest = hashlib.sha256(line.encode("utf-8")).hexdigest()[:16]
+            seen[digest] = seen.get(digest, 0) + 1
+            ids.append(digest if seen[digest] == 1 else f"{digest}_{seen[digest] - 1}")
+        return ids
+
+    @staticmethod
+    def line_name(index, line):
+        """
+        This function names a line's files after its id, falling back to its index for lines recorded before
+        lines had ids.
+        Args:
+            index: int the index of the line in the story
+            line: dict the line
+        Returns:
+            str
+        """
+        return line.get("id", index)
 
     def generate_audio(self):
         """
-        This function takes the story dictionary and generates audio for each line using gTTS.
+        This function takes the story dictionary and generates audio for each line with the story's tts backend.
+        Lines are synthesized concurrently by at most audio_workers threads, and each line is retried
+        audio_retries times before it is given up on.
         Args:
             story_dict:
 
@@ -175,53 +479,150 @@ class Story:
             print("Audio folder not found, creating it")
             os.makedirs(f"storyboard/audio/{self.file_prefix}")
         print("Audio folder found")
-        for index, line in enumerate(self.story_dict):
-            # check if the audio file already exists
-            # if it does, skip it
-            # if not, generate the audio file
-            # skip the last modified key
-            if not line.get("text"):
-                print(f"Skipping {line} as there is no text for this index")
+        with ThreadPoolExecutor(max_workers=self.audio_workers) as executor:
+            futures = [
+                executor.submit(self.audio_for_line, index, line) for index, line in enumerate(self.story_dict)
+            ]
+        for index, future in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(e)
+                print(f"Audio for line {index} could not be generated")
+        print("Audio generated")
+        self.cache_story()
+
+    def audio_for_line(self, index, line):
+        """
+        This function generates the audio for one line unless it is already cached.
+        Args:
+            index: int the index of the line in the story
+            line: dict the line
+        Returns:
+            the line with an audio key if its audio exists
+        """
+        # check if the audio file already exists
+        # if it does, skip it
+        # if not, generate the audio file
+        # skip the last modified key
+        extension = self.tts_backend.extension
+        name = self.line_name(index, line)
+        if not line.get("text"):
+            print(f"Skipping {line} as there is no text for this index")
+            return line
+        with self.stats.measure("audio", index) as record:
+            record["cache"] = "hit"
             if not self.ignore_cache:
                 print(f"Checking for audio file for line {index}")
                 if os.path.exists(
-                        f"storyboard/audio/{self.file_prefix}/audio_{index}.mp3"
+                        f"storyboard/audio/{self.file_prefix}/audio_{name}{extension}"
                 ):
                     print(f"Audio file for line {index} found")
-                    line["audio"] = f"audio_{index}.mp3"
-                    continue
+                    self.update_line(index, audio=f"audio_{name}{extension}")
+                    return line
+                if self.asset_cache.get(
+                        self.audio_cache_key(line),
+                        extension,
+                        destination=f"storyboard/audio/{self.file_prefix}/audio_{name}{extension}",
+                ):
+                    print(f"Audio file for line {index} found in the asset cache")
+                    self.update_line(index, audio=f"audio_{name}{extension}")
+                    return line
 
+            record["cache"] = "miss"
             try:
                 print(f"Audio file for line {index} not found, generating it")
-                tts = gTTS(text=line["text"], lang="en")
-                tts.save(f"storyboard/audio/{self.file_prefix}/audio_{index}.mp3")
-                line["audio"] = f"storyboard/audio/{self.file_prefix}/audio_{index}.mp3"
+                audio = synthesize(
+                    self.tts_backend,
+                    line["text"],
+                    f"storyboard/audio/{self.file_prefix}/audio_{name}{extension}",
+                    retries=self.audio_retries,
+                )
+                record["bytes"] = os.path.getsize(audio)
+                self.asset_cache.put(self.audio_cache_key(line), extension, audio)
+                self.update_line(index, audio=audio)
             except Exception as e:
                 print(e)
                 print(f"Audio file for line {index} could not be generated, {line}")
-        print("Audio generated")
-        self.cache_story()
+        return line
+
+    def audio_cache_key(self, line):
+        """
+        This function builds the asset cache key for a line's audio from its text and the tts backend's voice.
+        Args:
+            line: dict the line
+        Returns:
+            str
+        """
+        return asset_key(text=line["text"], voice=repr(self.tts_backend))
+
+    def get_journal(self):
+        """
+        This function opens the story's journal, replaying any progress already recorded for this story.
+        Returns:
+            StoryJournal
+        """
+        if self.journal is None:
+            self.cache_path = f"storyboard/cache/{self.file_prefix}.json"
+            self.journal = StoryJournal(f"storyboard/cache/{self.file_prefix}")
+        return self.journal
+
+    def update_line(self, index, **fields):
+        """
+        This function sets fields on a line and appends the change to the story's journal.
+        Args:
+            index: int the index of the line in the story
+            **fields: the values to set on the line
+        Returns:
+            None
+        """
+        self.story_dict[index].update(fields)
+        self.get_journal().record(index, **fields)
+        self.catalog.update_line(self.id, index, **self.catalog_fields(fields))
+        self.last_updated = arrow.now().isoformat()
+
+    def catalog_fields(self, fields):
+        """
+        This function translates a line's fields to the catalog's columns, with the audio as a full path.
+        Args:
+            fields: dict fields of a line
+        Returns:
+            dict
+        """
+        fields = dict(fields)
+        if "id" in fields:
+            fields["line_id"] = fields.pop("id")
+        if fields.get("audio"):
+            fields["audio"] = self.get_audio_path(fields)
+        return fields
+
+    def resume(self, story_id):
+        """
+        This function picks up a story where a previous run left off by replaying its journal.
+        Args:
+            story_id: str the id printed by the run being resumed
+        Returns:
+            list: the story dictionary as it was recorded
+        """
+        self.id = story_id
+        self.file_prefix = f"{story_id}_{story_id}"
+        self.journal = None
+        self.story_dict = [dict(line) for line in self.get_journal().lines]
+        print(f"Resuming story {story_id} with {len(self.story_dict)} recorded lines")
+        return self.story_dict
 
     def cache_story(self):
         """
-        This function takes the story dictionary and caches the story as a json file.
+        This function compacts the story's journal into the json snapshot of the story dictionary.
+        Progress is recorded line by line as it happens with update_line, so this only bounds the journal's size.
 
         Returns:
             None
         """
 
         print("let's cache this story")
-        self.cache_path = f"storyboard/cache/{self.file_prefix}.json"
-        if not os.path.exists(self.cache_path):
-            print("Cache file not found, creating it")
-            with open(self.cache_path, "w") as cache:
-                json.dump(self.story_dict, cache)
         try:
-            with open(self.cache_path, "w") as story:
-                # find the last_updated key
-                # if it exists, update it
-                # if not, add it
-                json.dump(self.story_dict, story)
+            self.get_journal().compact()
             print("Story cached")
             self.last_updated = arrow.now().isoformat()
             self.cached = True
@@ -247,45 +648,302 @@ class Story:
         # check if the images folder exists
         # if not, create it
 
-        for index, line in enumerate(self.story_dict):
-            # check if the image file already exists
-            # if it does, skip it
-            # if not, generate the image file
-            # skip the last modified key
-            if not self.ignore_cache:
-                print(f"Checking for image file for line {index}")
-                if os.path.exists(
-                        f"outputs/txt2img-samples/image_{self.file_prefix}_image_{index}.png"
-                ):
-                    print(f"Image file for line {index} found")
-                    line[
-                        "image"
-                    ] = f"outputs/txt2img-samples/image_{self.file_prefix}_image_{index}.png"
-                    continue
-            try:
-                print(f"Image file for line {index} not found, generating it")
-                # run the txt2img.py script with the line text as the prompt
-                filename = self.generate_path_from_script(
-                    f'{line["text"]}'.replace(":", " "),
-                    index,
+        self.check_warm_start()
+        uncached = [
+            (index, line)
+            for index, line in enumerate(self.story_dict)
+            if not self.check_image_cache(index, line)
+        ]
+        for start in range(0, len(uncached), self.image_batch_size):
+            self.render_images(uncached[start:start + self.image_batch_size])
+
+        self.cache_story()
+
+    def check_image_cache(self, index, line):
+        """
+        This function checks whether a line already has its image.
+        Args:
+            index: int the index of the line in the story
+            line: dict the line
+        Returns:
+            bool: True if the line needs no image rendered, either because it is cached or has no text
+        """
+        # skip the last modified key
+        if not line.get("text"):
+            return True
+        if line.get("scene", index) != index:
+            # shown with the image of the line that opens its shot
+            return True
+        name = self.line_name(index, line)
+        if not self.ignore_cache:
+            print(f"Checking for image file for line {index}")
+            if os.path.exists(
+                    f"outputs/txt2img-samples/image_{self.file_prefix}_image_{name}.png"
+            ):
+                print(f"Image file for line {index} found")
+                self.update_line(
+                    index, image=f"outputs/txt2img-samples/image_{self.file_prefix}_image_{name}.png"
                 )
-                line[
-                    "image"
-                ] = f"outputs/txt2img-samples/image_{self.file_prefix}_image_{index}.png"
-                print(f"Image file for line {index} generated")
-                # overlay the prompt on the image
-                # save the image
-                self.overlay_prompt(line["text"], filename)
-            except Exception as e:
-                print(e)
+                self.stats.record("images", index, cache="hit")
+                return True
+            os.makedirs("outputs/txt2img-samples", exist_ok=True)
+            if self.asset_cache.get(
+                    self.image_cache_key(line),
+                    ".png",
+                    destination=f"outputs/txt2img-samples/image_{self.file_prefix}_image_{name}.png",
+            ):
+                print(f"Image file for line {index} found in the asset cache")
+                self.update_line(
+                    index, image=f"outputs/txt2img-samples/image_{self.file_prefix}_image_{name}.png"
+                )
+                self.stats.record("images", index, cache="hit")
+                return True
+        return False
+
+    def image_cache_key(self, line):
+        """
+        This function builds the asset cache key for a line's image from everything that changes what gets rendered.
+        Args:
+            line: dict the line
+        Returns:
+            str
+        """
+        return asset_key(
+            text=line["text"],
+            prefix=self.global_prompt_prefix,
+            suffix=self.global_prompt_suffix,
+            seed=self.seed,
+            **self.render_options(),
+        )
+
+    def check_warm_start(self):
+        """
+        This function turns warm start off when the images are rendered by a generation server, which neither
+        starts a line from a latent nor returns the final latent of a line.
+        Returns:
+            None
+        """
+        if self.warm_start_strength and self.context.service:
+            print(f"Warm start is not supported by the generation server at {self.context.service}, "
+                  "every line is rendered from noise")
+            self.warm_start_strength = None
+
+    def render_options(self):
+        """
+        This function collects the txt2img options that change what any prompt renders.
+        Returns:
+            dict
+        """
+        opt = self.context.get_txt2img_options()
+        options = dict(
+            steps=opt.ddim_steps,
+            scale=opt.scale,
+            eta=opt.ddim_eta,
+            sampler="plms" if opt.plms else "ddim",
+            H=opt.H,
+            W=opt.W,
+            checkpoint=checkpoint_fingerprint(opt.ckpt),
+        )
+        if self.warm_start_strength:
+            # the line a warm started image continues from is not part of the key,
+            # only that it was rendered in this mode
+            options["warm_start"] = self.warm_start_strength
+        return options
+
+    def reuse_similar_images(self, batch):
+        """
+        This function looks each line's prompt up in the semantic prompt cache. A line whose prompt's CLIP embedding
+        is within prompt_cache_threshold of a prompt already rendered reuses that image, before its caption,
+        and if prompt_cache_refresh is set the image is refined towards the new prompt with a short img2img pass.
+        Args:
+            batch: list of (index, line) tuples
+        Returns:
+            tuple: the lines left to render, the (index, line) and image path of the lines to refresh,
+            and every line's prompt embedding by index
+        """
+        prompts = [self.prompt_for(line["text"]) for _, line in batch]
+        with self.stats.measure("prompt_embedding", -1) as record:
+            record["batch"] = len(batch)
+            embeddings = embed_texts(self.context.get_text_encoder(), prompts)
+        scope = asset_key(**self.render_options())
+        pending, refresh = [], []
+        for (index, line), embedding in zip(batch, embeddings):
+            with self.stats.measure("prompt_cache", index) as record:
+                key, similarity = self.prompt_cache.lookup(embedding, scope, self.prompt_cache_threshold)
+                filename = f"outputs/txt2img-samples/image_{self.file_prefix}_image_{self.line_name(index, line)}.png"
+                if key is None or not self.asset_cache.get(key, ".png", destination=filename):
+                    record["cache"] = "miss"
+                    pending.append((index, line))
+                    continue
+                record["cache"] = "hit"
+                print(f"Image for line {index} reused from a prompt {similarity:.3f} similar")
+                if self.prompt_cache_refresh:
+                    refresh.append(((index, line), filename))
+                else:
+                    self.finish_image(index, line, filename)
+        return pending, refresh, dict(zip([index for index, _ in batch], embeddings))
+
+    def render_images(self, batch):
+        """
+        This function renders the images for a batch of lines in one sampling call and overlays their text.
+        Args:
+            batch: list of (index, line) tuples
+        Returns:
+            the batch, with an image key on every line that was rendered
+        """
+        pending, refresh, embeddings = batch, [], {}
+        if self.prompt_cache_threshold is not None:
+            self.stats.set(prompt_cache_threshold=self.prompt_cache_threshold)
+            pending, refresh, embeddings = self.reuse_similar_images(batch)
+        rendered = []
+        if pending:
+            print(f"Image files for lines {[index for index, _ in pending]} not found, generating them")
+            rendered.extend(self.render_lines(pending) if not self.warm_start_strength else self.warm_start(pending))
+        if refresh:
+            # refreshed images are left out of the warm start chain
+            print(f"Refreshing the reused images of lines {[index for (index, _), _ in refresh]}")
+            timings = {}
+            filenames = self.generate_paths_from_script(
+                [(self.line_name(index, line), f'{line["text"]}'.replace(":", " ")) for (index, line), _ in refresh],
+                timings=timings,
+                init_images=[filename for _, filename in refresh],
+                strength=self.prompt_cache_refresh,
+            )
+            self.record_render([item for item, _ in refresh], timings)
+            rendered.extend(zip([item for item, _ in refresh], filenames))
+        for (index, line), filename in rendered:
+            if filename is None:
                 print(f"Image file for line {index} could not be generated, {line}")
+                continue
+            if index in embeddings:
+                # remember the image before its caption is drawn on it, so any line can reuse it
+                key = asset_key(uncaptioned=self.image_cache_key(line))
+                self.asset_cache.put(key, ".png", filename)
+                self.prompt_cache.add(key, asset_key(**self.render_options()), embeddings[index])
+            self.finish_image(index, line, filename)
+        return batch
 
-        self.cache_story()
+    def render_lines(self, batch, init_latents=None):
+        """
+        This function renders a batch of lines from noise, or from init_latents, in one sampling call.
+        Args:
+            batch: list of (index, line) tuples
+            init_latents: list of latents to start each line from, see ImageGenerator.make_images
+        Returns:
+            list: ((index, line), image path) tuples
+        """
+        timings = {}
+        latents = [] if self.warm_start_strength else None
+        kwargs = dict(init_latents=init_latents, strength=self.warm_start_strength) if init_latents else {}
+        if self.prompt_cache_threshold is None:
+            # caption each image before it is first saved, the prompt cache needs them saved without one
+            kwargs["postprocess"] = lambda image, position: caption(image, batch[position][1]["text"])
+        filenames = self.generate_paths_from_script(
+            [(self.line_name(index, line), f'{line["text"]}'.replace(":", " ")) for index, line in batch],
+            timings=timings,
+            latents=latents,
+            **kwargs,
+        )
+        self.record_render(batch, timings, cache="miss")
+        for (index, _), latent in zip(batch, latents or []):
+            self.latents[index] = latent
+        return list(zip(batch, filenames))
+
+    def warm_start(self, batch):
+        """
+        This function renders a batch of lines, starting each line from the final latent of the line rendered
+        before it, noised to warm_start_strength, so it only runs that fraction of the ddim steps and follows on
+        visually. A line whose previous line is in the same batch waits for it, so consecutive lines render in
+        waves, and a line whose previous line's latent is unknown, e.g. because its image was cached,
+        starts from noise.
+        Args:
+            batch: list of (index, line) tuples
+        Returns:
+            list: ((index, line), image path) tuples
+        """
+        rendered = []
+        while batch:
+            waiting = {index for index, _ in batch}
+            wave = [(index, line) for index, line in batch if self.previous_line(index) not in waiting]
+            batch = [(index, line) for index, line in batch if self.previous_line(index) in waiting]
+            cold = [(index, line) for index, line in wave if self.previous_line(index) not in self.latents]
+            warm = [(index, line) for index, line in wave if self.previous_line(index) in self.latents]
+            if cold:
+                rendered.extend(self.render_lines(cold))
+            if warm:
+                print(f"Warm starting lines {[index for index, _ in warm]} from the lines before them")
+                init_latents = [self.latents.pop(self.previous_line(index)) for index, _ in warm]
+                rendered.extend(self.render_lines(warm, init_latents=init_latents))
+        return rendered
+
+    def previous_line(self, index):
+        """
+        This function finds the closest line before index that renders its own image.
+        Args:
+            index: int the index of the line in the story
+        Returns:
+            int the previous line's index, or -1 if there is none
+        """
+        previous = index - 1
+        while previous >= 0 and (
+            not self.story_dict[previous].get("text") or self.story_dict[previous].get("scene", previous) != previous
+        ):
+            previous -= 1
+        return previous
+
+    def record_render(self, batch, timings, cache=None):
+        """
+        This function gives every line of a rendered batch an equal share of the batch's txt2img timings.
+        Args:
+            batch: list of (index, line) tuples
+            timings: dict filled by ImageGenerator.make_images
+            cache: str recorded on the sampling phase
+        Returns:
+            None
+        """
+        for index, _ in batch:
+            for phase in ("sampling", "decode", "save"):
+                if phase in timings:
+                    wall, cpu = timings[phase]
+                    self.stats.record(
+                        phase,
+                        index,
+                        wall=wall / len(batch),
+                        cpu=cpu / len(batch),
+                        bytes=timings.get("bytes", 0) // len(batch) if phase == "save" else 0,
+                        cache=cache if phase == "sampling" else None,
+                        batch=len(batch),
+                    )
+
+    def finish_image(self, index, line, filename):
+        """
+        This function overlays a line's text on its image, unless it was captioned as it was rendered,
+        caches the image and records it on the line.
+        Args:
+            index: int the index of the line in the story
+            line: dict the line
+            filename: str the line's image
+        Returns:
+            None
+        """
+        try:
+            print(f"Image file for line {index} generated")
+            # overlay the prompt on the image
+            # save the image
+            if self.prompt_cache_threshold is not None:
+                with self.stats.measure("overlay", index) as record:
+                    self.overlay_prompt(line["text"], filename)
+                    record["bytes"] = os.path.getsize(filename)
+            self.asset_cache.put(self.image_cache_key(line), ".png", filename)
+            self.update_line(index, image=filename)
+        except Exception as e:
+            print(e)
+            print(f"Image file for line {index} could not be generated, {line}")
 
     @staticmethod
     def overlay_prompt(text, file):
         """
-        This function overlays the prompt on the image.
+        This function overlays the prompt on an image that was saved without it.
         Args:
             text: str the prompt to overlay
             file: str the path to the image file
@@ -295,152 +953,180 @@ class Story:
         Side Effects:
             Overlays the prompt on the image and saves it.
         """
-        # load the image
-        # create a font
-
-        image = Image.open(file)
-        draw = ImageDraw.Draw(image)
-        font_size = 36
-        font = ImageFont.truetype("Arial", font_size)
+        caption_file(text, file)
 
-        textwidth, textheight = draw.textsize(text, font)
-
-        image_width, image_height = image.size
-        # Adjust font size if text is too wide
-        while textwidth > image_width:
-            font_size -= 1
-            font = ImageFont.truetype("Arial", font_size)
-            textwidth, textheight = draw.textsize(text, font)
-
-        x = (image_width - textwidth) / 2
-        y = 0
-
-        draw.text((x - 1, y - 1), text, font=font, fill=(0, 0, 0))
-        draw.text((x + 1, y - 1), text, font=font, fill=(0, 0, 0))
-        draw.text((x - 1, y + 1), text, font=font, fill=(0, 0, 0))
-        draw.text((x + 1, y + 1), text, font=font, fill=(0, 0, 0))
-        draw.text((x, y), text, font=font, fill=(255, 255, 255))
+    def line_seed(self, text):
+        """
+        This function derives a line's seed from the story seed and the line's text, so the same line renders
+        the same image in any batch, at any index and in any story.
+        Args:
+            text: str the line text
+        Returns:
+            int
+        """
+        return (self.seed + zlib.crc32(text.encode("utf-8"))) % 2 ** 32
 
-        image.save(file)
+    def prompt_for(self, text):
+        """
+        This function wraps a line's text in the global prompt prefix and suffix.
+        Args:
+            text: str the line text
+        Returns:
+            str
+        """
+        return f"{self.global_prompt_prefix}, {text} {self.global_prompt_suffix}"
 
-    def generate_path_from_script(self, text, line_index):
+    def generate_paths_from_script(self, batch, timings=None, **kwargs):
         """
-        This function runs the txt2img.py script with the line text as the prompt.
+        This function renders a batch of lines in a single txt2img sampling call with the in-process generator.
+        Each line is seeded from its text with line_seed.
         Args:
-            text: str the prompt to overlay
-            line_index: int the index of the line in the story
+            batch: list of (line_name, text) tuples, the images are named after line_name
+            timings: dict filled with the time spent in each phase of txt2img
+            **kwargs: passed on to ImageGenerator.make_images, e.g. init_images and strength
         Returns:
-            the path to the image file generated by the script
+            the paths to the image files generated by txt2img, in the same order as the batch
         """
-        script_file = "scripts/txt2img.py"
-        prompt = f"{self.global_prompt_prefix}, {text} {self.global_prompt_suffix}"
-        print(f"Running {script_file} with {prompt}")
+        prompts = [self.prompt_for(text) for _, text in batch]
+        print(f"Running txt2img with {prompts}")
         try:
-            subprocess.run(
-                [
-                    "python",
-                    script_file,
-                    "--prompt",
-                    prompt,
-                    "--n_samples",
-                    "1",
-                    "--n_iter",
-                    "1",
-                    "--plms",
-                    "--name",
-                    f"{self.file_prefix}_image_{line_index}",
-                ]
+            return self.context.get_image_generator().make_images(
+                prompts,
+                [f"{self.file_prefix}_image_{line_name}" for line_name, _ in batch],
+                [self.line_seed(text) for _, text in batch],
+                timings=timings,
+                **kwargs,
             )
         except Exception as e:
             print(e)
-            print(f"Image file for {line_index} could not be generated")
-            return None
-        return (
-            f"outputs/txt2img-samples/image_{self.file_prefix}_image_{line_index}.png"
-        )
+            print(f"Image files for {[line_name for line_name, _ in batch]} could not be generated")
+            return [None] * len(batch)
 
     def generate_video(self):
         """
-        This function uses the story dictionary to generate a video using moviepy.
+        This function uses the story dictionary to stream every line's image and audio into the final video in one pass.
+        Each image is encoded once and held for the duration of its audio, so no per line videos are written.
         Args:
             story_dict:
             [{'text': 'This is the first line.', 'audio': 'audio_0.mp3', 'image': 'image_0.png'},
             {'text': 'This is the second line.', 'audio': 'audio_1.mp3', 'image': 'image_1.png'}]
 
         Returns:
-            video.mp4
+            final_video.mp4
 
         """
-        # check if the video folder exists
+        # check if the final video folder exists
         # if not, create it
-        print("Checking for video folder")
-        if not os.path.exists(f"storyboard/video/{self.file_prefix}"):
-            print("Video folder not found, creating it")
-            os.makedirs(f"storyboard/video/{self.file_prefix}")
+        output_path = f"storyboard/final_video/{self.file_prefix}"
+        output_file = f"{output_path}/final_video.mp4"
+        print("Checking for final video folder")
+        if not os.path.exists(output_path):
+            print("Final video folder not found, creating it")
+            os.makedirs(output_path)
         else:
-            print("Video folder found")
-        for index, line in enumerate(self.story_dict):
-            line["video"] = f"storyboard/video/{index}.mp4"
-            if line.get("last_updated"):
-                continue
-            if not self.ignore_cache:
-                print(f"Checking for video file for line {index}")
-                if os.path.exists(f"storyboard/video/{self.file_prefix}/{index}.mp4"):
-                    print(f"Video file for line {index} found")
-                    continue
-            try:
-                try:
-                    audio_clip = AudioFileClip(
-                        f"storyboard/audio/{self.file_prefix}/{line['audio']}"
-                    )
-                except Exception as e:
-                    audio_clip = AudioFileClip(line["audio"])
-                image_clip = ImageClip(
-                    line["image"], duration=audio_clip.duration
-                ).set_audio(audio_clip)
-                image_clip.write_videofile(
-                    f"storyboard/video/{self.file_prefix}/{index}.mp4", fps=24
-                )
-            except Exception as e:
-                print(e)
-                continue
+            print("Final video folder found")
+        with StreamingVideoAssembler(output_file) as assembler:
+            for index, line in enumerate(self.story_dict):
+                self.add_line_to_video(assembler, index, line)
         self.cache_story()
+        self.catalog.add_story(self.id, final_video=output_file)
+        self.stats.write(output_path)
+        return output_file
 
-    def concatenate_videos(self):
+    def add_line_to_video(self, assembler, index, line):
         """
-        This function concatenates all the videos into one final video.
+        This function appends one line's image and audio to the final video.
         Args:
-            video_directory: str the directory containing the videos to concatenate
-            output_file: str the path to the output file
+            assembler: StreamingVideoAssembler writing the final video
+            index: int the index of the line in the story
+            line: dict the line
         Returns:
             None
         """
-        # Get a list of all the video files in the directory
-        import re
+        image = self.story_dict[line.get("scene", index)].get("image")
+        if not image or not line.get("audio"):
+            print(f"Skipping line {index} as it has no image or audio")
+            return
+        try:
+            print(f"Adding line {index} to the final video")
+            with self.stats.measure("video", index):
+                self.update_line(index, duration=assembler.add(image, self.get_audio_path(line)))
+        except Exception as e:
+            print(e)
+            print(f"Line {index} could not be added to the final video, {line}")
 
-        video_directory = f"storyboard/video/{self.file_prefix}/"
+    def run_pipeline(self):
+        """
+        This function runs every stage of the story at once. Lines flow from the text parser through the audio
+        and image stages on their own worker threads, and each line is appended to the final video as soon as
+        it and every line before it are ready.
+        Returns:
+            final_video.mp4
+        """
+        self.check_warm_start()
+        os.makedirs(f"storyboard/audio/{self.file_prefix}", exist_ok=True)
         output_path = f"storyboard/final_video/{self.file_prefix}"
-        output_file = f"storyboard/final_video/{self.file_prefix}/final_video.mp4"
-        video_files = [f for f in os.listdir(video_directory) if f.endswith(".mp4")]
-        # ensure that the files are in order from storyboard/video/0.mp4 to n and retain the order and path
-        # create the final video directory if it doesn't exist
-        if not os.path.exists(output_path):
-            os.makedirs(output_path)
-
-        video_files = sorted(
-            video_files, key=lambda x: int(re.search(r"\d+", x).group())
+        os.makedirs(output_path, exist_ok=True)
+        output_file = f"{output_path}/final_video.mp4"
+        pipeline = Pipeline(
+            [
+                Stage(
+                    "audio",
+                    lambda batch: [(index, self.audio_for_line(index, line)) for index, line in batch],
+                    workers=self.audio_workers,
+                ),
+                Stage(
+                    "images",
+                    self.render_images,
+                    workers=self.image_workers,
+                    batch_size=self.image_batch_size,
+                    skip=lambda item: self.check_image_cache(*item),
+                ),
+            ],
+            queue_size=self.queue_size,
         )
-        # Create the concat demuxer file
-        with open("concat_list.txt", "w") as f:
-            for video_file in video_files:
-                f.write(f"file {video_directory}/{video_file}'\n")
-        concat_file = "concat_list.txt"
-
-        # Use FFmpeg to combine the videos using the concat demuxer
-        command = f"ffmpeg -f concat -safe 0 -i {concat_file} -c copy {output_file}"
-        os.system(command)
-        # delete the concat demuxer file
-        os.remove(concat_file)
+        # lines can finish out of order, hold them back until every line before them has been added
+        finished = {}
+        next_index = 0
+        error = None
+        with StreamingVideoAssembler(output_file) as assembler:
+            try:
+                for index, line in pipeline.run(self.iter_text()):
+                    finished[index] = line
+                    while next_index in finished:
+                        self.add_line_to_video(assembler, next_index, finished.pop(next_index))
+                        next_index += 1
+            except Exception as e:
+                # the pipeline only raises once every line has left it, finish the video before raising
+                error = e
+            if finished:
+                # a line never came out of the pipeline, the lines after it are still added in order
+                missing = sorted(set(range(next_index, max(finished))) - set(finished))
+                print(f"Lines {missing} never finished and are missing from the video")
+                for index in sorted(finished):
+                    self.add_line_to_video(assembler, index, finished.pop(index))
+            with self.stats.measure("video_close", -1) as record:
+                assembler.close()
+                if os.path.exists(output_file):
+                    record["bytes"] = os.path.getsize(output_file)
+        self.latents.clear()
+        self.cache_story()
+        self.catalog.add_story(self.id, final_video=output_file)
+        self.stats.write(output_path)
+        if error is not None:
+            raise error
+        return output_file
+
+    def get_audio_path(self, line):
+        """
+        This function resolves a line's audio, which is either a path or a file name inside the story's audio folder.
+        Args:
+            line: dict a line of the story dictionary
+        Returns:
+            str the path to the audio file
+        """
+        audio_path = f"storyboard/audio/{self.file_prefix}/{line['audio']}"
+        return audio_path if os.path.exists(audio_path) else line["audio"]
 
     def check_if_final_video_exists(self):
         """
@@ -457,49 +1143,121 @@ class Story:
 
 @dataclass
 class Paraphraser:
-    model = BartForConditionalGeneration.from_pretrained("eugenesiow/bart-paraphrase")
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
-    tokenizer = BartTokenizer.from_pretrained("eugenesiow/bart-paraphrase")
+    model_name: str = "eugenesiow/bart-paraphrase"
+    batch_size: int = 16
+    cache_path: str = "storyboard/paraphrase_cache.jsonl"
+    generate_options: dict = field(default_factory=dict)
+    memo: dict = None
+    model = None
+    tokenizer = None
+    device = None
+
+    def load_model(self):
+        """
+        This function downloads and loads the paraphrasing model the first time it is needed.
+        Returns:
+            None
+        """
+        if self.model is None:
+            import torch
+            from transformers import BartForConditionalGeneration, BartTokenizer
+
+            print(f"Loading {self.model_name}")
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            self.model = BartForConditionalGeneration.from_pretrained(self.model_name).to(self.device)
+            self.tokenizer = BartTokenizer.from_pretrained(self.model_name)
+
+    def load_memo(self):
+        """
+        This function loads the paraphrases of every sentence seen before, keyed with sentence_key.
+        Returns:
+            dict
+        """
+        if self.memo is None:
+            self.memo = {}
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, "r") as cache:
+                    for entry in cache:
+                        with contextlib.suppress(json.JSONDecodeError):
+                            entry = json.loads(entry)
+                            self.memo[entry["key"]] = entry["text"]
+        return self.memo
+
+    def sentence_key(self, sentence):
+        """
+        This function hashes a sentence with the model and generation options that paraphrase it, so changing
+        either never returns a paraphrase made with the old ones.
+        Args:
+            sentence: str
+        Returns:
+            str
+        """
+        key = json.dumps([self.model_name, self.generate_options, sentence], sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def paraphrase_sentences(self, sentences):
+        """
+        This function paraphrases sentences in padded batches of batch_size, skipping any already in the memo
+        and appending new paraphrases to it on disk.
+        Args:
+            sentences: list of str
+        Returns:
+            list of str: the paraphrase of each sentence, in order
+        """
+        memo = self.load_memo()
+        missing = list(dict.fromkeys(s for s in sentences if self.sentence_key(s) not in memo))
+        if missing:
+            import torch
+
+            self.load_model()
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            print(f"Attempting to paraphrase {len(batch)} sentences")
+            tokens = self.tokenizer(batch, return_tensors="pt", padding=True, truncation=True).to(self.device)
+            with torch.no_grad():
+                generated_ids = self.model.generate(
+                    tokens["input_ids"], attention_mask=tokens["attention_mask"], **self.generate_options
+                )
+            generated = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+            with open(self.cache_path, "a") as cache:
+                for sentence, generated_sentence in zip(batch, generated):
+                    memo[self.sentence_key(sentence)] = generated_sentence
+                    cache.write(json.dumps({"key": self.sentence_key(sentence), "text": generated_sentence}) + "\n")
+        return [memo[self.sentence_key(s)] for s in sentences]
+
+    def paraphrase_lines(self, lines):
+        """
+        This function splits each line into sentences, paraphrases every sentence of every line together
+        and joins each line's paraphrased sentences back up.
+        Args:
+            lines: list of str
+        Returns:
+            list of str: the paraphrase of each line, in order
+        """
+        # split the lines into seperate sentences and paraprhase them all at once
+        split_lines = [[s.strip() for s in line.split(".") if s.strip()] for line in lines]
+        paraphrased = iter(self.paraphrase_sentences([s for sentences in split_lines for s in sentences]))
+        return [" ".join(next(paraphrased) for _ in sentences) for sentences in split_lines]
 
 
 def paraphrase(text_input: dict, paraphraser_model):
     """
     Takes a sentence and sums it up into a more cohesive idea using the BartForConditionalGeneration model.
+    Prefer Paraphraser.paraphrase_lines when there is more than one line, it batches every sentence together.
     Args:
         text_input:a dict with a "text" key
         paraphraser_model: an instance of a Paraphraser
 
     Returns:
-        the first index of the generated string
+        a dict with the paraphrased text under the "text" key
     """
-    # split the text_input into seperate sentences and paraprhase each
-    parapraph_split = text_input["text"].split(".")
-
-    output = []
-    for sentence in parapraph_split:
-        print(f"Attempting to paraphrase: {sentence}")
-        batch = paraphraser_model.tokenizer(sentence, return_tensors="pt")
-        generated_ids = paraphraser_model.model.generate(batch["input_ids"])
-        generated_sentence = paraphraser_model.tokenizer.batch_decode(
-            generated_ids, skip_special_tokens=True
-        )[0]
-        print(f"Paraphrased sentence: {sentence}")
-        output.append(sentence)
-    return {"text": "".join(output)}
+    return {"text": paraphraser_model.paraphrase_lines([text_input["text"]])[0]}
 
 
 def initiate_story(story):
-    print("Getting text...")
-    story.get_text()
-    print("Generating audio...")
-    story.generate_audio()
-    print("Generating images...")
-    story.generate_images()
-    print("Generating Video...")
-    story.generate_video()
-    print("Generating final video...")
-    story.concatenate_videos()
+    print("Generating text, audio, images and the final video...")
+    story.run_pipeline()
+    print_summary(story.stats.summary())
     story.end_time = arrow.now()
     elapsed_time = story.end_time - story.start_time
     print(
@@ -522,22 +1280,63 @@ def user_input():
     if not os.path.exists(file_path):
         print("File not found")
         exit()
-    users_story = Story(file_path)
+    artist = input(
+        "Enter an artist or press enter to use the default of Van Gogh"
+    ) or "Van Gogh"
+    global_prompt = GlobalPrompt(artist=artist)
+    global_prompt_prefix = global_prompt.global_prompt_prefix()
+    global_prompt_suffix = global_prompt.global_prompt_suffix()
+    prefix_approval = input(f"Are you ok with this prompt prefix: {global_prompt_prefix}?")
+    if prefix_approval.lower().startswith("n"):
+        global_prompt_prefix = input("Enter your own prefix: ")
+    suffix_approval = input(f"Ok, but what about this suffix: {global_prompt_suffix}?")
+    if suffix_approval.lower().startswith("n"):
+        global_prompt_suffix = input("Enter your own suffix: ")
+    users_story = Story(
+        file_path, global_prompt_prefix=global_prompt_prefix, global_prompt_suffix=global_prompt_suffix
+    )
+    story_id = input("Enter a story id to resume or press enter to start a new story")
+    if story_id:
+        users_story.resume(story_id)
     if users_story.check_if_final_video_exists():
-        print("Final video found, do you want to regenerate it?")
-        regenerate = input("Enter y or n")
-        if regenerate.lower().startswith("n"):
-            print("Exiting")
-            exit()
-        else:
+        print("Final video found, do you want to regenerate every line?")
+        regenerate = input("Enter y, or n to only regenerate the lines that changed in the text file")
+        if regenerate.lower().startswith("y"):
             users_story.ignore_cache = True
     return users_story
 
 
+def config_input(config_path):
+    """
+    Builds the story from a config file instead of asking for input, for batch runs.
+    Args:
+        config_path: str a yaml file like configs/storyboard/example.yaml
+    Returns:
+        Story
+    """
+    from omegaconf import OmegaConf
+
+    config_story = Story.from_config(OmegaConf.to_container(OmegaConf.load(config_path)))
+    if config_story.check_if_final_video_exists() and not config_story.ignore_cache:
+        print("Final video found, only the lines that changed in the text file will be regenerated")
+        print("Set story.ignore_cache to regenerate every line")
+    return config_story
+
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        type=str,
+        help="run without prompting, taking every option from this yaml file",
+    )
+    args = parser.parse_args()
     try:
-        story = user_input()
-        initiate_story(story)
+        story = config_input(args.config) if args.config else user_input()
+        with story.context:
+            initiate_story(story)
     except KeyboardInterrupt:
         print("Exiting...")
         exit()
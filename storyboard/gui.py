@@ -20,11 +20,11 @@ A 'Storyboard' is:
 - a final video
 - a cache directory
 The directory for each storyboard's audio files is located at:
-    storyboard/audio/<uuid>/audio_<index>.mp3
+    storyboard/audio/<uuid>/audio_<line id>.mp3
 The directory for each storyboard's video files is located at:
     storyboard/video/<uuid>/<index>.mp4 # TODO: change this to match the same file name format as audio
 The directory for each storyboard's image files is located at:
-    output/txt2img-samples/image_<id>_<id>_image_<index>.png # TODO: change this to match the same file name format as audio
+    output/txt2img-samples/image_<id>_<id>_image_<line id>.png # TODO: change this to match the same file name format as audio
 The directory for each storyboard's final video is located at:
     storyboard/final_video/<id>_<id>/final_video.mp4 #TODO: change this to match the same file name format as audio
 The directory for each storyboard's cache is located at:
@@ -42,6 +42,9 @@ import PIL.ImageTk
 from PIL import Image, ImageTk
 import subprocess
 import json
+import queue
+from storyboard.catalog import StoryCatalog
+from storyboard.thumbnails import ThumbnailCache, ThumbnailPager
 
 # create the main window
 root = tk.Tk()
@@ -52,19 +55,19 @@ root.geometry("1024x768")
 mainframe = ttk.Frame(root, padding="3 3 12 12")
 mainframe.grid(column=0, row=0, sticky=(tk.N, tk.W, tk.E, tk.S))
 mainframe.columnconfigure(0, weight=1)
+catalog = StoryCatalog()
+# stories cached before the catalog existed are imported once, the first time the GUI opens this catalog
+catalog.migrate_snapshots("storyboard/cache")
+
+
 # method to find all cached storyboards
 def find_cached_storyboards():
     """
-    Find all cached storyboards in the storyboard/cache directory.
+    Find all cached storyboards in the storyboard catalog.
     Returns:
-        A list of cached storyboards.
+        A list of cached storyboard ids, most recently updated first.
     """
-
-    # get the path to the cache directory
-    cache_dir = "storyboard/cache"
-
-    # get all the cached storyboards
-    cached_storyboards = [file for file in os.listdir(cache_dir)]
+    cached_storyboards = [story["id"] for story in catalog.stories()]
 
     # return the cached storyboards
     print(cached_storyboards)
@@ -103,34 +106,19 @@ def load_storyboard():
         A Storyboard object.
     """
 
-    # find the uuid from the cache path example: "/Users/joshwren/Code/playground/stable-diffusion/storyboard/cache/08e3d70c-fa2d-4e2b-9d9c-1b1c55712e9e_08e3d70c-fa2d-4e2b-9d9c-1b1c55712e9e.json"
-    story_id = None
-    try:
-        cache_path = cached_storyboards.get()
-        story_id = cache_path.split("/")[-1].split("_")[0]
-    except Exception:
-        # user may have manually entered a uuid
-        story_id = cached_storyboards.get()
-        cache_path = f"storyboard/cache/{story_id}_{story_id}.json"
-
-
-
-    images = [
-        image
-        for image in os.listdir("./outputs/txt2img-samples")
-        if story_id in str(image)
-    ] or []
-    # find the audio file directory for the uuid in the storyboard/audio/ directory
-    audio_dir = next(f"storyboard/audio/{_}" for _ in os.listdir("storyboard/audio") if story_id in _)
-    audio_files = [audio for audio in os.listdir(audio_dir) if audio.endswith(".mp3")] or []
-    # find the video file directory for the uuid in the storyboard/video/ directory
-    try:
-        video_dir = next(f"storyboard/video/{_}" for _ in os.listdir("storyboard/video") if story_id in _)
-        video_files = [video for video in os.listdir(video_dir) if video.endswith(".mp4")] or []
-    except Exception:
-        video_files = []
-    # find the final video file for the uuid in the storyboard/final_video/ directory
-    final_video = f"storyboard/final_video/{story_id}/{story_id}.mp4"
+    # the combobox holds story ids, but a cache path may have been entered by hand
+    story_id = cached_storyboards.get().split("/")[-1].split("_")[0].split(".json")[0]
+    story = catalog.story(story_id)
+    if story is None:
+        messagebox.showerror("Storyboard", f"No storyboard with the id {story_id} in the catalog")
+        return None
+    cache_path = f"storyboard/cache/{story['file_prefix']}.json"
+    lines = catalog.lines(story_id)
+    images = [line["image"] for line in lines if line["image"]]
+    audio_files = [line["audio"] for line in lines if line["audio"]]
+    # lines are no longer rendered to their own videos, the final video is streamed in one pass
+    video_files = []
+    final_video = story["final_video"]
     print(final_video)
     all_images(images)
     return StoryBoard(
@@ -156,97 +144,77 @@ load_cached_storyboard.grid(column=2, row=1, sticky=tk.W)
 # when load_cached_storyboard is clicked, load the storyboard object
 load_cached_storyboard["command"] = load_storyboard
 
-# display all images for the storyboard using PIL
+# display all images for the storyboard as thumbnails, one page at a time
 images = []
-def all_images(images):
+thumbnail_cache = ThumbnailCache()
+thumbnail_pager = None
+# pages loaded on the background thread, shown by the main loop since Tk is not thread safe
+loaded_pages = queue.Queue()
+thumbnail_frame = ttk.Frame(mainframe)
+thumbnail_frame.grid(column=1, row=2, sticky=(tk.W, tk.E))
+
+
+def all_images(story_images):
     """
-    Display all images for the storyboard using PIL.
+    Display the images of the storyboard as thumbnails, 10 at a time.
+    Thumbnails are loaded on a background thread, so the window stays responsive however many images there are.
     Args:
-
+        story_images: list of image paths, in story order
     Returns:
-
+        None
     """
-    global mainframe
-    image_dir = "./outputs/txt2img-samples"
-
-    # create a PIL image object for each image
-    processed_images = [PIL.Image.open(os.path.join(image_dir, image)) for image in images]
-
-    # create a Tkinter image object for each image
-    tk_images = [PIL.ImageTk.PhotoImage(image) for image in processed_images]
-
-    # display the images 10 at a time
-    starting_index = 0
-    # prevent too many files open error
-    ending_index = 10 if len(tk_images) > 10 else len(tk_images)
-    for image in tk_images[starting_index:ending_index]:
-        # create a label for the image
-        label = ttk.Label(mainframe, image=image)
-        label.image = image
-        label.grid(column=1, row=2, sticky=tk.W)
-        # add the label to the images list
-        images.append(label)
-
-    # when the user clicks the next button, display the next 10 images
-    def next_images():
-        """
-        Display the next 10 images.
-        Args:
-
-        Returns:
-
-        """
-        starting_index += 10
-        ending_index += 10
-        for image in tk_images[starting_index:ending_index]:
-            # create a label for the image
-            label = ttk.Label(mainframe, image=image)
-            label.image = image
-            label.grid(column=1, row=2, sticky=tk.W)
-            # add the label to the images list
-            images.append(label)
+    global thumbnail_pager
+    if thumbnail_pager is not None:
+        thumbnail_pager.close()
+    thumbnail_pager = ThumbnailPager(thumbnail_cache, story_images, page_size=10)
+    request_page(0)
 
-    # when the user clicks the previous button, display the previous 10 images
-    def previous_images():
-        """
-        Display the previous 10 images.
-        Args:
 
-        Returns:
+def request_page(page):
+    pager = thumbnail_pager
+    if pager is not None:
+        pager.request(page, lambda loaded, thumbnails: loaded_pages.put((pager, loaded, thumbnails)))
 
-        """
-        starting_index -= 10
-        ending_index -= 10
-        for image in tk_images[starting_index:ending_index]:
+
+def show_loaded_pages():
+    """
+    Display any page of thumbnails the background thread has finished loading.
+    """
+    while not loaded_pages.empty():
+        pager, page, thumbnails = loaded_pages.get()
+        if pager is not thumbnail_pager or page != pager.current:
+            # the user has moved on since this page was requested
+            continue
+        for label in images:
+            label.destroy()
+        images.clear()
+        for position, (path, thumbnail) in enumerate(thumbnails):
             # create a label for the image
-            label = ttk.Label(mainframe, image=image)
+            image = PIL.ImageTk.PhotoImage(thumbnail)
+            label = ttk.Label(thumbnail_frame, image=image)
             label.image = image
-            label.grid(column=1, row=2, sticky=tk.W)
+            label.grid(column=position % 5, row=position // 5, sticky=tk.W)
             # add the label to the images list
             images.append(label)
-
-    # widget to display the next 10 images
-    next_images = ttk.Button(mainframe, text="Next Images")
-    next_images.grid(column=2, row=2, sticky=tk.W)
-    # when next_images is clicked, display the next 10 images
-    next_images["command"] = next_images
-
-    # widget to display the previous 10 images
-    previous_images = ttk.Button(mainframe, text="Previous Images")
-    previous_images.grid(column=2, row=2, sticky=tk.W)
-    # when previous_images is clicked, display the previous 10 images
-    previous_images["command"] = previous_images
-
-
-
-
-
-
-
+        page_label["text"] = f"Page {page + 1} of {pager.page_count}"
+    root.after(50, show_loaded_pages)
 
 
+# widget to display the next 10 images
+next_images = ttk.Button(mainframe, text="Next Images")
+next_images.grid(column=2, row=3, sticky=tk.W)
+# when next_images is clicked, display the next 10 images
+next_images["command"] = lambda: thumbnail_pager and request_page(thumbnail_pager.current + 1)
 
+# widget to display the previous 10 images
+previous_images = ttk.Button(mainframe, text="Previous Images")
+previous_images.grid(column=1, row=3, sticky=tk.W)
+# when previous_images is clicked, display the previous 10 images
+previous_images["command"] = lambda: thumbnail_pager and request_page(thumbnail_pager.current - 1)
 
+page_label = ttk.Label(mainframe, text="")
+page_label.grid(column=1, row=4, sticky=tk.W)
+root.after(50, show_loaded_pages)
 
 # widget to display the images
 display_images = ttk.Button(mainframe, text="Display Images")
@@ -0,0 +1,121 @@
+"""
+An append-only journal of a story's progress.
+Every change to a line is appended to <path>.journal as one json event, so recording progress costs the same
+however long the story is. The journal is periodically compacted into a <path>.json snapshot, written atomically,
+which is the same list of line dictionaries the story cache has always held.
+Loading replays the journal over the snapshot. A torn last event from a crash is ignored, and events are idempotent,
+so replaying them over a snapshot they are already part of is harmless.
+"""
+
+import json
+import os
+import threading
+
+
+class StoryJournal:
+    """
+    The snapshot and journal for one story.
+    Usage:
+        journal = StoryJournal("storyboard/cache/<file_prefix>")
+        journal.record(0, text="This is the first line.")
+        journal.record(0, audio="storyboard/audio/<file_prefix>/audio_0.mp3")
+        journal.compact()
+    """
+
+    def __init__(self, path, compact_every=1000):
+        """
+        Args:
+            path: str the snapshot and journal are written to path + ".json" and path + ".journal"
+            compact_every: int events to append before the journal is compacted into the snapshot
+        """
+        self.snapshot_path = f"{path}.json"
+        self.journal_path = f"{path}.journal"
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.lines = self._load()
+        self.events = 0
+        self.file = open(self.journal_path, "a")
+        if self.file.tell() and not self._ends_with_newline():
+            # end the torn event so the next one starts on its own line
+            self.file.write("\n")
+
+    def _load(self):
+        lines = []
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as snapshot:
+                lines = json.load(snapshot)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as journal:
+                for event in journal:
+                    try:
+                        event = json.loads(event)
+                    except json.JSONDecodeError:
+                        # the process died halfway through writing this event
+                        continue
+                    self._apply(lines, event["index"], event["fields"])
+        return lines
+
+    def _ends_with_newline(self):
+        with open(self.journal_path, "rb") as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b"\n"
+
+    @staticmethod
+    def _apply(lines, index, fields):
+        while len(lines) <= index:
+            lines.append({})
+        lines[index].update(fields)
+
+    def record(self, index, **fields):
+        """
+        Appends an event setting fields on one line.
+        Args:
+            index: int the index of the line in the story
+            **fields: json serializable values to set on the line
+        Returns:
+            None
+        """
+        with self.lock:
+            self._apply(self.lines, index, fields)
+            self.file.write(json.dumps({"index": index, "fields": fields}, default=str) + "\n")
+            self.file.flush()
+            self.events += 1
+            if self.events >= self.compact_every:
+                self._compact()
+
+    def replace(self, lines):
+        """
+        Replaces every line at once, e.g. after the story's text has been re-diffed, and compacts.
+        Args:
+            lines: list of dict the new lines
+        Returns:
+            None
+        """
+        with self.lock:
+            self.lines = [dict(line) for line in lines]
+            self._compact()
+
+    def compact(self):
+        """
+        Writes every line to the snapshot and empties the journal.
+        Returns:
+            None
+        """
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        temporary = f"{self.snapshot_path}.tmp"
+        with open(temporary, "w") as snapshot:
+            json.dump(self.lines, snapshot, default=str)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.snapshot_path)
+        # a crash before the truncate only means replaying events the snapshot already holds
+        self.file.close()
+        self.file = open(self.journal_path, "w")
+        self.events = 0
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,151 @@
+"""
+A threaded producer/consumer pipeline for the storyboard.
+Items flow from a source through a chain of stages connected by bounded queues, so a fast stage never runs more than
+queue_size items ahead of a slow one and memory stays bounded however long the story is.
+Each stage runs its own pool of worker threads and can pull several items at once to work on them as a batch.
+A failure never stalls the pipeline: the failed items are passed on unchanged, and the first exception is raised to
+the caller once every item has left the pipeline.
+"""
+
+import threading
+from dataclasses import dataclass, field
+from queue import Queue
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of the pipeline.
+    Attributes:
+        name: str used when reporting failures
+        func: callable that takes a list of items and returns the list of items to pass on
+        workers: int how many threads run func concurrently
+        batch_size: int the most items handed to func at once, a worker never waits for a batch to fill up
+        skip: callable that takes an item and returns True when it should bypass func, e.g. when it is cached
+    """
+
+    name: str
+    func: callable
+    workers: int = 1
+    batch_size: int = 1
+    skip: callable = None
+    _remaining: int = field(default=0, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+
+class Pipeline:
+    """
+    Runs items through a list of stages.
+    Usage:
+        pipeline = Pipeline([Stage("audio", make_audio, workers=8), Stage("images", make_images, batch_size=4)])
+        for item in pipeline.run(lines):
+            ...
+    """
+
+    def __init__(self, stages, queue_size=16):
+        """
+        Args:
+            stages: list of Stage
+            queue_size: int the most items waiting in front of each stage
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, source):
+        """
+        Feeds the source through every stage.
+        Args:
+            source: an iterable of items, consumed on its own thread
+        Returns:
+            a generator of items as they leave the last stage, which is not necessarily the order of the source
+        Raises:
+            the first exception raised by the source or by a stage's func, after the last item was yielded
+        """
+        queues = [Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        errors = []
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0], errors), daemon=True)]
+        for position, stage in enumerate(self.stages):
+            stage._remaining = stage.workers
+            consumers = self.stages[position + 1].workers if position + 1 < len(self.stages) else 1
+            threads.extend(
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[position], queues[position + 1], consumers, errors),
+                    daemon=True,
+                )
+                for _ in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            yield item
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _feed(self, source, outbox, errors):
+        try:
+            for item in source:
+                outbox.put(item)
+        except Exception as e:
+            print(e)
+            print("The pipeline source failed, finishing the items already queued")
+            errors.append(e)
+        finally:
+            for _ in range(self.stages[0].workers if self.stages else 1):
+                outbox.put(_DONE)
+
+    @staticmethod
+    def _skip(stage, item):
+        if stage.skip is None:
+            return False
+        try:
+            return stage.skip(item)
+        except Exception as e:
+            print(e)
+            print(f"The {stage.name} stage could not tell whether to skip an item, running it")
+            return False
+
+    @classmethod
+    def _work(cls, stage, inbox, outbox, consumers, errors):
+        try:
+            done = False
+            while not done:
+                batch = []
+                item = inbox.get()
+                while True:
+                    if item is _DONE:
+                        done = True
+                        break
+                    if cls._skip(stage, item):
+                        outbox.put(item)
+                    else:
+                        batch.append(item)
+                    if len(batch) >= stage.batch_size or inbox.empty():
+                        break
+                    item = inbox.get()
+                if not batch:
+                    continue
+                try:
+                    results = list(stage.func(batch))
+                except Exception as e:
+                    print(e)
+                    print(f"The {stage.name} stage failed for {len(batch)} items, passing them on unchanged")
+                    errors.append(e)
+                    results = batch
+                for result in results:
+                    outbox.put(result)
+        finally:
+            with stage._lock:
+                stage._remaining -= 1
+                last = stage._remaining == 0
+            if last:
+                # the last worker out tells every worker of the next stage to stop, however it got out
+                for _ in range(consumers):
+                    outbox.put(_DONE)
@@ -0,0 +1,92 @@
+"""
+A semantic cache of rendered prompts for the storyboard.
+Many lines end up with nearly the same prompt once the global prefix and suffix are attached. Every rendered prompt's
+CLIP text embedding is remembered along with the asset cache key of its image, before the caption is drawn on it,
+so a new prompt close enough to one already rendered can reuse that image instead of being sampled from noise.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class SemanticPromptCache:
+    """
+    Prompt embeddings and the images they rendered, grouped by scope so images rendered with different
+    sampling options, sizes or checkpoints are never mixed up.
+    Usage:
+        cache = SemanticPromptCache()
+        key, similarity = cache.lookup(embedding, scope, threshold=0.95)
+        cache.add(key, scope, embedding)
+    """
+
+    def __init__(self, path="storyboard/prompt_cache.jsonl"):
+        """
+        Args:
+            path: str the jsonl file the embeddings are appended to
+        """
+        self.path = path
+        self.scopes = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.scopes is not None:
+            return
+        self.scopes = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as cache:
+                for entry in cache:
+                    try:
+                        entry = json.loads(entry)
+                    except json.JSONDecodeError:
+                        continue
+                    self._add(entry["key"], entry["scope"], np.asarray(entry["embedding"], dtype=np.float32))
+
+    def _add(self, key, scope, embedding):
+        keys, embeddings, _ = self.scopes.get(scope, ([], [], None))
+        keys.append(key)
+        embeddings.append(embedding / (np.linalg.norm(embedding) or 1.0))
+        # the stacked matrix is rebuilt on the next lookup
+        self.scopes[scope] = (keys, embeddings, None)
+
+    def lookup(self, embedding, scope, threshold):
+        """
+        Finds the closest prompt rendered in the same scope.
+        Args:
+            embedding: np.ndarray the new prompt's embedding
+            scope: str the rendering options the image must have been made with
+            threshold: float the cosine similarity a cached prompt needs to be reused
+        Returns:
+            tuple: the cached image's asset key, or None if nothing is within threshold, and the best similarity
+        """
+        with self.lock:
+            self._load()
+            if scope not in self.scopes:
+                return None, 0.0
+            keys, embeddings, matrix = self.scopes[scope]
+            if matrix is None:
+                matrix = np.stack(embeddings)
+                self.scopes[scope] = (keys, embeddings, matrix)
+        similarities = matrix @ (embedding / (np.linalg.norm(embedding) or 1.0))
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        return (keys[best] if similarity >= threshold else None), similarity
+
+    def add(self, key, scope, embedding):
+        """
+        Remembers a rendered prompt.
+        Args:
+            key: str the asset cache key of the image it rendered
+            scope: str the rendering options it was rendered with
+            embedding: np.ndarray the prompt's embedding
+        Returns:
+            None
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            self._load()
+            self._add(key, scope, embedding)
+            with open(self.path, "a") as cache:
+                cache.write(json.dumps({"key": key, "scope": scope, "embedding": embedding.tolist()}) + "\n")
@@ -0,0 +1,61 @@
+"""
+Semantic scene grouping for the storyboard.
+Consecutive lines often describe the same scene. Lines are embedded with the CLIP text encoder the image model is
+conditioned on, and runs of adjacent lines that stay close to the scene they open are merged into one shot, so
+a shot costs one image however many lines it holds.
+"""
+
+import numpy as np
+
+
+def embed_texts(encoder, texts, batch_size=32):
+    """
+    Embeds texts with a FrozenCLIPEmbedder's pooled output.
+    Args:
+        encoder: FrozenCLIPEmbedder, e.g. the cond_stage_model of the loaded txt2img model
+        texts: list of str
+        batch_size: int how many texts go through the encoder at once
+    Returns:
+        np.ndarray of shape (len(texts), dim), every row normalized to unit length
+    """
+    import torch
+
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(texts), batch_size):
+            tokens = encoder.tokenizer(
+                list(texts[start:start + batch_size]),
+                truncation=True,
+                max_length=encoder.max_length,
+                padding="max_length",
+                return_tensors="pt",
+            )["input_ids"].to(encoder.device)
+            pooled = encoder.transformer(input_ids=tokens).pooler_output.float()
+            embeddings.append(torch.nn.functional.normalize(pooled, dim=-1).cpu().numpy())
+    return np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+
+
+def group_scenes(embeddings, threshold, max_lines=8):
+    """
+    Splits a sequence of embeddings into runs of semantically similar neighbours.
+    A line joins the current scene when its cosine similarity to the mean of the scene's lines is at least
+    threshold, so a scene can drift slowly but not jump.
+    Args:
+        embeddings: np.ndarray of unit length rows, in story order
+        threshold: float the cosine similarity a line needs to join the scene before it
+        max_lines: int the most lines one scene may hold
+    Returns:
+        list of lists of row indices, one list per scene
+    """
+    scenes = []
+    total = None
+    for position, embedding in enumerate(embeddings):
+        if scenes and len(scenes[-1]) < max_lines:
+            similarity = float(total @ embedding) / (np.linalg.norm(total) or 1.0)
+            if similarity >= threshold:
+                scenes[-1].append(position)
+                total = total + embedding
+                continue
+        scenes.append([position])
+        total = np.array(embedding, dtype=np.float64)
+    return scenes
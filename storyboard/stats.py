@@ -0,0 +1,146 @@
+"""
+Per line, per stage timings for the storyboard pipeline.
+Stages run on their own threads, so cpu time is measured with the calling thread's clock and only counts
+the work done for that line. The report is written as json and csv next to the final video.
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+FIELDS = ["stage", "index", "wall", "cpu", "bytes", "cache", "batch"]
+
+
+class PipelineStats:
+    """
+    Collects one record per line per stage.
+    Usage:
+        stats = PipelineStats()
+        with stats.measure("audio", index) as record:
+            record["bytes"] = write_audio()
+        stats.write("storyboard/final_video/<file_prefix>")
+    """
+
+    def __init__(self):
+        self.records = []
+        self.settings = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def record(self, stage, index, wall=0.0, cpu=0.0, bytes=0, cache=None, batch=1):
+        """
+        Adds one record.
+        Args:
+            stage: str e.g. audio, sampling, decode, save, overlay or video
+            index: int the index of the line in the story, -1 for work done once for the whole story
+            wall: float seconds of wall clock time
+            cpu: float seconds of cpu time
+            bytes: int bytes written to disk
+            cache: "hit", "miss" or None when the stage has no cache
+            batch: int how many lines shared the work, wall and cpu are this line's share
+        Returns:
+            dict the record
+        """
+        record = dict(stage=stage, index=index, wall=wall, cpu=cpu, bytes=bytes, cache=cache, batch=batch)
+        with self.lock:
+            self.records.append(record)
+        return record
+
+    def set(self, **settings):
+        """
+        Notes settings the run was made with, e.g. a cache's threshold, so the report can be read against them.
+        """
+        with self.lock:
+            self.settings.update(settings)
+
+    @contextmanager
+    def measure(self, stage, index, **fields):
+        """
+        Times the body of the with statement. The yielded record can be updated with bytes and cache.
+        """
+        record = dict(bytes=0, cache=None, batch=1, **fields)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            self.record(
+                stage,
+                index,
+                wall=time.perf_counter() - wall,
+                cpu=time.thread_time() - cpu,
+                **record,
+            )
+
+    def summary(self, slowest=5):
+        """
+        Totals for the run and for every stage.
+        Args:
+            slowest: int how many of the slowest stages and line records to include
+        Returns:
+            dict
+        """
+        with self.lock:
+            records = list(self.records)
+        elapsed = time.perf_counter() - self.start
+        lines = len({r["index"] for r in records if r["index"] >= 0})
+        stages = {}
+        for r in records:
+            stage = stages.setdefault(
+                r["stage"], dict(wall=0.0, cpu=0.0, bytes=0, lines=0, hits=0, misses=0)
+            )
+            stage["wall"] += r["wall"]
+            stage["cpu"] += r["cpu"]
+            stage["bytes"] += r["bytes"]
+            stage["lines"] += 1
+            stage["hits"] += r["cache"] == "hit"
+            stage["misses"] += r["cache"] == "miss"
+        for stage in stages.values():
+            lookups = stage["hits"] + stage["misses"]
+            stage["hit_rate"] = stage["hits"] / lookups if lookups else None
+        return dict(
+            elapsed=elapsed,
+            lines=lines,
+            lines_per_minute=lines / elapsed * 60 if elapsed else 0.0,
+            settings=dict(self.settings),
+            stages=stages,
+            slowest_stages=sorted(stages, key=lambda s: stages[s]["wall"], reverse=True)[:slowest],
+            slowest_records=sorted(records, key=lambda r: r["wall"], reverse=True)[:slowest],
+        )
+
+    def write(self, directory):
+        """
+        Writes stats.json, with the summary and every record, and stats.csv, with every record.
+        Args:
+            directory: str usually the final video's directory
+        Returns:
+            dict the summary
+        """
+        os.makedirs(directory, exist_ok=True)
+        summary = self.summary()
+        with self.lock:
+            records = sorted(self.records, key=lambda r: (r["index"], r["stage"]))
+        with open(os.path.join(directory, "stats.json"), "w") as report:
+            json.dump(dict(summary=summary, records=records), report, indent=2)
+        with open(os.path.join(directory, "stats.csv"), "w", newline="") as report:
+            writer = csv.DictWriter(report, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        return summary
+
+
+def print_summary(summary):
+    print(f"{summary['lines']} lines in {summary['elapsed']:.1f} seconds, {summary['lines_per_minute']:.2f} lines/minute")
+    # every stage, slowest first, so no cache's hit rate is left out
+    for name in sorted(summary["stages"], key=lambda name: summary["stages"][name]["wall"], reverse=True):
+        stage = summary["stages"][name]
+        cache = (
+            f", {stage['hits']} cache hits, {stage['misses']} misses ({stage['hit_rate']:.0%} hit rate)"
+            if stage["hit_rate"] is not None
+            else ""
+        )
+        print(f"  {name}: {stage['wall']:.1f}s wall, {stage['cpu']:.1f}s cpu over {stage['lines']} lines{cache}")
+    for name, value in summary["settings"].items():
+        print(f"  {name}: {value}")
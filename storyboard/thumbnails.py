@@ -0,0 +1,145 @@
+"""
+Thumbnails for browsing a storyboard's images.
+Thumbnails are written to a disk cache keyed by the image's path, modification time and the thumbnail size, so each
+image is only decoded at full size once, and a regenerated image gets a new thumbnail. Pages of thumbnails are loaded
+on a background thread, and only the page on screen and the one prefetched after it are kept in memory.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from storyboard.asset_cache import asset_key
+
+
+class ThumbnailCache:
+    """
+    Thumbnails of images, written once to root and read back from there.
+    Usage:
+        thumbnails = ThumbnailCache()
+        image = thumbnails.get("outputs/txt2img-samples/image_<file_prefix>_image_<line id>.png")
+    """
+
+    def __init__(self, root="storyboard/thumbnails", size=(128, 128)):
+        """
+        Args:
+            root: str the directory the thumbnails are kept in
+            size: (width, height) the most a thumbnail may measure
+        """
+        self.root = root
+        self.size = tuple(size)
+
+    def path(self, image_path):
+        """
+        The thumbnail's path, which changes whenever the image or the thumbnail size does.
+        """
+        stat = os.stat(image_path)
+        key = asset_key(path=os.path.abspath(image_path), mtime=stat.st_mtime, size=self.size)
+        return os.path.join(self.root, f"{key}.png")
+
+    def get(self, image_path):
+        """
+        Loads an image's thumbnail, making it first if it is not cached.
+        Args:
+            image_path: str the full size image
+        Returns:
+            PIL.Image.Image the thumbnail, fully loaded so its file is closed
+        """
+        path = self.path(image_path)
+        if os.path.exists(path):
+            with Image.open(path) as thumbnail:
+                thumbnail.load()
+                return thumbnail
+        with Image.open(image_path) as image:
+            # let the decoder downscale while it reads when the format supports it
+            image.draft("RGB", self.size)
+            thumbnail = image.convert("RGB")
+        thumbnail.thumbnail(self.size)
+        os.makedirs(self.root, exist_ok=True)
+        temporary = f"{path}.tmp"
+        thumbnail.save(temporary, format="PNG")
+        os.replace(temporary, path)
+        return thumbnail
+
+
+class ThumbnailPager:
+    """
+    Pages through the thumbnails of a list of images, loading each page on a background thread.
+    Usage:
+        pager = ThumbnailPager(ThumbnailCache(), image_paths, page_size=10)
+        pager.request(0, on_page)  # on_page(0, thumbnails) is called from the loading thread
+    """
+
+    def __init__(self, cache, paths, page_size=10):
+        """
+        Args:
+            cache: ThumbnailCache
+            paths: list of str the images to page through
+            page_size: int how many thumbnails one page holds
+        """
+        self.cache = cache
+        self.paths = list(paths)
+        self.page_size = page_size
+        self.pages = {}
+        self.loading = {}
+        self.current = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.paths) // self.page_size))
+
+    def request(self, page, callback):
+        """
+        Makes page the current page and calls callback(page, thumbnails) once it is loaded, then prefetches
+        the page after it. Every other page is dropped from memory.
+        Args:
+            page: int the page to show
+            callback: callable, called from the loading thread or, if the page is already loaded, right away
+        Returns:
+            None
+        """
+        page = min(max(page, 0), self.page_count - 1)
+        with self.lock:
+            self.current = page
+            keep = {page, page + 1}
+            for stale in [p for p in self.pages if p not in keep]:
+                del self.pages[stale]
+            loaded = self.pages.get(page)
+        if loaded is not None:
+            callback(page, loaded)
+        else:
+            self._load(page).add_done_callback(lambda future: self._deliver(page, future, callback))
+        if page + 1 < self.page_count:
+            self._load(page + 1)
+
+    def _load(self, page):
+        with self.lock:
+            if page not in self.loading:
+                self.loading[page] = self.executor.submit(self._read, page)
+            return self.loading[page]
+
+    def _read(self, page):
+        thumbnails = []
+        for path in self.paths[page * self.page_size:(page + 1) * self.page_size]:
+            try:
+                thumbnails.append((path, self.cache.get(path)))
+            except Exception as e:
+                print(e)
+                print(f"Could not make a thumbnail of {path}")
+        with self.lock:
+            del self.loading[page]
+            if page in (self.current, self.current + 1):
+                self.pages[page] = thumbnails
+        return thumbnails
+
+    def _deliver(self, page, future, callback):
+        # only the page the user is still looking at is shown
+        if page == self.current and future.exception() is None:
+            callback(page, future.result())
+
+    def close(self):
+        self.executor.shutdown(wait=False)
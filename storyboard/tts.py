@@ -0,0 +1,98 @@
+"""
+Text to speech backends for the storyboard.
+A backend turns one line of text into one audio file. Story.generate_audio runs a backend over every line
+in a bounded worker pool, so any backend has to be safe to call from several threads at once.
+"""
+
+import math
+import time
+import wave
+from array import array
+from dataclasses import dataclass
+
+
+class TTSBackend:
+    """
+    The interface every text to speech backend implements.
+    """
+
+    extension = ".mp3"
+
+    def save(self, text, path):
+        """
+        Synthesizes the text and writes it to path.
+        Args:
+            text: str the text to speak
+            path: str the file to write, ending in the backend's extension
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+
+@dataclass
+class GTTSBackend(TTSBackend):
+    """
+    Google Translate's text to speech, one network round trip per line.
+    """
+
+    lang: str = "en"
+    extension = ".mp3"
+
+    def save(self, text, path):
+        from gtts import gTTS
+
+        gTTS(text=text, lang=self.lang).save(path)
+
+
+@dataclass
+class LocalTTSBackend(TTSBackend):
+    """
+    An offline stand-in that writes a quiet tone lasting as long as the text would take to read aloud.
+    latency simulates the round trip of a remote backend so the audio stage can be benchmarked without network.
+    """
+
+    words_per_minute: int = 150
+    sample_rate: int = 22050
+    frequency: int = 220
+    latency: float = 0.0
+    extension = ".wav"
+
+    def save(self, text, path):
+        if self.latency:
+            time.sleep(self.latency)
+        seconds = max(len(text.split()), 1) * 60 / self.words_per_minute
+        step = 2 * math.pi * self.frequency / self.sample_rate
+        samples = array(
+            "h", (int(2000 * math.sin(step * i)) for i in range(int(seconds * self.sample_rate)))
+        )
+        with wave.open(path, "wb") as audio:
+            audio.setnchannels(1)
+            audio.setsampwidth(2)
+            audio.setframerate(self.sample_rate)
+            audio.writeframes(samples.tobytes())
+
+
+def synthesize(backend, text, path, retries=3, backoff=1.0):
+    """
+    Runs the backend for one line, retrying with a growing delay when it fails.
+    Args:
+        backend: TTSBackend
+        text: str the text to speak
+        path: str the file to write
+        retries: int how many attempts to make before giving up
+        backoff: float seconds to wait after the first failure, doubled after each one
+    Returns:
+        path
+    Raises:
+        the last exception raised by the backend once every attempt has failed
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            backend.save(text, path)
+            return path
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"Attempt {attempt} to generate {path} failed: {e}, retrying")
+            time.sleep(backoff * 2 ** (attempt - 1))
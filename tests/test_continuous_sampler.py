@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+import torch
+
+from ldm.models.diffusion.continuous import ContinuousDDIMSampler
+from ldm.models.diffusion.ddim import DDIMSampler
+from ldm.modules.diffusionmodules.util import make_beta_schedule
+
+
+class StubModel:
+    """
+    The schedule of the v1 inference config and a cheap, deterministic noise prediction that depends on x, t and c.
+    """
+
+    num_timesteps = 1000
+    parameterization = "eps"
+    device = torch.device("cpu")
+
+    def __init__(self):
+        betas = make_beta_schedule("linear", self.num_timesteps, linear_start=0.00085, linear_end=0.0120)
+        alphas_cumprod = np.cumprod(1. - betas, axis=0)
+        self.betas = torch.tensor(betas, dtype=torch.float32)
+        self.alphas_cumprod = torch.tensor(alphas_cumprod, dtype=torch.float32)
+        self.alphas_cumprod_prev = torch.tensor(np.append(1., alphas_cumprod[:-1]), dtype=torch.float32)
+
+    def apply_model(self, x, t, c):
+        shift = c.reshape(c.shape[0], -1).mean(dim=1).view(-1, 1, 1, 1)
+        return 0.5 * torch.tanh(x) + shift + t.view(-1, 1, 1, 1).float() / self.num_timesteps
+
+
+class ContinuousDDIMSamplerTest(unittest.TestCase):
+    shape = (4, 8, 8)
+
+    def setUp(self):
+        self.model = StubModel()
+        generator = torch.Generator().manual_seed(0)
+        self.x_T = torch.randn((3, *self.shape), generator=generator)
+        self.cond = torch.randn((3, 5, 6), generator=generator)
+        self.uncond = torch.zeros((3, 5, 6))
+
+    def reference(self, steps, scale):
+        sampler = DDIMSampler(self.model)
+        samples, _ = sampler.sample(
+            steps, len(self.x_T), self.shape, conditioning=self.cond, x_T=self.x_T, eta=0.,
+            unconditional_guidance_scale=scale, unconditional_conditioning=self.uncond, verbose=False,
+        )
+        return samples, len(sampler.ddim_timesteps)
+
+    def continuous(self, steps, scale):
+        sampler = ContinuousDDIMSampler(self.model, max_batch=2)
+        requests = [
+            sampler.submit(sampler.request(x_T, c, uc, steps=steps, scale=scale))
+            for x_T, c, uc in zip(self.x_T, self.cond, self.uncond)
+        ]
+        while not sampler.idle:
+            sampler.step()
+        return requests
+
+    def test_matches_ddim_sampler(self):
+        # 1000 is not a multiple of 30 or 35, make_ddim_timesteps returns one more timestep than steps for them
+        for steps in (20, 30, 35, 50):
+            for scale in (1.0, 7.5):
+                with self.subTest(steps=steps, scale=scale):
+                    reference, length = self.reference(steps, scale)
+                    requests = self.continuous(steps, scale)
+                    self.assertEqual([request.steps for request in requests], [length] * len(requests))
+                    samples = torch.stack([request.x for request in requests])
+                    self.assertLess((samples - reference).abs().max().item(), 1e-3)
+
+
+if __name__ == "__main__":
+    unittest.main()
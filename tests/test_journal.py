@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+
+from storyboard.journal import StoryJournal
+
+
+class StoryJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "story")
+        self.journals = []
+
+    def tearDown(self):
+        for journal in self.journals:
+            journal.close()
+        self.directory.cleanup()
+
+    def open(self, **kwargs):
+        journal = StoryJournal(self.path, **kwargs)
+        self.journals.append(journal)
+        return journal
+
+    def events(self):
+        with open(f"{self.path}.journal", "r") as journal:
+            return [json.loads(event) for event in journal]
+
+    def test_replays_events(self):
+        journal = self.open()
+        journal.record(0, text="first")
+        journal.record(2, text="third")
+        journal.record(0, audio="audio_0.mp3")
+        journal.close()
+        self.assertEqual(
+            self.open().lines, [{"text": "first", "audio": "audio_0.mp3"}, {}, {"text": "third"}]
+        )
+
+    def test_ignores_torn_last_event(self):
+        journal = self.open()
+        journal.record(0, text="first")
+        journal.record(1, text="second")
+        journal.close()
+        with open(f"{self.path}.journal", "a") as torn:
+            torn.write('{"index": 1, "fields": {"audio": "aud')
+
+        journal = self.open()
+        self.assertEqual(journal.lines, [{"text": "first"}, {"text": "second"}])
+        # the next event starts on its own line instead of being glued to the torn one
+        journal.record(1, audio="audio_1.mp3")
+        journal.close()
+        self.assertEqual(self.open().lines, [{"text": "first"}, {"text": "second", "audio": "audio_1.mp3"}])
+
+    def test_compact_writes_snapshot_and_empties_journal(self):
+        journal = self.open()
+        journal.record(0, text="first")
+        journal.record(1, text="second")
+        journal.compact()
+        self.assertEqual(self.events(), [])
+        with open(f"{self.path}.json", "r") as snapshot:
+            self.assertEqual(json.load(snapshot), [{"text": "first"}, {"text": "second"}])
+        self.assertFalse(os.path.exists(f"{self.path}.json.tmp"))
+
+        journal.record(1, audio="audio_1.mp3")
+        journal.close()
+        self.assertEqual(self.open().lines, [{"text": "first"}, {"text": "second", "audio": "audio_1.mp3"}])
+
+    def test_compacts_every_n_events(self):
+        journal = self.open(compact_every=3)
+        for index in range(7):
+            journal.record(index, text=str(index))
+        # two compactions after the third and sixth events, the seventh is still in the journal
+        self.assertEqual(self.events(), [{"index": 6, "fields": {"text": "6"}}])
+        with open(f"{self.path}.json", "r") as snapshot:
+            self.assertEqual(len(json.load(snapshot)), 6)
+        journal.close()
+        self.assertEqual(self.open().lines, [{"text": str(index)} for index in range(7)])
+
+    def test_replay_over_snapshot_is_idempotent(self):
+        journal = self.open()
+        journal.record(0, text="first")
+        journal.record(0, text="changed")
+        journal.close()
+        # a crash between writing the snapshot and truncating the journal leaves events the snapshot holds
+        with open(f"{self.path}.json", "w") as snapshot:
+            json.dump([{"text": "changed"}], snapshot)
+        self.assertEqual(self.open().lines, [{"text": "changed"}])
+
+    def test_replace_compacts(self):
+        journal = self.open()
+        journal.record(0, text="first")
+        journal.replace([{"text": "new"}, {"text": "lines"}])
+        self.assertEqual(self.events(), [])
+        journal.close()
+        self.assertEqual(self.open().lines, [{"text": "new"}, {"text": "lines"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import threading
+import time
+import unittest
+
+from storyboard.pipeline import Pipeline, Stage
+
+
+def add(amount):
+    def func(batch):
+        return [item + amount for item in batch]
+    return func
+
+
+def run_with_timeout(pipeline, source, timeout=10):
+    """
+    Drains the pipeline on another thread so a stalled pipeline fails the test instead of hanging it.
+    """
+    items, errors = [], []
+
+    def drain():
+        try:
+            for item in pipeline.run(source):
+                items.append(item)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise AssertionError("the pipeline did not finish")
+    return items, errors
+
+
+class PipelineTest(unittest.TestCase):
+    def test_done_reaches_every_stage(self):
+        stages = [
+            Stage("first", add(1), workers=3, batch_size=2),
+            Stage("second", add(10), workers=1),
+            Stage("third", add(100), workers=4, batch_size=3),
+        ]
+        items, errors = run_with_timeout(Pipeline(stages, queue_size=2), range(50))
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(items), [item + 111 for item in range(50)])
+
+    def test_empty_source(self):
+        stages = [Stage("first", add(1), workers=2), Stage("second", add(1), workers=3)]
+        items, errors = run_with_timeout(Pipeline(stages), [])
+        self.assertEqual((items, errors), ([], []))
+
+    def test_skipped_items_bypass_func(self):
+        stages = [Stage("first", add(1), skip=lambda item: item % 2 == 0)]
+        items, errors = run_with_timeout(Pipeline(stages), range(10))
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(items), sorted(item if item % 2 == 0 else item + 1 for item in range(10)))
+
+    def test_stage_failure_reaches_caller(self):
+        def fail_on_three(batch):
+            if 3 in batch:
+                raise ValueError("three")
+            return [item * 2 for item in batch]
+
+        stages = [Stage("failing", fail_on_three, workers=2), Stage("last", add(0), workers=2)]
+        items, errors = run_with_timeout(Pipeline(stages, queue_size=1), range(10))
+        # the failed item is passed on unchanged and every other item still makes it through
+        self.assertEqual(sorted(items), sorted(3 if item == 3 else item * 2 for item in range(10)))
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ValueError)
+
+    def test_error_is_raised_after_the_last_item(self):
+        def fail_on_zero(batch):
+            if 0 in batch:
+                raise ValueError("zero")
+            return batch
+
+        seen = []
+        with self.assertRaises(ValueError):
+            for item in Pipeline([Stage("failing", fail_on_zero)]).run(range(5)):
+                seen.append(item)
+        self.assertEqual(seen, list(range(5)))
+
+    def test_source_failure_reaches_caller(self):
+        def source():
+            yield 1
+            yield 2
+            raise RuntimeError("source")
+
+        stages = [Stage("first", add(1), workers=2), Stage("second", add(1))]
+        items, errors = run_with_timeout(Pipeline(stages), source())
+        self.assertEqual(sorted(items), [3, 4])
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], RuntimeError)
+
+    def test_single_workers_keep_order(self):
+        def slow(batch):
+            time.sleep(0.001)
+            return batch
+
+        stages = [Stage("first", slow), Stage("second", add(0)), Stage("third", slow)]
+        items, errors = run_with_timeout(Pipeline(stages, queue_size=1), range(100))
+        self.assertEqual(errors, [])
+        self.assertEqual(items, list(range(100)))
+
+    def test_queues_bound_the_source(self):
+        queue_size = 2
+        pulled = []
+        release = threading.Event()
+
+        def source():
+            for item in range(100):
+                pulled.append(item)
+                yield item
+
+        def blocked(batch):
+            release.wait()
+            return batch
+
+        pipeline = Pipeline([Stage("blocked", blocked)], queue_size=queue_size)
+        items = pipeline.run(source())
+        thread = threading.Thread(target=lambda: items.__next__(), daemon=True)
+        thread.start()
+        time.sleep(0.2)
+        # one item held by the worker, queue_size waiting for it and one blocked on the full queue
+        self.assertLessEqual(len(pulled), queue_size + 2)
+        release.set()
+        thread.join(10)
+        self.assertEqual([next(items)] + list(items), list(range(1, 100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+
+from storyboard.cya import PipelineContext, Story
+
+
+class StubParaphraser:
+    """
+    Records the lines it is asked to paraphrase and returns them upper cased.
+    """
+
+    batch_size = 2
+
+    def __init__(self):
+        self.calls = []
+
+    def paraphrase_lines(self, lines):
+        self.calls.extend(lines)
+        return [line.upper() for line in lines]
+
+
+class StoryEditTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        # the story keeps its journal, catalog and caches under storyboard/ in the working directory
+        os.chdir(self.directory.name)
+        os.makedirs("storyboard/cache")
+        self.stories = []
+
+    def tearDown(self):
+        for story in self.stories:
+            if story.journal is not None:
+                story.journal.close()
+            story.catalog.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def write(self, lines):
+        with open("story.txt", "w") as text:
+            text.write("".join(f"{line}\n" for line in lines))
+
+    def story(self, resume=None):
+        paraphraser = StubParaphraser()
+        story = Story("story.txt", context=PipelineContext(paraphraser=paraphraser))
+        self.stories.append(story)
+        if resume is not None:
+            story.resume(resume)
+        return story, paraphraser
+
+    def run_text(self, story):
+        lines = dict(story.iter_lines())
+        # a stand in for the audio stage, every line it sees gets an asset named after its text
+        for index, line in lines.items():
+            if "audio" not in line:
+                story.update_line(index, audio=f"{line['text']}.mp3")
+        story.journal.close()
+        return [line for line in story.story_dict if "text" in line]
+
+    def test_first_run_paraphrases_every_line(self):
+        self.write(["one", "two", "three"])
+        story, paraphraser = self.story()
+        lines = self.run_text(story)
+        self.assertEqual(paraphraser.calls, ["one", "two", "three"])
+        self.assertEqual([line["text"] for line in lines], ["ONE", "TWO", "THREE"])
+
+    def test_resume_regenerates_only_changed_and_inserted_lines(self):
+        self.write(["one", "two", "three"])
+        story, _ = self.story()
+        self.run_text(story)
+
+        self.write(["zero", "one", "two!", "three"])
+        resumed, paraphraser = self.story(resume=story.id)
+        lines = self.run_text(resumed)
+        self.assertEqual(paraphraser.calls, ["zero", "two!"])
+        self.assertEqual([line["text"] for line in lines], ["ZERO", "ONE", "TWO!", "THREE"])
+        # the unchanged lines kept the assets of the first run wherever they moved to
+        self.assertEqual(
+            [line["audio"] for line in lines], ["ZERO.mp3", "ONE.mp3", "TWO!.mp3", "THREE.mp3"]
+        )
+        self.assertEqual(lines[1]["id"], story.story_dict[0]["id"])
+        self.assertEqual(lines[3]["id"], story.story_dict[2]["id"])
+
+    def test_resume_drops_deleted_lines(self):
+        self.write(["one", "two", "three"])
+        story, _ = self.story()
+        self.run_text(story)
+
+        self.write(["one", "three"])
+        resumed, paraphraser = self.story(resume=story.id)
+        lines = self.run_text(resumed)
+        self.assertEqual(paraphraser.calls, [])
+        self.assertEqual([line["text"] for line in lines], ["ONE", "THREE"])
+
+    def test_repeated_lines_get_distinct_ids(self):
+        ids = Story.line_ids(["same", "other", "same"])
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(ids[2], f"{ids[0]}_1")
+
+    def test_resume_replays_a_torn_journal(self):
+        self.write(["one", "two"])
+        story, _ = self.story()
+        self.run_text(story)
+        # a later run died while recording the audio of the second line
+        story.journal = None
+        journal = story.get_journal()
+        journal.record(0, audio="redone.mp3")
+        journal.file.write('{"index": 1, "fields": {"audio": "tor')
+        journal.close()
+
+        self.write(["one", "two"])
+        resumed, paraphraser = self.story(resume=story.id)
+        lines = self.run_text(resumed)
+        self.assertEqual(paraphraser.calls, [])
+        self.assertEqual([line["audio"] for line in lines], ["redone.mp3", "TWO.mp3"])
+
+
+if __name__ == "__main__":
+    unittest.main()